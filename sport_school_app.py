@@ -5,7 +5,11 @@ Sports DB — шаг 7+: поиск + скроллы + пагинация + по
 Запуск: py sports_app_step7.py
 """
 
-import os, io, csv, sqlite3, datetime
+import os, io, sys, csv, json, gzip, shutil, sqlite3, datetime, time, pathlib, tempfile, threading
+import asyncio, hashlib, socket, urllib.parse
+from collections import deque, OrderedDict
+from itertools import groupby
+from contextlib import contextmanager
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from datetime import datetime as dt
@@ -17,6 +21,13 @@ try:
 except Exception:
     HAS_XLSX = False
 
+# --- NumPy для колоночных отчётов (опционально, без него всё считает SQL)
+try:
+    import numpy as np  # type: ignore
+    HAS_NUMPY = True
+except Exception:
+    HAS_NUMPY = False
+
 APP_TITLE = "Sports DB — шаг 7+ (Поиск/Пагинация/Карточки/Подсветка)"
 APP_SIZE  = (1180, 780)
 
@@ -25,11 +36,32 @@ LINES  = ["", "Образование", "Спорт"]
 SPORTS = ["", "Ориентирование", "Туризм", "Спартакиада (разное)"]
 MEDALS = ["", "gold", "silver", "bronze"]
 
+# перечисления хранятся кодами из таблиц enum_<вид>: код = позиция в списке выше
+# ('' уровня/линии/вида — «все» — не хранится; медаль '' — код 0, «без медали»).
+# Значения вне списков (старые базы, ручной ввод) получают следующие свободные коды.
+ENUMS = {"level": LEVELS, "line": LINES, "sport": SPORTS, "medal": MEDALS}
+ENUM_COLUMNS = {   # таблица -> {столбец: перечисление}
+    "groups":  {"sport": "sport"},
+    "events":  {"level": "level", "line": "line", "sport": "sport"},
+    "results": {"medal": "medal"},
+}
+
 DB_PATH = "sports.db"
 
+# одна база на несколько операторов (общая папка): чужая блокировка пережидается, чужие правки опрашиваются
+BUSY_TIMEOUT_MS = 5000      # PRAGMA busy_timeout: столько SQLite сам ждёт, пока другой оператор допишет
+WRITE_RETRIES = 3           # потом запись из формы повторяется с паузой (WRITE_RETRY_SEC, 2×, 3×)
+WRITE_RETRY_SEC = 0.5
+EXTERNAL_POLL_MS = 2000     # как часто окно сверяет PRAGMA data_version
+
 SCHEMA_SQL = r"""
 PRAGMA foreign_keys = ON;
 
+CREATE TABLE IF NOT EXISTS enum_level (code INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS enum_line  (code INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS enum_sport (code INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS enum_medal (code INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+
 CREATE TABLE IF NOT EXISTS coaches (
     coach_id INTEGER PRIMARY KEY,
     fio TEXT NOT NULL,
@@ -39,7 +71,7 @@ CREATE TABLE IF NOT EXISTS coaches (
 CREATE TABLE IF NOT EXISTS groups (
     group_id INTEGER PRIMARY KEY,
     name TEXT NOT NULL,
-    sport TEXT NOT NULL,
+    sport INTEGER NOT NULL REFERENCES enum_sport(code),
     coach_id INTEGER,
     FOREIGN KEY (coach_id) REFERENCES coaches(coach_id) ON DELETE RESTRICT
 );
@@ -55,18 +87,20 @@ CREATE TABLE IF NOT EXISTS persons (
     group_id    INTEGER,
     FOREIGN KEY (group_id) REFERENCES groups(group_id) ON DELETE SET NULL
 );
+CREATE INDEX IF NOT EXISTS idx_persons_name ON persons(last_name, first_name);
 
 CREATE TABLE IF NOT EXISTS events (
     event_id INTEGER PRIMARY KEY,
     name TEXT NOT NULL,
     date TEXT NOT NULL,   -- YYYY-MM-DD
-    level TEXT NOT NULL,
-    line  TEXT NOT NULL,
-    sport TEXT NOT NULL,
+    level INTEGER NOT NULL REFERENCES enum_level(code),
+    line  INTEGER NOT NULL REFERENCES enum_line(code),
+    sport INTEGER NOT NULL REFERENCES enum_sport(code),
     location TEXT,
     total_count INTEGER,
     UNIQUE(name, date, location)
 );
+CREATE INDEX IF NOT EXISTS idx_events_date ON events(date);
 
 CREATE TABLE IF NOT EXISTS results (
     result_id INTEGER PRIMARY KEY,
@@ -74,7 +108,7 @@ CREATE TABLE IF NOT EXISTS results (
     person_id  INTEGER NOT NULL,
     category   TEXT NOT NULL DEFAULT '',
     place      INTEGER,
-    medal      TEXT,
+    medal      INTEGER NOT NULL DEFAULT 0 REFERENCES enum_medal(code),
     note       TEXT,
     UNIQUE(event_id, person_id, category),
     FOREIGN KEY (event_id)  REFERENCES events(event_id)   ON DELETE CASCADE,
@@ -82,53 +116,1002 @@ CREATE TABLE IF NOT EXISTS results (
 );
 CREATE INDEX IF NOT EXISTS idx_results_event  ON results(event_id);
 CREATE INDEX IF NOT EXISTS idx_results_person ON results(person_id);
+CREATE INDEX IF NOT EXISTS idx_results_place  ON results(place);
+CREATE INDEX IF NOT EXISTS idx_results_medal  ON results(medal);
+
+-- те же таблицы с названиями вместо кодов перечислений: списки, карточки, экспорт
+CREATE VIEW IF NOT EXISTS groups_named AS
+    SELECT g.group_id, g.name, sp.name AS sport, g.coach_id
+    FROM groups g JOIN enum_sport sp ON sp.code=g.sport;
+CREATE VIEW IF NOT EXISTS events_named AS
+    SELECT e.event_id, e.name, e.date, lv.name AS level, ln.name AS line, sp.name AS sport, e.location, e.total_count
+    FROM events e JOIN enum_level lv ON lv.code=e.level JOIN enum_line ln ON ln.code=e.line JOIN enum_sport sp ON sp.code=e.sport;
+CREATE VIEW IF NOT EXISTS results_named AS
+    SELECT r.result_id, r.event_id, r.person_id, r.category, r.place, md.name AS medal, r.note
+    FROM results r JOIN enum_medal md ON md.code=r.medal;
+
+-- ключи блокировки для поиска дублей участников (PersonDedup): фонетика фамилии/имени, дата рождения.
+-- Сами ключи считаются в Python (lower() в SQLite не знает кириллицу), триггеры лишь помечают
+-- изменённых участников, поэтому таблица остаётся верной и при импорте, и при правке извне
+-- (DELETE + INSERT, а не OR IGNORE: внутри INSERT ... ON CONFLICT импорта OR IGNORE не действует).
+CREATE TABLE IF NOT EXISTS person_keys (
+    key       TEXT NOT NULL,
+    person_id INTEGER NOT NULL REFERENCES persons(person_id) ON DELETE CASCADE,
+    PRIMARY KEY (key, person_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_person_keys_person ON person_keys(person_id);
+CREATE TABLE IF NOT EXISTS person_keys_dirty (person_id INTEGER PRIMARY KEY);
+CREATE TRIGGER IF NOT EXISTS trg_persons_keys_ins AFTER INSERT ON persons BEGIN
+    DELETE FROM person_keys_dirty WHERE person_id=NEW.person_id;
+    INSERT INTO person_keys_dirty(person_id) VALUES (NEW.person_id);
+END;
+CREATE TRIGGER IF NOT EXISTS trg_persons_keys_upd AFTER UPDATE OF last_name, first_name, birthdate ON persons BEGIN
+    DELETE FROM person_keys_dirty WHERE person_id=NEW.person_id;
+    INSERT INTO person_keys_dirty(person_id) VALUES (NEW.person_id);
+END;
+
+-- контрольные точки импорта частями (Importer.import_csv_chunked)
+CREATE TABLE IF NOT EXISTS import_checkpoints (
+    file_hash   TEXT NOT NULL,
+    table_name  TEXT NOT NULL,
+    path        TEXT,
+    byte_offset INTEGER NOT NULL,   -- позиция в файле сразу после последней записанной строки
+    row_no      INTEGER NOT NULL,   -- строк данных обработано
+    inserted INTEGER NOT NULL DEFAULT 0, updated  INTEGER NOT NULL DEFAULT 0,
+    unchanged INTEGER NOT NULL DEFAULT 0, rejected INTEGER NOT NULL DEFAULT 0,
+    done        INTEGER NOT NULL DEFAULT 0,
+    updated_at  TEXT,
+    PRIMARY KEY (file_hash, table_name)
+);
+
+-- закрытые сезоны, перенесённые в отдельные файлы (Store.archive_season)
+CREATE TABLE IF NOT EXISTS archive_seasons (
+    year        INTEGER PRIMARY KEY,
+    path        TEXT NOT NULL,      -- относительно папки основной базы
+    events      INTEGER NOT NULL DEFAULT 0,
+    results     INTEGER NOT NULL DEFAULT 0,
+    archived_at TEXT
+);
 """
 
+# журнал изменений для обмена разностями между установками (Store.delta_since, Importer.import_delta):
+# одна строка на (таблица, id) с номером последней правки (триггеры: DELETE + INSERT — OR REPLACE
+# внутри INSERT ... ON CONFLICT импорта не действует); op 'U' — вставка/изменение, 'D' — удаление
+SYNC_TABLES = {"coaches": "coach_id", "groups": "group_id", "persons": "person_id", "events": "event_id", "results": "result_id"}
+SYNC_REFS = {"groups": {"coach_id": "coaches"}, "persons": {"group_id": "groups"},
+             "results": {"event_id": "events", "person_id": "persons"}}
+SCHEMA_SQL += """
+CREATE TABLE IF NOT EXISTS changelog (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    tbl     TEXT NOT NULL,
+    row_id  INTEGER NOT NULL,
+    op      TEXT NOT NULL CHECK (op IN ('U','D')),
+    UNIQUE (tbl, row_id)
+);
+-- до какой версии журнала разности уже выгружены адресату
+CREATE TABLE IF NOT EXISTS delta_exports (peer TEXT PRIMARY KEY, version INTEGER NOT NULL, exported_at TEXT);
+-- глобальные ключи строк для разностей: id у каждой установки свои, uid строки — один на все.
+-- Вставка получает случайный uid, строке из чужой разности импорт ставит uid источника. Запись
+-- удалённой строки остаётся (по ней выгружается удаление), пока её id не займёт новая строка.
+CREATE TABLE IF NOT EXISTS sync_keys (
+    tbl    TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    uid    INTEGER NOT NULL,
+    PRIMARY KEY (tbl, row_id)
+) WITHOUT ROWID;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_sync_keys_uid ON sync_keys(tbl, uid);
+""" + "".join(f"""CREATE TRIGGER IF NOT EXISTS trg_{t}_log_ins AFTER INSERT ON {t} BEGIN
+    DELETE FROM changelog WHERE tbl='{t}' AND row_id=NEW.{pk};
+    INSERT INTO changelog(tbl,row_id,op) VALUES ('{t}', NEW.{pk}, 'U');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_{t}_log_upd AFTER UPDATE ON {t} BEGIN
+    DELETE FROM changelog WHERE tbl='{t}' AND row_id IN (OLD.{pk}, NEW.{pk});
+    INSERT INTO changelog(tbl,row_id,op) SELECT '{t}', OLD.{pk}, 'D' WHERE OLD.{pk} <> NEW.{pk};
+    INSERT INTO changelog(tbl,row_id,op) VALUES ('{t}', NEW.{pk}, 'U');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_{t}_log_del AFTER DELETE ON {t} BEGIN
+    DELETE FROM changelog WHERE tbl='{t}' AND row_id=OLD.{pk};
+    INSERT INTO changelog(tbl,row_id,op) VALUES ('{t}', OLD.{pk}, 'D');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_{t}_uid_ins AFTER INSERT ON {t} BEGIN
+    DELETE FROM sync_keys WHERE tbl='{t}' AND row_id=NEW.{pk};
+    INSERT INTO sync_keys(tbl,row_id,uid) VALUES ('{t}', NEW.{pk}, random());
+END;
+CREATE TRIGGER IF NOT EXISTS trg_{t}_uid_upd AFTER UPDATE OF {pk} ON {t} WHEN OLD.{pk} <> NEW.{pk} BEGIN
+    DELETE FROM sync_keys WHERE tbl='{t}' AND row_id=NEW.{pk};
+    UPDATE sync_keys SET row_id=NEW.{pk} WHERE tbl='{t}' AND row_id=OLD.{pk};
+END;
+""" for t, pk in SYNC_TABLES.items())
+DELTA_FORMAT = "sports-delta/2"     # /1 переносил строки по id установки-источника
+
+# целочисленные столбцы дат в events (виртуальные, вычисляются из date; добавляет Store._migrate).
+# day — порядковый номер дня, как date.toordinal(); month — YYYYMM. Для неверной даты — NULL.
+EVENT_DATE_COLUMNS = (
+    ("day",   "CAST(julianday(date) - 1721424.5 AS INTEGER)"),
+    ("year",  "CAST(strftime('%Y', date) AS INTEGER)"),
+    ("month", "CAST(strftime('%Y%m', date) AS INTEGER)"),
+)
+EVENT_DATE_INDEXES_SQL = """
+CREATE INDEX IF NOT EXISTS idx_events_day        ON events(day);
+CREATE INDEX IF NOT EXISTS idx_events_year_month ON events(year, month);
+CREATE INDEX IF NOT EXISTS idx_events_sport_day  ON events(sport, day);
+CREATE INDEX IF NOT EXISTS idx_events_line_day   ON events(line, day);
+CREATE INDEX IF NOT EXISTS idx_events_level_day  ON events(level, day);
+"""
+
+# схема архива сезона: те же events/results с кодами перечислений, без внешних ключей
+# (участники остаются в основной базе). {s} — имя подключённой схемы.
+ARCHIVE_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS {s}.events (
+    event_id INTEGER PRIMARY KEY, name TEXT NOT NULL, date TEXT NOT NULL,
+    level INTEGER NOT NULL, line INTEGER NOT NULL, sport INTEGER NOT NULL,
+    location TEXT, total_count INTEGER,
+    """ + ",\n    ".join(f"{n} INTEGER GENERATED ALWAYS AS ({x}) VIRTUAL" for n, x in EVENT_DATE_COLUMNS) + """
+);
+CREATE TABLE IF NOT EXISTS {s}.results (
+    result_id INTEGER PRIMARY KEY, event_id INTEGER NOT NULL, person_id INTEGER NOT NULL,
+    category TEXT NOT NULL DEFAULT '', place INTEGER, medal INTEGER NOT NULL DEFAULT 0, note TEXT,
+    UNIQUE(event_id, person_id, category)
+);
+CREATE INDEX IF NOT EXISTS {s}.idx_results_event  ON results(event_id);
+CREATE INDEX IF NOT EXISTS {s}.idx_results_person ON results(person_id);
+""" + "".join(f"CREATE TABLE IF NOT EXISTS {{s}}.enum_{k} (code INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);\n"
+              for k in ENUMS) + EVENT_DATE_INDEXES_SQL.replace("EXISTS ", "EXISTS {s}.")
+ARCHIVE_EVENT_COLS  = "event_id, name, date, level, line, sport, location, total_count"
+ARCHIVE_RESULT_COLS = "result_id, event_id, person_id, category, place, medal, note"
+ARCHIVE_ATTACH_MAX = 10   # SQLITE_MAX_ATTACHED сборки по умолчанию
+# id из архива в общем представлении: (год << ARCHIVE_ID_SHIFT) + id. Основная база после переноса
+# может снова выдать те же event_id, а соединение results с events должно оставаться внутри своего файла.
+ARCHIVE_ID_SHIFT = 40
+MAIN_TABLES = ("events", "results")
+
+def date_ordinal(s):
+    # 'YYYY-MM-DD' -> номер дня (как events.day); ValueError для другого формата
+    return dt.strptime(s, "%Y-%m-%d").date().toordinal()
+
+# ------------ Фильтр отчётов ------------
+# поле фильтра -> условие по таблице events (порядок фиксирован: от него зависит канонический текст SQL)
+FILTER_FIELDS = (
+    ("date_from", "{a}day >= ?"),
+    ("date_to",   "{a}day <= ?"),
+    ("sport",     "{a}sport = (SELECT code FROM enum_sport WHERE name=?)"),
+    ("line",      "{a}line = (SELECT code FROM enum_line WHERE name=?)"),
+    ("level",     "{a}level = (SELECT code FROM enum_level WHERE name=?)"),
+)
+# поле фильтра -> значение параметра SQL (даты сравниваются по индексу events.day)
+FILTER_PARAMS = {"date_from": date_ordinal, "date_to": date_ordinal}
+
+# измерения для сгруппированных подсчётов (Store.counts_by): SQL и вид значения в ответе
+# (коды перечислений counts_by переводит в названия сам)
+GROUP_DIMS = {
+    "level": "e.level",
+    "line":  "e.line",
+    "sport": "e.sport",
+    "year":  "e.year",
+    "month": "e.month",
+}
+GROUP_DIM_FORMAT = {
+    "year":  lambda v: "—" if v is None else str(v),
+    "month": lambda v: "—" if v is None else f"{v // 100:04d}-{v % 100:02d}",
+}
+COUNT_SOURCES = {
+    "events":  "{events} e",
+    "results": "{results} r JOIN {events} e ON e.event_id=r.event_id",
+}
+
+# списки вкладок (Store.list_page): страница выбирается в SQL — сортировка по любому столбцу и переход
+# дальше по ключу последней строки (keyset), без OFFSET и без загрузки всей таблицы в окно.
+# Столбец: (выражение для показа, ключ сортировки, может ли ключ быть NULL); ключи ФИО, дат, мест
+# и медалей идут по индексам. Ничья по ключу решается первичным ключом pk в том же направлении.
+LIST_VIEWS = {
+    "coaches": {
+        "from": "coaches c", "pk": "c.coach_id", "count": "coaches", "default": (0, False),
+        "columns": [("c.coach_id", ("c.coach_id",), False),
+                    ("c.fio", ("c.fio",), False),
+                    ("COALESCE(c.phone,'')", ("c.phone",), True)],
+    },
+    "persons": {
+        "from": """persons p LEFT JOIN groups g ON g.group_id=p.group_id
+                   LEFT JOIN coaches c ON c.coach_id=g.coach_id""",
+        "pk": "p.person_id", "count": "persons", "default": (0, False),
+        "columns": [("p.person_id", ("p.person_id",), False),
+                    ("p.last_name||' '||p.first_name", ("p.last_name", "p.first_name"), False),
+                    ("COALESCE(p.birthdate,'')", ("p.birthdate",), True),
+                    ("COALESCE(g.name,'—')", ("g.name",), True),
+                    ("COALESCE(c.fio,'—')", ("c.fio",), True),
+                    ("COALESCE(p.phone,'')", ("p.phone",), True),
+                    ("COALESCE(p.address,'')", ("p.address",), True)],
+    },
+    "events": {
+        "from": """events e JOIN enum_level lv ON lv.code=e.level JOIN enum_line ln ON ln.code=e.line
+                   JOIN enum_sport sp ON sp.code=e.sport""",
+        "pk": "e.event_id", "count": "events", "default": (1, True),
+        "columns": [("e.event_id", ("e.event_id",), False),
+                    ("e.date", ("e.date",), False),
+                    ("e.name", ("e.name",), False),
+                    ("lv.name", ("e.level",), False),
+                    ("ln.name", ("e.line",), False),
+                    ("sp.name", ("e.sport",), False),
+                    ("COALESCE(e.location,'')", ("e.location",), True),
+                    ("COALESCE(e.total_count,'')", ("e.total_count",), True),
+                    ("(SELECT COUNT(DISTINCT person_id) FROM results r WHERE r.event_id=e.event_id)",
+                     ("(SELECT COUNT(DISTINCT person_id) FROM results r WHERE r.event_id=e.event_id)",), False)],
+    },
+    "results": {
+        "from": """results r JOIN events e ON e.event_id=r.event_id JOIN persons p ON p.person_id=r.person_id
+                   JOIN enum_medal md ON md.code=r.medal""",
+        "pk": "r.result_id", "count": "results", "default": (1, True),
+        "columns": [("r.result_id", ("r.result_id",), False),
+                    ("e.date", ("e.date",), False),
+                    ("e.name", ("e.name",), False),
+                    ("p.last_name||' '||p.first_name", ("p.last_name", "p.first_name"), False),
+                    ("r.category", ("r.category",), False),
+                    ("COALESCE(r.place,'')", ("r.place",), True),
+                    ("md.name", ("r.medal",), False),
+                    ("COALESCE(r.note,'')", ("r.note",), True)],
+    },
+}
+
+class ReportFilter:
+    # скомпилированный фильтр: «форма» (какие поля заданы) + параметры.
+    # Текст запроса зависит только от формы, поэтому одинаковые по форме фильтры
+    # дают один и тот же SQL и попадают в кэш подготовленных выражений sqlite3.
+    __slots__ = ("shape", "values", "params")
+    _sql_cache = {}
+
+    def __init__(self, flt=None):
+        flt = flt or {}
+        self.shape  = tuple(k for k,_ in FILTER_FIELDS if flt.get(k))
+        self.values = [flt[k] for k in self.shape]
+        self.params = [FILTER_PARAMS[k](v) if k in FILTER_PARAMS else v for k,v in zip(self.shape, self.values)]
+
+    @classmethod
+    def of(cls, flt):
+        return flt if isinstance(flt, cls) else cls(flt)
+
+    def as_dict(self):
+        d = {k: "" for k,_ in FILTER_FIELDS}
+        d.update(zip(self.shape, self.values))
+        return d
+
+    def years(self):
+        # (первый, последний) год диапазона дат фильтра; None — без границы
+        v = dict(zip(self.shape, self.values))
+        return tuple(int(v[k][:4]) if k in v else None for k in ("date_from", "date_to"))
+
+    def sql(self, template, alias="e", tables=MAIN_TABLES):
+        # template: {where} -> "WHERE ..."/"" ; {cond} -> " AND ..."/"" ;
+        # {events}/{results} -> таблицы или представления с архивами (Store._tables)
+        key = (template, alias, self.shape, tables)
+        q = self._sql_cache.get(key)
+        if q is None:
+            a = f"{alias}." if alias else ""
+            conds = [c.format(a=a) for k,c in FILTER_FIELDS if k in self.shape]
+            q = template.format(where=("WHERE " + " AND ".join(conds)) if conds else "",
+                                cond="".join(" AND " + c for c in conds), events=tables[0], results=tables[1])
+            self._sql_cache[key] = q
+        return q
+
+# ------------ Сводный отчёт за сезон ------------
+class SeasonReport:
+    # все агрегаты вкладки «Отчёты» за один проход по events⟕results:
+    # medals=(g,s,b), by_level/by_line как в events_breakdown,
+    # coaches как в medals_by_coach, yearly как в yearly_dynamics
+    def __init__(self, flt, medals, by_level, by_line, coaches, yearly):
+        self.filter   = flt
+        self.medals   = medals
+        self.by_level = by_level
+        self.by_line  = by_line
+        self.coaches  = coaches
+        self.yearly   = yearly
+
+# ------------ Замеры задержек UI ------------
+class UiTrace:
+    # журнал замеров: сколько занял SQL, сборка строк в Python и вставка в Tk
+    COLUMNS = ["ts", "source", "op", "rows", "query_ms", "build_ms", "filter_ms", "insert_ms", "total_ms"]
+
+    def __init__(self, enabled=False, maxlen=20000):
+        self.enabled = enabled
+        self.records = deque(maxlen=maxlen)
+        self.sql_time = 0.0   # накопительное время SQL (его пополняет Store._fetchall)
+
+    def add_sql(self, sec):
+        self.sql_time += sec
+
+    @contextmanager
+    def measure(self, source, op):
+        # замер произвольного блока UI: SQL считается отдельно, остальное — вставка/отрисовка
+        t0 = time.perf_counter(); q0 = self.sql_time
+        box = {"rows": 0}
+        try: yield box
+        finally:
+            query = self.sql_time - q0
+            self.record(source, op, box["rows"], query=query, insert=time.perf_counter()-t0-query)
+
+    def record(self, source, op, rows=0, query=0.0, build=0.0, flt=0.0, insert=0.0):
+        if not self.enabled: return
+        ms = lambda x: round(x*1000, 3)
+        self.records.append([datetime.datetime.now().isoformat(timespec="milliseconds"), source, op, rows,
+                             ms(query), ms(build), ms(flt), ms(insert), ms(query+build+flt+insert)])
+
+    def clear(self):
+        self.records.clear()
+
+    def export_csv(self, path):
+        with io.open(path, "w", encoding="utf-8-sig", newline="") as f:
+            w = csv.writer(f, delimiter=';')
+            w.writerow(self.COLUMNS); w.writerows(self.records)
+        return len(self.records)
+
+# ------------ Колоночный снимок результатов ------------
+def _np_fit(a, n, fill):
+    # массив по id: дорастить до n ячеек (с запасом), новые ячейки = fill
+    if n <= len(a): return a
+    b = np.full(max(n, 2*len(a), 64), fill, dtype=a.dtype); b[:len(a)] = a
+    return b
+
+class ResultColumns:
+    # results в виде массивов NumPy: отчёты считаются масками и bincount без SQL-соединений.
+    # Строка results -> позиция (по возрастанию result_id); соревнования, участники и группы — массивы по id,
+    # поэтому смена группы участника или тренера группы не трогает массивы results.
+    # Запись через методы Store правит снимок точечно (touch), любая другая запись
+    # (импорт, слияние дублей) видна по conn.total_changes и ведёт к перезагрузке при следующем запросе.
+    EVENT_CODES = ("level", "line", "sport")
+    # код MEDALS: 0 нет, 1 gold, 2 silver, 3 bronze; прочие названия из формы (коды 4+) — как «нет», как и в SQL-отчётах
+    MEDAL_SQL = "CASE WHEN medal BETWEEN 1 AND 3 THEN medal ELSE 0 END"
+    TOP3_SQL  = "CASE WHEN place BETWEEN 1 AND 3 THEN 1 ELSE 0 END"
+
+    def __init__(self, store):
+        self.store = store
+        self.stamp = None   # conn.total_changes, которому соответствует снимок; None — не загружен
+
+    # ---- загрузка и точечные правки
+    def load(self):
+        conn = self.store.conn
+        self.codes = {"year": {}}   # год -> свой плотный код (уровень/линия/вид — коды перечислений из базы)
+        self.ev_alive = np.zeros(0, dtype=bool); self.ev_day = np.zeros(0, dtype=np.float64)   # NaN — дата неверна
+        self.ev_code  = {k: np.zeros(0, dtype=np.int32) for k in self.EVENT_CODES + ("year",)}
+        for row in conn.execute("SELECT event_id, day, year, level, line, sport FROM events"):
+            self._set_event(*row)
+        self.p_group = np.zeros(0, dtype=np.int32)
+        for pid, gid in conn.execute("SELECT person_id, group_id FROM persons"):
+            self._set_person(pid, gid)
+        self.g_coach = np.zeros(0, dtype=np.int32)
+        for gid, cid in conn.execute("SELECT group_id, coach_id FROM groups"):
+            self._set_group(gid, cid)
+        rows = conn.execute(f"""SELECT result_id, event_id, person_id, {self.MEDAL_SQL}, {self.TOP3_SQL}
+                                FROM results ORDER BY result_id""").fetchall()
+        a = np.array(rows, dtype=np.int64).reshape(-1, 5)
+        self.n = len(a)
+        self.r_id = a[:, 0].copy(); self.r_ev = a[:, 1].astype(np.int32); self.r_person = a[:, 2].astype(np.int32)
+        self.r_medal = a[:, 3].astype(np.int8); self.r_top3 = a[:, 4].astype(bool)
+        self.r_alive = np.ones(self.n, dtype=bool)
+        self.stamp = conn.total_changes
+
+    def _set_event(self, eid, day, year, level, line, sport):
+        n = eid + 1
+        self.ev_alive = _np_fit(self.ev_alive, n, False); self.ev_day = _np_fit(self.ev_day, n, np.nan)
+        for k in self.ev_code: self.ev_code[k] = _np_fit(self.ev_code[k], n, -1)
+        self.ev_alive[eid] = True; self.ev_day[eid] = np.nan if day is None else day
+        for k, v in zip(self.EVENT_CODES, (level, line, sport)):
+            self.ev_code[k][eid] = v
+        self.ev_code["year"][eid] = self.codes["year"].setdefault(year, len(self.codes["year"]))
+
+    def _set_person(self, pid, gid):
+        self.p_group = _np_fit(self.p_group, pid + 1, -1); self.p_group[pid] = -1 if gid is None else gid
+
+    def _set_group(self, gid, cid):
+        self.g_coach = _np_fit(self.g_coach, gid + 1, -1); self.g_coach[gid] = -1 if cid is None else cid
+
+    def touch(self, table, id_, before):
+        # точечная правка после записи Store в table/id_; before — conn.total_changes до записи
+        if self.stamp is None: return
+        if self.stamp != before or not getattr(self, "_touch_" + table)(id_):
+            self.stamp = None; return
+        self.stamp = self.store.conn.total_changes
+
+    def _touch_coaches(self, cid):
+        return True     # ФИО берётся при запросе, удаление тренера с группами запрещено (RESTRICT)
+
+    def _touch_groups(self, gid):
+        row = self.store.conn.execute("SELECT coach_id FROM groups WHERE group_id=?", (gid,)).fetchone()
+        if row: self._set_group(gid, row[0])
+        elif gid < len(self.g_coach):
+            self.g_coach[gid] = -1; self.p_group[self.p_group == gid] = -1     # ON DELETE SET NULL
+        return True
+
+    def _touch_persons(self, pid):
+        row = self.store.conn.execute("SELECT group_id FROM persons WHERE person_id=?", (pid,)).fetchone()
+        if row:
+            self._set_person(pid, row[0])
+            if row[0] is not None: self._touch_groups(row[0])
+        elif pid < len(self.p_group):
+            self.p_group[pid] = -1; self.r_alive[:self.n] &= self.r_person[:self.n] != pid   # каскад results
+        return True
+
+    def _touch_events(self, eid):
+        row = self.store.conn.execute("SELECT day, year, level, line, sport FROM events WHERE event_id=?", (eid,)).fetchone()
+        if row: self._set_event(eid, *row)
+        elif eid < len(self.ev_alive):
+            self.ev_alive[eid] = False; self.r_alive[:self.n] &= self.r_ev[:self.n] != eid
+        return True
+
+    def _touch_results(self, rid):
+        conn, n = self.store.conn, self.n
+        row = conn.execute(f"SELECT event_id, person_id, {self.MEDAL_SQL}, {self.TOP3_SQL} FROM results WHERE result_id=?",
+                           (rid,)).fetchone()
+        i = int(np.searchsorted(self.r_id[:n], rid))
+        found = i < n and self.r_id[i] == rid
+        if row is None:
+            if found: self.r_alive[i] = False
+            return True
+        if not found:
+            if i < n: return False      # id не в конце — проще перезагрузить
+            for name in ("r_id", "r_ev", "r_person", "r_medal", "r_top3", "r_alive"):
+                setattr(self, name, _np_fit(getattr(self, name), n + 1, 0))
+            self.n = n + 1
+        ev, pid, medal, top3 = row
+        self.r_id[i], self.r_ev[i], self.r_person[i], self.r_medal[i], self.r_top3[i], self.r_alive[i] = rid, ev, pid, medal, top3, True
+        if ev >= len(self.ev_alive) or not self.ev_alive[ev]: self._touch_events(ev)
+        if pid >= len(self.p_group): self._touch_persons(pid)
+        # INSERT OR REPLACE могла удалить прежнюю строку того же участника в том же соревновании
+        live = {r[0] for r in conn.execute("SELECT result_id FROM results WHERE event_id=? AND person_id=?", (ev, pid))}
+        same = np.flatnonzero(self.r_alive[:self.n] & (self.r_ev[:self.n] == ev) & (self.r_person[:self.n] == pid))
+        for j in same:
+            if int(self.r_id[j]) not in live: self.r_alive[j] = False
+        return True
+
+    # ---- запросы
+    def _sync(self):
+        self.store._check_external()
+        if self.stamp != self.store.conn.total_changes: self.load()
+
+    def _mask(self, rf):
+        # маска строк results под фильтр: условия считаются по соревнованиям и переносятся на результаты
+        self._sync()
+        evm = self.ev_alive.copy()
+        for k, v in zip(rf.shape, rf.params):
+            if k == "date_from": evm &= self.ev_day >= v
+            elif k == "date_to": evm &= self.ev_day <= v
+            else: evm &= self.ev_code[k] == self.store.enum_codes[k].get(v, -2)
+        n = self.n
+        return self.r_alive[:n] & evm[self.r_ev[:n]]
+
+    def _coach_of(self, idx):
+        # тренер для строк results idx (-1 — нет группы или тренера)
+        grp = self.p_group[self.r_person[idx]]
+        coach = np.full(len(idx), -1, dtype=np.int64)
+        ok = grp >= 0
+        coach[ok] = self.g_coach[grp[ok]]
+        return coach
+
+    @staticmethod
+    def _count_distinct(key, val, size):
+        # число различных val для каждого key (0..size-1)
+        if not len(key): return np.zeros(size, dtype=np.int64)
+        pairs = np.unique(key.astype(np.int64) * (int(val.max()) + 1) + val)
+        return np.bincount(pairs // (int(val.max()) + 1), minlength=size)
+
+    def medals_summary(self, rf):
+        m = self._mask(rf)
+        c = np.bincount(self.r_medal[:self.n][m], minlength=4)
+        return int(c[1]), int(c[2]), int(c[3])
+
+    def _coach_stats(self, idx, coach):
+        ok = coach >= 0
+        idx, coach = idx[ok], coach[ok]
+        if not len(idx): return {}
+        size = int(coach.max()) + 1
+        medals = np.bincount(coach * 4 + self.r_medal[idx], minlength=size * 4).reshape(size, 4)
+        starts = np.bincount(coach, minlength=size)
+        events = self._count_distinct(coach, self.r_ev[idx].astype(np.int64), size)
+        athletes = self._count_distinct(coach, self.r_person[idx].astype(np.int64), size)
+        return {int(c): {"g": int(medals[c, 1]), "s": int(medals[c, 2]), "b": int(medals[c, 3]), "starts": int(starts[c]),
+                         "events": int(events[c]), "athletes": int(athletes[c])} for c in np.flatnonzero(starts)}
+
+    def medals_by_coach(self, rf):
+        idx = np.flatnonzero(self._mask(rf))
+        stats = self._coach_stats(idx, self._coach_of(idx))
+        names = self.store.get_many("coaches", list(stats))
+        return [dict(coach_id=c, fio=names[c]["fio"], **st) for c, st in sorted(stats.items()) if c in names]
+
+    def coach_summary(self, coach_id, rf):
+        idx = np.flatnonzero(self._mask(rf))
+        coach = self._coach_of(idx)
+        sel = coach == coach_id
+        st = self._coach_stats(idx[sel], coach[sel]).get(coach_id)
+        return st or {"g": 0, "s": 0, "b": 0, "starts": 0, "events": 0, "athletes": 0}
+
+    def prize_summary(self, key, id_, rf):
+        m = self._mask(rf)
+        person = self.r_person[:self.n]
+        m &= (person if key == "person_id" else self.p_group[person]) == id_
+        medal = self.r_medal[:self.n][m]
+        c = np.bincount(medal, minlength=4)
+        prize = int(np.count_nonzero((medal > 0) | self.r_top3[:self.n][m]))
+        return {"starts": int(m.sum()), "gold": int(c[1]), "silver": int(c[2]), "bronze": int(c[3]), "prize": prize}
+
+    def yearly_dynamics(self, rf):
+        m = self._mask(rf)
+        ev = self.r_ev[:self.n][m]
+        year = self.ev_code["year"]
+        ny = len(self.codes["year"])
+        # соревнования с результатами (под фильтр попадают и их результаты — условия только по events)
+        evs = np.unique(ev)
+        events = np.bincount(year[evs], minlength=ny)
+        medals = np.bincount(year[ev] * 4 + self.r_medal[:self.n][m], minlength=ny * 4).reshape(ny, 4)
+        names = {c: GROUP_DIM_FORMAT["year"](y) for y, c in self.codes["year"].items()}
+        rows = []
+        for c in np.flatnonzero(events):
+            g, s, b = (int(x) for x in medals[c, 1:])
+            rows.append({"year": names[c], "events": int(events[c]), "gold": g, "silver": s, "bronze": b, "total_medals": g+s+b})
+        return sorted(rows, key=lambda r: r["year"])
+
 # ------------ Хранилище ------------
 class Store:
-    def __init__(self, db_path=DB_PATH):
-        self.conn = sqlite3.connect(db_path)
+    # кэш сущностей по id (identity map), см. get_many
+    ENTITIES = {"coaches": "coach_id", "groups": "group_id", "persons": "person_id",
+                "events": "event_id", "results": "result_id"}
+    ENTITY_CACHE_SIZE = 4096    # строк на таблицу
+    ENTITY_SOURCES = {"groups": "groups_named", "events": "events_named", "results": "results_named"}   # с названиями перечислений
+
+    def __init__(self, db_path=DB_PATH, trace=None, columnar=None, readonly=False):
+        # columnar: отчёты из колоночного снимка (None — если установлен numpy).
+        # readonly: только чтение чужой базы (сводка округа, табло) — файл открывается mode=ro,
+        # схема не создаётся и не обновляется; базу прежней версии такой Store не читает (ValueError)
+        self.trace = trace
+        self._cache, self._cache_stamp = {}, None
+        self.columns = ResultColumns(self) if (HAS_NUMPY if columnar is None else columnar) else None
+        # кэш подготовленных выражений: отчёты используют канонические тексты SQL (см. ReportFilter)
+        if readonly:
+            self.conn = sqlite3.connect(pathlib.Path(db_path).resolve().as_uri() + "?mode=ro", uri=True, cached_statements=256)
+        else:
+            self.conn = sqlite3.connect(db_path, cached_statements=256)
         self.conn.execute("PRAGMA foreign_keys = ON;")
+        self.conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
         self.conn.row_factory = sqlite3.Row
+        # поиск в списках без учёта регистра и для кириллицы (LIKE/lower в SQLite — только ASCII)
+        self.conn.create_function("casefold", 1, lambda v: v.casefold() if isinstance(v, str) else v, deterministic=True)
+        self.db_path, self.readonly = db_path, readonly
+        self._attached, self._scopes = [], {}   # подключённые архивы (старые первыми) и представления над ними
+        # новая база создаётся с возвратом свободных страниц порциями (Maintenance); у прежних режим сменит VACUUM
+        if not readonly: self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._open()
+
+    def _open(self):
+        if self.readonly: return self._open_readonly()
         self.conn.executescript(SCHEMA_SQL)
+        self._migrate()
+        self.archives = {y: p for y, p in self.conn.execute("SELECT year, path FROM archive_seasons ORDER BY year")}
+        # участники, добавленные до появления person_keys (или другой программой без триггеров)
+        self.conn.execute("""INSERT OR IGNORE INTO person_keys_dirty(person_id)
+                             SELECT person_id FROM persons p WHERE NOT EXISTS (SELECT 1 FROM person_keys k WHERE k.person_id=p.person_id)""")
+        self.conn.commit()
+        self._data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        self._external, self._seen_version = False, self.changelog_version()
+
+    def _open_readonly(self):
+        # отчётам нужны коды перечислений и столбцы дат events (Store._migrate); без них — только обновление
+        have = {r[0] for r in self.conn.execute("SELECT name FROM sqlite_master")}
+        cols = {r[1]: r[2].upper() for r in self.conn.execute("PRAGMA table_xinfo(events)")}
+        need = {f"enum_{k}" for k in ENUMS} | {"events_named", "results_named", "groups_named"}
+        if not need <= have or cols.get("level") != "INTEGER" or any(n not in cols for n, _ in EVENT_DATE_COLUMNS):
+            raise ValueError("база прежней версии программы — нужно обновление (откройте её в программе)")
+        self._load_enums()
+        self.archives = ({y: p for y, p in self.conn.execute("SELECT year, path FROM archive_seasons ORDER BY year")}
+                         if "archive_seasons" in have else {})
+        self._data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        self._external, self._seen_version = False, self.changelog_version() if "changelog" in have else 0
+
+    def reload(self):
+        # содержимое базы заменено целиком (восстановление из копии): схема, перечисления, архивы и кэши — заново
+        for s in list(self._attached): self._detach(s)
+        self._cache.clear(); self._cache_stamp = None
+        if self.columns is not None: self.columns.stamp = None
+        self._open()
+
+    def _migrate(self):
+        # столбцы и типы, которых нет в базах прежних версий (CREATE TABLE IF NOT EXISTS их не добавит)
+        self._seed_enums()
+        if {r[1]: r[2] for r in self.conn.execute("PRAGMA table_info(results)")}.get("medal", "").upper() == "TEXT":
+            self._migrate_enums()
+        have = {r[1] for r in self.conn.execute("PRAGMA table_xinfo(events)")}
+        for name, expr in EVENT_DATE_COLUMNS:
+            if name not in have:
+                self.conn.execute(f"ALTER TABLE events ADD COLUMN {name} INTEGER GENERATED ALWAYS AS ({expr}) VIRTUAL")
+        self.conn.executescript(EVENT_DATE_INDEXES_SQL)
+        if self.conn.execute("""SELECT 1 FROM sqlite_master WHERE type='trigger'
+                                AND name LIKE 'trg_persons_keys_%' AND sql LIKE '%OR IGNORE%'""").fetchone():
+            # триггеры person_keys_dirty прежних версий ронялись на повторном импорте участников
+            self.conn.executescript("DROP TRIGGER trg_persons_keys_ins; DROP TRIGGER trg_persons_keys_upd;" + SCHEMA_SQL)
+        if self.conn.execute("SELECT 1 FROM changelog LIMIT 1").fetchone() is None:
+            # журнал появился в уже заполненной базе: все строки — как вставленные, первая разность = полная выгрузка
+            for t, pk in SYNC_TABLES.items():
+                self.conn.execute(f"INSERT OR IGNORE INTO changelog(tbl,row_id,op) SELECT '{t}', {pk}, 'U' FROM {t}")
+            self.conn.commit()
+        if self.conn.execute("SELECT 1 FROM sync_keys LIMIT 1").fetchone() is None:
+            # uid строк, внесённых до появления sync_keys, — из id и содержимого строки: у копий одной базы
+            # они совпадут, у независимых установок с теми же id (но другими строками) — нет
+            self.conn.create_function("_sync_uid", -1, lambda *a: int.from_bytes(
+                hashlib.sha1(repr(a).encode()).digest()[:8], "big", signed=True), deterministic=True)
+            for t, pk in SYNC_TABLES.items():
+                cols = ", ".join([pk] + IMPORT_TABLES[t][1])
+                self.conn.execute(f"INSERT OR IGNORE INTO sync_keys(tbl,row_id,uid) SELECT '{t}', {pk}, _sync_uid('{t}', {cols}) FROM {t}")
+            self.conn.commit()
+        self._load_enums()
+
+    def _seed_enums(self):
+        for kind, values in ENUMS.items():
+            for code, name in enumerate(values):
+                if name or kind == "medal":
+                    self.conn.execute(f"INSERT OR IGNORE INTO enum_{kind}(code,name) VALUES(?,?)", (code, name))
+                    self.conn.execute(f"INSERT OR IGNORE INTO enum_{kind}(name) VALUES(?)", (name,))
         self.conn.commit()
 
+    def _migrate_enums(self):
+        # базы с названиями в groups/events/results: тип столбца через ALTER не сменить, поэтому таблицы
+        # пересоздаются и строки копируются с кодами (legacy_alter_table — чтобы ссылки results на events
+        # не переехали на переименованную копию). Неизвестные названия сначала получают свои коды.
+        script = ["PRAGMA foreign_keys=OFF;", "PRAGMA legacy_alter_table=ON;", "BEGIN;"]
+        for t, cols in ENUM_COLUMNS.items():
+            for col, kind in cols.items():
+                script.append(f"INSERT OR IGNORE INTO enum_{kind}(name) SELECT DISTINCT COALESCE({col},'') FROM {t};")
+        script += [f"ALTER TABLE {t} RENAME TO _old_{t};" for t in ENUM_COLUMNS]
+        script.append(SCHEMA_SQL)
+        for t, cols in ENUM_COLUMNS.items():
+            pk, fields, _ = IMPORT_TABLES[t]
+            sel = [f"(SELECT code FROM enum_{cols[c]} WHERE name=COALESCE(o.{c},''))" if c in cols else f"o.{c}"
+                   for c in [pk] + fields]
+            script.append(f"INSERT INTO {t}({', '.join([pk] + fields)}) SELECT {', '.join(sel)} FROM _old_{t} o;")
+        script += [f"DROP TABLE _old_{t};" for t in ENUM_COLUMNS]
+        script.append(SCHEMA_SQL)   # индексы: прежние имена освободились вместе со старыми таблицами
+        script += ["COMMIT;", "PRAGMA legacy_alter_table=OFF;", "PRAGMA foreign_keys=ON;"]
+        self.conn.executescript("\n".join(script))
+
+    # --- перечисления: в базе коды, наружу из Store — названия
+    def _load_enums(self):
+        self.enum_codes = {k: {} for k in ENUMS}
+        self.enum_names = {k: {} for k in ENUMS}
+        for kind in ENUMS:
+            for code, name in self.conn.execute(f"SELECT code, name FROM enum_{kind}"):
+                self.enum_codes[kind][name] = code; self.enum_names[kind][code] = name
+
+    def encode(self, kind, name):
+        # название -> код; новое название получает следующий код (как раньше, любое значение из формы сохранится)
+        name = name or ""
+        code = self.enum_codes[kind].get(name)
+        if code is None:
+            outer = self.conn.in_transaction
+            self.conn.execute(f"INSERT OR IGNORE INTO enum_{kind}(name) VALUES(?)", (name,))
+            code = self.conn.execute(f"SELECT code FROM enum_{kind} WHERE name=?", (name,)).fetchone()[0]
+            if not outer:   # внутри чужой транзакции код может откатиться вместе с ней — не запоминаем
+                self.conn.commit()
+                self.enum_codes[kind][name] = code; self.enum_names[kind][code] = name
+        return code
+
+    def decode(self, kind, code):
+        return self.enum_names[kind].get(code, code)
+
     # helpers
     def _fetchall(self, q, a=()):
+        if self.trace is not None and self.trace.enabled:
+            t0 = time.perf_counter()
+            rows = [dict(r) for r in self.conn.execute(q, a).fetchall()]
+            self.trace.add_sql(time.perf_counter() - t0)
+            return rows
         return [dict(r) for r in self.conn.execute(q, a).fetchall()]
+    def _fetchrows(self, q, a=()):
+        # как _fetchall, но без преобразования в dict (для агрегатов)
+        if self.trace is not None and self.trace.enabled:
+            t0 = time.perf_counter()
+            rows = self.conn.execute(q, a).fetchall()
+            self.trace.add_sql(time.perf_counter() - t0)
+            return rows
+        return self.conn.execute(q, a).fetchall()
     def _fetchone(self, q, a=()):
-        r = self.conn.execute(q, a).fetchone()
+        if self.trace is not None and self.trace.enabled:
+            t0 = time.perf_counter()
+            r = self.conn.execute(q, a).fetchone()
+            self.trace.add_sql(time.perf_counter() - t0)
+        else:
+            r = self.conn.execute(q, a).fetchone()
         return dict(r) if r else None
 
+    def _write(self, q, a=()):
+        # одна запись из формы с фиксацией. Чужую блокировку SQLite пережидает сам (busy_timeout);
+        # если другой оператор держит её дольше — откат и ещё попытки с растущей паузой.
+        # Внутри чужой транзакции (импорт протокола) — без фиксации и повторов: ими распоряжается её владелец
+        if self.conn.in_transaction:
+            return self.conn.execute(q, a)
+        for attempt in range(1, WRITE_RETRIES + 1):
+            try:
+                cur = self.conn.execute(q, a); self.conn.commit()
+                return cur
+            except sqlite3.OperationalError as e:
+                if self.conn.in_transaction: self.conn.rollback()
+                if attempt == WRITE_RETRIES or not ("locked" in str(e) or "busy" in str(e)): raise
+                time.sleep(WRITE_RETRY_SEC * attempt)
+
+    # --- чужие правки: другой оператор с той же базой, CLI, загрузка изменений в другом окне.
+    # PRAGMA data_version меняется только от фиксаций других соединений; свои записи его не трогают.
+    def _check_external(self):
+        dv = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if dv == self._data_version: return False
+        self._data_version, self._external = dv, True
+        self._cache.clear(); self._cache_stamp = None
+        if self.columns is not None: self.columns.stamp = None
+        self._load_enums()
+        self.archives = {y: p for y, p in self.conn.execute("SELECT year, path FROM archive_seasons ORDER BY year")}
+        return True
+
+    def external_changes(self):
+        # таблицы SYNC_TABLES, которые изменили другие соединения с прошлого вызова (пусто — ничего).
+        # Какие именно — по журналу changelog выше запомненной версии; в окно между опросами могут
+        # попасть и свои записи, их таблицы просто перечитаются ещё раз.
+        self._check_external()
+        seen, self._seen_version = self._seen_version, self.changelog_version()
+        if not self._external: return set()
+        self._external = False
+        if self._seen_version < seen: return set(SYNC_TABLES)   # база подменена (восстановление из копии)
+        tables = {r[0] for r in self.conn.execute("SELECT DISTINCT tbl FROM changelog WHERE version > ?", (seen,))}
+        return tables or set(SYNC_TABLES)   # перенос в архив и прочее без следа в журнале — всё заново
+
+    # --- кэш сущностей: карточки и диалоги берут строки по id отсюда, а не сканом таблиц.
+    # Кэш действителен, пока не изменился conn.total_changes: любая запись через это соединение
+    # (формы, импорт, слияние дублей, триггеры) сбрасывает его целиком.
+    def _entity_cache(self, table):
+        self._check_external()
+        if self._cache_stamp != self.conn.total_changes:
+            self._cache.clear(); self._cache_stamp = self.conn.total_changes
+        return self._cache.setdefault(table, OrderedDict())
+    def get_many(self, table, ids):
+        # {id: строка} для найденных id; промахи добираются одним запросом IN (...)
+        pk = self.ENTITIES[table]
+        cache = self._entity_cache(table)
+        out, miss = {}, []
+        for i in dict.fromkeys(ids):
+            if i in cache: cache.move_to_end(i); out[i] = cache[i]
+            else: miss.append(i)
+        keep = not self.conn.in_transaction     # незафиксированное может откатиться — не кэшируем
+        for k in range(0, len(miss), 500):
+            part = miss[k:k+500]
+            src = self.ENTITY_SOURCES.get(table, table)
+            for r in self._fetchall(f"SELECT * FROM {src} WHERE {pk} IN ({','.join('?'*len(part))})", part):
+                out[r[pk]] = r
+                if keep: cache[r[pk]] = r
+        while len(cache) > self.ENTITY_CACHE_SIZE: cache.popitem(last=False)
+        return {i: dict(out[i]) for i in ids if i in out}
+    def get_coach(self, cid):  return self.get_many("coaches", [cid]).get(cid)
+    def get_group(self, gid):  return self.get_many("groups", [gid]).get(gid)
+    def get_person(self, pid): return self.get_many("persons", [pid]).get(pid)
+    def get_event(self, eid):  return self.get_many("events", [eid]).get(eid)
+    def get_result(self, rid): return self.get_many("results", [rid]).get(rid)
+
+    def _touch(self, table, id_, before):
+        if self.columns is None: return
+        if self.conn.in_transaction: self.columns.stamp = None   # может откатиться — снимок перечитается
+        else: self.columns.touch(table, id_, before)
+
+    # --- архив сезонов: закрытые сезоны лежат в файлах рядом с базой (sports_2019.db) и подключаются
+    # (ATTACH) только для отчётов, чей период их захватывает; рабочая база остаётся маленькой
+    def archive_file(self, year):
+        path = self.archives.get(year)
+        if path is None:
+            base, ext = os.path.splitext(os.path.basename(self.db_path))
+            path = f"{base}_{year}{ext or '.db'}"
+        return path if os.path.isabs(path) else os.path.join(os.path.dirname(os.path.abspath(self.db_path)), path)
+
+    def _attach(self, years):
+        # подключить архивы years (имена схем season_<год>); лишние подключения отключаются, старые первыми
+        if len(years) > ARCHIVE_ATTACH_MAX:
+            raise ValueError(f"В период попадает архивов: {len(years)}, подключить можно {ARCHIVE_ATTACH_MAX} — сузьте даты")
+        want = [f"season_{y}" for y in years]
+        for s in [s for s in self._attached if s not in want][:max(0, len(set(self._attached) | set(want)) - ARCHIVE_ATTACH_MAX)]:
+            self._detach(s)
+        for y, s in zip(years, want):
+            if s in self._attached: continue
+            path = self.archive_file(y)
+            if y in self.archives and not os.path.exists(path):
+                raise FileNotFoundError(f"Нет файла архива сезона {y}: {path}")
+            self.conn.execute(f"ATTACH DATABASE ? AS {s}", (path,))
+            self._attached.append(s)
+        return want
+
+    def _detach(self, schema):
+        for years, names in list(self._scopes.items()):
+            if schema in (f"season_{y}" for y in years):
+                for v in names: self.conn.execute(f"DROP VIEW IF EXISTS temp.{v}")
+                del self._scopes[years]
+        self.conn.execute(f"DETACH DATABASE {schema}")
+        self._attached.remove(schema)
+
+    def archive_schemas(self):
+        # по одному подключённому архиву за раз (для проверок и правок, которые должны видеть и историю)
+        for y in list(self.archives):
+            yield self._attach((y,))[0]
+
+    def _archived_years(self, rf):
+        y0, y1 = rf.years()
+        return tuple(y for y in self.archives if (y0 is None or y >= y0) and (y1 is None or y <= y1))
+
+    def _tables(self, rf):
+        # {events}/{results} для отчёта: таблицы рабочей базы либо временные представления
+        # main ∪ архивы захваченных фильтром сезонов (UNION ALL; условия фильтра SQLite переносит в каждую ветку)
+        years = self._archived_years(rf)
+        if not years: return MAIN_TABLES
+        names = self._scopes.get(years)
+        if names is None:
+            ev = [f"SELECT {ARCHIVE_EVENT_COLS}, day, year, month FROM main.events"]
+            rs = [f"SELECT {ARCHIVE_RESULT_COLS} FROM main.results"]
+            for y, s in zip(years, self._attach(years)):
+                off = y << ARCHIVE_ID_SHIFT
+                ev.append(f"SELECT event_id + {off}, name, date, level, line, sport, location, total_count, day, year, month FROM {s}.events")
+                rs.append(f"SELECT result_id + {off}, event_id + {off}, person_id, category, place, medal, note FROM {s}.results")
+            sfx = "_".join(map(str, years))
+            names = (f"scope_events_{sfx}", f"scope_results_{sfx}")
+            self.conn.execute(f"CREATE TEMP VIEW IF NOT EXISTS {names[0]} AS " + " UNION ALL ".join(ev))
+            self.conn.execute(f"CREATE TEMP VIEW IF NOT EXISTS {names[1]} AS " + " UNION ALL ".join(rs))
+            self._scopes[years] = names
+        else:
+            self._attach(years)
+        return names
+
+    def _rsql(self, rf, template):
+        return rf.sql(template, tables=self._tables(rf))
+
+    def _columnar(self, rf):
+        # колоночный снимок знает только рабочую базу
+        return self.columns is not None and not self._archived_years(rf)
+
+    def seasons(self):
+        # сезоны рабочей базы и архива: {год: {"events", "results", "archived_events", "archived_results", "path"}}
+        out = {}
+        blank = lambda: {"events": 0, "results": 0, "archived_events": 0, "archived_results": 0, "path": ""}
+        for y, ne, nr in self.conn.execute("""SELECT e.year, COUNT(DISTINCT e.event_id), COUNT(r.result_id)
+                                              FROM events e LEFT JOIN results r ON r.event_id=e.event_id
+                                              WHERE e.year IS NOT NULL GROUP BY e.year"""):
+            out.setdefault(y, blank()).update(events=ne, results=nr)
+        for y, path, ne, nr in self.conn.execute("SELECT year, path, events, results FROM archive_seasons"):
+            out.setdefault(y, blank()).update(archived_events=ne, archived_results=nr, path=path)
+        return dict(sorted(out.items()))
+
+    def archive_season(self, year):
+        # перенести закрытый сезон (соревнования года и их результаты) в файл архива. Повторный вызов
+        # дописывает соревнования того же года, внесённые позже; рабочая база после переноса снова выдаёт
+        # те же id, поэтому при совпадении с уже архивными дописываемые id сдвигаются за максимум архива.
+        # Возвращает (соревнований, результатов).
+        year = int(year)
+        if year >= datetime.date.today().year:
+            raise ValueError(f"Сезон {year} ещё не закрыт")
+        if self.db_path == ":memory:":
+            raise ValueError("Архив сезонов работает только с базой в файле")
+        if not self._fetchone("SELECT 1 FROM events WHERE year=? LIMIT 1", (year,)):
+            raise ValueError(f"В рабочей базе нет соревнований {year} года")
+        path = self.archives.get(year) or os.path.basename(self.archive_file(year))
+        s = self._attach((year,))[0]
+        self.conn.executescript(ARCHIVE_SCHEMA_SQL.format(s=s))
+        self.conn.execute("BEGIN")
+        try:
+            v0 = self.changelog_version()
+            for kind in ENUMS:
+                self.conn.execute(f"INSERT OR REPLACE INTO {s}.enum_{kind}(code,name) SELECT code, name FROM main.enum_{kind}")
+            def shift(table, pk, src):
+                # 0 — id свободны в архиве, иначе максимум архива (порядок id сохраняется)
+                clash = self.conn.execute(f"SELECT 1 FROM {src} AND EXISTS (SELECT 1 FROM {s}.{table} a WHERE a.{pk}=x.{pk}) LIMIT 1", (year,)).fetchone()
+                return self.conn.execute(f"SELECT MAX({pk}) FROM {s}.{table}").fetchone()[0] if clash else 0
+            ev_src = "main.events x WHERE x.year=?"
+            rs_src = "main.results x JOIN main.events e ON e.event_id=x.event_id WHERE e.year=?"
+            eoff, roff = shift("events", "event_id", ev_src), shift("results", "result_id", rs_src)
+            ev_cols = ARCHIVE_EVENT_COLS.replace("event_id", f"x.event_id + {eoff}", 1)
+            rs_cols = ", ".join({"result_id": f"x.result_id + {roff}", "event_id": f"x.event_id + {eoff}"}.get(c, "x." + c)
+                                for c in ARCHIVE_RESULT_COLS.split(", "))
+            ne = self.conn.execute(f"INSERT INTO {s}.events({ARCHIVE_EVENT_COLS}) SELECT {ev_cols} FROM {ev_src}", (year,)).rowcount
+            nr = self.conn.execute(f"INSERT INTO {s}.results({ARCHIVE_RESULT_COLS}) SELECT {rs_cols} FROM {rs_src}", (year,)).rowcount
+            self.conn.execute("DELETE FROM main.events WHERE year=?", (year,))   # results — каскадом
+            self.conn.execute("DELETE FROM changelog WHERE version > ?", (v0,))   # перенос в архив — не удаление для других установок
+            self.conn.execute("""INSERT INTO archive_seasons(year,path,events,results,archived_at)
+                                 VALUES(?,?,?,?,datetime('now'))
+                                 ON CONFLICT(year) DO UPDATE SET events=events+excluded.events,
+                                    results=results+excluded.results, archived_at=excluded.archived_at""",
+                              (year, path, ne, nr))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            if year not in self.archives: self._detach(s)
+            raise
+        # прежние представления остаются верными: набор лет входит в их имя.
+        # Снимок ResultColumns и кэш сущностей перечитаются сами — total_changes изменился
+        self.archives = dict(sorted({**self.archives, year: path}.items()))
+        return ne, nr
+
+    # --- обмен разностями: строки, изменённые после версии журнала changelog
+    def changelog_version(self):
+        return self.conn.execute("SELECT COALESCE(MAX(version), 0) FROM changelog").fetchone()[0]
+
+    def delta_since(self, since=0):
+        # {"format", "since", "version", "tables": {таблица: {"columns", "upsert": [[...]], "delete": [uid]}}};
+        # значения — строками в формате импорта CSV, перечисления — названиями (коды у установок свои),
+        # id строки и ссылки на другие таблицы — глобальными ключами uid (sync_keys), а не своими id
+        uid = lambda t, col: f"(SELECT uid FROM sync_keys WHERE tbl='{t}' AND row_id=x.{col})"
+        self.conn.execute("BEGIN")      # один снимок на все таблицы
+        try:
+            version, tables = self.changelog_version(), {}
+            for t in IMPORT_ORDER:
+                pk, fields, _ = IMPORT_TABLES[t]
+                cols, refs = [pk] + fields, SYNC_REFS.get(t, {})
+                sel = [uid(t, pk)] + [uid(refs[c], c) if c in refs else f"x.{c}" for c in fields]
+                ups = self.conn.execute(f"""SELECT {', '.join(sel)} FROM {self.ENTITY_SOURCES.get(t, t)} x WHERE {pk} IN
+                                            (SELECT row_id FROM changelog WHERE tbl=? AND op='U' AND version>?)
+                                            ORDER BY {pk}""", (t, since)).fetchall()
+                dels = [r[0] for r in self.conn.execute("""SELECT k.uid FROM changelog c JOIN sync_keys k ON k.tbl=c.tbl AND k.row_id=c.row_id
+                                                           WHERE c.tbl=? AND c.op='D' AND c.version>? ORDER BY c.row_id""", (t, since))]
+                if ups or dels:
+                    tables[t] = {"columns": cols, "upsert": [["" if v is None else str(v) for v in r] for r in ups], "delete": dels}
+        finally:
+            self.conn.execute("COMMIT")
+        return {"format": DELTA_FORMAT, "since": since, "version": version, "tables": tables}
+
+    def sync_ids(self, table, uids):
+        # глобальные ключи строк -> свои id ({uid: id}); неизвестных здесь uid в ответе нет
+        out, uids = {}, list(dict.fromkeys(uids))
+        for k in range(0, len(uids), 500):
+            part = uids[k:k+500]
+            out.update(self.conn.execute(f"SELECT uid, row_id FROM sync_keys WHERE tbl=? AND uid IN ({','.join('?'*len(part))})",
+                                         [table] + part).fetchall())
+        return out
+
+    def last_delta_version(self, peer=""):
+        row = self.conn.execute("SELECT version FROM delta_exports WHERE peer=?", (peer,)).fetchone()
+        return row[0] if row else 0
+
+    def mark_delta_exported(self, peer, version):
+        self._write("""INSERT INTO delta_exports(peer,version,exported_at) VALUES(?,?,datetime('now'))
+                       ON CONFLICT(peer) DO UPDATE SET version=excluded.version, exported_at=excluded.exported_at""",
+                    (peer, version))
+
     # --- coaches
     def add_coach(self, fio, phone):
-        self.conn.execute("INSERT INTO coaches(fio,phone) VALUES(?,?)", (fio, phone or None)); self.conn.commit()
+        before = self.conn.total_changes
+        cur = self._write("INSERT INTO coaches(fio,phone) VALUES(?,?)", (fio, phone or None))
+        self._touch("coaches", cur.lastrowid, before)
     def list_coaches(self):
         return self._fetchall("SELECT coach_id, fio, COALESCE(phone,'') AS phone FROM coaches ORDER BY coach_id")
     def edit_coach(self, cid, fio, phone):
-        self.conn.execute("UPDATE coaches SET fio=?, phone=? WHERE coach_id=?", (fio, phone or None, cid)); self.conn.commit()
+        before = self.conn.total_changes
+        self._write("UPDATE coaches SET fio=?, phone=? WHERE coach_id=?", (fio, phone or None, cid))
+        self._touch("coaches", cid, before)
     def can_delete_coach(self, cid):
         return self._fetchone("SELECT 1 FROM groups WHERE coach_id=? LIMIT 1", (cid,)) is None
     def delete_coach(self, cid):
-        self.conn.execute("DELETE FROM coaches WHERE coach_id=?", (cid,)); self.conn.commit()
+        before = self.conn.total_changes
+        self._write("DELETE FROM coaches WHERE coach_id=?", (cid,))
+        self._touch("coaches", cid, before)
 
     # --- groups
     def add_group(self, name, sport, coach_id):
-        self.conn.execute("INSERT INTO groups(name,sport,coach_id) VALUES(?,?,?)", (name, sport, coach_id)); self.conn.commit()
+        sport = self.encode("sport", sport)
+        before = self.conn.total_changes
+        cur = self._write("INSERT INTO groups(name,sport,coach_id) VALUES(?,?,?)", (name, sport, coach_id))
+        self._touch("groups", cur.lastrowid, before)
     def list_groups(self):
         q = """
         SELECT g.group_id, g.name, g.sport, COALESCE(c.fio,'—') AS coach,
                (SELECT COUNT(*) FROM persons p WHERE p.group_id=g.group_id) AS members
-        FROM groups g LEFT JOIN coaches c ON c.coach_id=g.coach_id ORDER BY g.group_id"""
+        FROM groups_named g LEFT JOIN coaches c ON c.coach_id=g.coach_id ORDER BY g.group_id"""
         return self._fetchall(q)
     def edit_group(self, gid, name, sport, coach_id):
-        self.conn.execute("UPDATE groups SET name=?, sport=?, coach_id=? WHERE group_id=?", (name, sport, coach_id, gid)); self.conn.commit()
+        sport = self.encode("sport", sport)
+        before = self.conn.total_changes
+        self._write("UPDATE groups SET name=?, sport=?, coach_id=? WHERE group_id=?", (name, sport, coach_id, gid))
+        self._touch("groups", gid, before)
     def can_delete_group(self, gid):
         return self._fetchone("SELECT 1 FROM persons WHERE group_id=? LIMIT 1", (gid,)) is None
     def delete_group(self, gid):
-        self.conn.execute("DELETE FROM groups WHERE group_id=?", (gid,)); self.conn.commit()
+        before = self.conn.total_changes
+        self._write("DELETE FROM groups WHERE group_id=?", (gid,))
+        self._touch("groups", gid, before)
     def group_info(self, gid):
-        g = self._fetchone("SELECT * FROM groups WHERE group_id=?", (gid,))
+        g = self.get_group(gid)
         members = self._fetchall("""SELECT person_id, last_name||' '||first_name AS fio,
                                     COALESCE(birthdate,'') AS birthdate, COALESCE(phone,'') AS phone
                                     FROM persons WHERE group_id=? ORDER BY last_name, first_name""",(gid,))
@@ -136,233 +1119,349 @@ class Store:
 
     # --- persons
     def add_person(self, last, first, birthdate, address, phone, group_id):
-        self.conn.execute("""INSERT INTO persons(last_name,first_name,birthdate,address,phone,group_id)
+        before = self.conn.total_changes
+        cur = self._write("""INSERT INTO persons(last_name,first_name,birthdate,address,phone,group_id)
                              VALUES(?,?,?,?,?,?)""",(last, first, birthdate or None, address or None, phone or None, group_id))
-        self.conn.commit()
-    def list_persons(self):
-        q = """
-        SELECT p.person_id, p.last_name||' '||p.first_name AS fio, COALESCE(p.birthdate,'') AS birthdate,
-               COALESCE(g.name,'—') AS gname, COALESCE(c.fio,'—') AS coach,
-               COALESCE(p.phone,'') AS phone, COALESCE(p.address,'') AS address
-        FROM persons p
-        LEFT JOIN groups g  ON g.group_id=p.group_id
-        LEFT JOIN coaches c ON c.coach_id=g.coach_id
-        ORDER BY p.person_id"""
-        return self._fetchall(q)
-    def person_raw(self, pid):
-        return self._fetchone("SELECT * FROM persons WHERE person_id=?", (pid,))
+        self._touch("persons", cur.lastrowid, before)
+        return cur.lastrowid
     def edit_person(self, pid, last, first, birthdate, address, phone, group_id):
-        self.conn.execute("""UPDATE persons SET last_name=?, first_name=?, birthdate=?, address=?, phone=?, group_id=?
+        before = self.conn.total_changes
+        self._write("""UPDATE persons SET last_name=?, first_name=?, birthdate=?, address=?, phone=?, group_id=?
                              WHERE person_id=?""", (last, first, birthdate or None, address or None, phone or None, group_id, pid))
-        self.conn.commit()
+        self._touch("persons", pid, before)
     def can_delete_person(self, pid):
-        return self._fetchone("SELECT 1 FROM results WHERE person_id=? LIMIT 1", (pid,)) is None
+        # результаты в архиве сезонов тоже держат участника
+        if self._fetchone("SELECT 1 FROM results WHERE person_id=? LIMIT 1", (pid,)): return False
+        return not any(self._fetchone(f"SELECT 1 FROM {s}.results WHERE person_id=? LIMIT 1", (pid,))
+                       for s in self.archive_schemas())
     def delete_person(self, pid):
-        self.conn.execute("DELETE FROM persons WHERE person_id=?", (pid,)); self.conn.commit()
+        before = self.conn.total_changes
+        self._write("DELETE FROM persons WHERE person_id=?", (pid,))
+        self._touch("persons", pid, before)
 
     # --- events
     def add_event(self, name, date, level, line, sport, location, total):
-        self.conn.execute("""INSERT INTO events(name,date,level,line,sport,location,total_count)
+        level, line, sport = self.encode("level", level), self.encode("line", line), self.encode("sport", sport)
+        before = self.conn.total_changes
+        cur = self._write("""INSERT INTO events(name,date,level,line,sport,location,total_count)
                              VALUES(?,?,?,?,?,?,?)""",(name, date, level, line, sport, location or None, total))
-        self.conn.commit()
+        self._touch("events", cur.lastrowid, before)
+        return cur.lastrowid
     def list_events(self):
         q = """
         SELECT e.event_id, e.date, e.name, e.level, e.line, e.sport,
                COALESCE(e.location,'') AS location, COALESCE(e.total_count,'') AS total_count,
                (SELECT COUNT(DISTINCT person_id) FROM results r WHERE r.event_id=e.event_id) AS ours
-        FROM events e ORDER BY e.date DESC, e.event_id DESC"""
+        FROM events_named e ORDER BY e.date DESC, e.event_id DESC"""
         return self._fetchall(q)
-    def event_raw(self, eid):
-        return self._fetchone("SELECT * FROM events WHERE event_id=?", (eid,))
+    def list_page(self, view, sort=None, desc=None, after=None, limit=50, search=""):
+        # страница списка вкладки (LIST_VIEWS): (строки, ключ последней строки для after, есть ли дальше).
+        # Ключ — (значения ключа сортировки, pk). Если ключ может быть NULL, список идёт двумя отрезками
+        # (NULL первыми по возрастанию и последними по убыванию, как сортирует SQLite), и каждый
+        # выбирается по своему индексу: сравнение строк-значений с NULL не работает.
+        v = LIST_VIEWS[view]
+        d_sort, d_desc = v["default"]
+        sort = d_sort if sort is None else sort
+        desc = d_desc if desc is None else desc
+        cols, pk = v["columns"], v["pk"]
+        keys, nullable = cols[sort][1], cols[sort][2]
+        d, cmp = ("DESC", "<") if desc else ("ASC", ">")
+        base, params = [], []
+        if search:
+            text = " || char(31) || ".join(c[0] for c in cols)
+            base.append(f"instr(casefold({text}), ?) > 0")
+            params.append(search.casefold())
+        head = f"SELECT {', '.join(c[0] for c in cols)}, {', '.join(keys)}, {pk} FROM {v['from']}"
+        segments = ["null", "value"] if nullable and not desc else ["value", "null"] if nullable else ["value"]
+        if after is not None and nullable and after[0][0] is None:
+            segments = segments[segments.index("null"):]
+        elif after is not None:
+            segments = segments[segments.index("value"):]
+        rows, fetch = [], limit + 1     # лишняя строка — есть ли следующая страница
+        for seg in segments:
+            conds, args = list(base), list(params)
+            if seg == "null":
+                conds.append(f"{keys[0]} IS NULL"); order = f"{pk} {d}"
+                if after is not None: conds.append(f"{pk} {cmp} ?"); args.append(after[1])
+            else:
+                if nullable: conds.append(f"{keys[0]} IS NOT NULL")
+                order = ", ".join(f"{k} {d}" for k in keys + (pk,))
+                if after is not None:
+                    conds.append(f"({', '.join(keys + (pk,))}) {cmp} ({', '.join('?' * (len(keys) + 1))})")
+                    args += list(after[0]) + [after[1]]
+            where = f" WHERE {' AND '.join(conds)}" if conds else ""
+            rows += self._fetchrows(f"{head}{where} ORDER BY {order} LIMIT ?", args + [fetch - len(rows)])
+            after = None    # следующий отрезок — с начала
+            if len(rows) >= fetch: break
+        n = len(cols)
+        more = len(rows) > limit
+        rows = rows[:limit]
+        last = (tuple(rows[-1][n:n + len(keys)]), rows[-1][-1]) if rows else None
+        return [list(r[:n]) for r in rows], last, more
+
+    def list_count(self, view):
+        # строк в списке без поиска (по основной таблице; с поиском счёт — полный проход, его не ведём)
+        return self._fetchrows(f"SELECT COUNT(*) FROM {LIST_VIEWS[view]['count']}")[0][0]
+
+    def recent_events(self, limit):
+        return self._fetchall("""SELECT event_id, date, name, level, line, sport, COALESCE(location,'') AS location
+                                 FROM events_named ORDER BY date DESC, event_id DESC LIMIT ?""", (limit,))
     def edit_event(self, eid, name, date, level, line, sport, location, total):
-        self.conn.execute("""UPDATE events SET name=?, date=?, level=?, line=?, sport=?, location=?, total_count=?
+        level, line, sport = self.encode("level", level), self.encode("line", line), self.encode("sport", sport)
+        before = self.conn.total_changes
+        self._write("""UPDATE events SET name=?, date=?, level=?, line=?, sport=?, location=?, total_count=?
                              WHERE event_id=?""",(name, date, level, line, sport, location or None, total, eid))
-        self.conn.commit()
+        self._touch("events", eid, before)
     def can_delete_event(self, eid):
         return self._fetchone("SELECT 1 FROM results WHERE event_id=? LIMIT 1", (eid,)) is None
     def delete_event(self, eid):
-        self.conn.execute("DELETE FROM events WHERE event_id=?", (eid,)); self.conn.commit()
+        before = self.conn.total_changes
+        self._write("DELETE FROM events WHERE event_id=?", (eid,))
+        self._touch("events", eid, before)
 
     # --- results
     def add_result(self, event_id, person_id, category, place, medal, note):
-        category = category or ''
-        self.conn.execute("""INSERT OR REPLACE INTO results(event_id, person_id, category, place, medal, note)
-                             VALUES(?,?,?,?,?,?)""",(event_id, person_id, category, place, medal or "", note or None))
-        self.conn.commit()
-    def list_results(self):
-        q = """
-        SELECT r.result_id, e.date, e.name AS event_name, p.last_name||' '||p.first_name AS fio,
-               r.category, COALESCE(r.place,'') AS place, COALESCE(r.medal,'') AS medal, COALESCE(r.note,'') AS note
-        FROM results r JOIN events e ON e.event_id=r.event_id JOIN persons p ON p.person_id=r.person_id
-        ORDER BY e.date DESC, r.result_id DESC"""
-        return self._fetchall(q)
-    def result_raw(self, rid):
-        return self._fetchone("SELECT * FROM results WHERE result_id=?", (rid,))
+        category, medal = category or '', self.encode("medal", medal)
+        before = self.conn.total_changes
+        cur = self._write("""INSERT OR REPLACE INTO results(event_id, person_id, category, place, medal, note)
+                             VALUES(?,?,?,?,?,?)""",(event_id, person_id, category, place, medal, note or None))
+        self._touch("results", cur.lastrowid, before)
     def edit_result(self, rid, event_id, person_id, category, place, medal, note):
-        category = category or ''
-        self.conn.execute("""UPDATE results SET event_id=?, person_id=?, category=?, place=?, medal=?, note=?
-                             WHERE result_id=?""",(event_id, person_id, category, place, medal or "", note or None, rid))
-        self.conn.commit()
+        category, medal = category or '', self.encode("medal", medal)
+        before = self.conn.total_changes
+        self._write("""UPDATE results SET event_id=?, person_id=?, category=?, place=?, medal=?, note=?
+                             WHERE result_id=?""",(event_id, person_id, category, place, medal, note or None, rid))
+        self._touch("results", rid, before)
     def delete_result(self, rid):
-        self.conn.execute("DELETE FROM results WHERE result_id=?", (rid,)); self.conn.commit()
-
-    # --- общие помощники фильтра для отчётов
-    def _where_events(self, flt):
-        cond, par = [], []
-        if flt.get("date_from"):
-            cond.append("date >= ?"); par.append(flt["date_from"])
-        if flt.get("date_to"):
-            cond.append("date <= ?"); par.append(flt["date_to"])
-        if flt.get("sport"):
-            cond.append("sport = ?"); par.append(flt["sport"])
-        if flt.get("line"):
-            cond.append("line = ?"); par.append(flt["line"])
-        if flt.get("level"):
-            cond.append("level = ?"); par.append(flt["level"])
-        where = "WHERE " + " AND ".join(cond) if cond else ""
-        return where, par
-
-    def _where_results_join(self, flt):
-        cond, par = [], []
-        if flt.get("date_from"):
-            cond.append("e.date >= ?"); par.append(flt["date_from"])
-        if flt.get("date_to"):
-            cond.append("e.date <= ?"); par.append(flt["date_to"])
-        if flt.get("sport"):
-            cond.append("e.sport = ?"); par.append(flt["sport"])
-        if flt.get("line"):
-            cond.append("e.line = ?"); par.append(flt["line"])
-        if flt.get("level"):
-            cond.append("e.level = ?"); par.append(flt["level"])
-        where = "WHERE " + " AND ".join(cond) if cond else ""
-        return where, par
-
-    # --- отчёты
+        before = self.conn.total_changes
+        self._write("DELETE FROM results WHERE result_id=?", (rid,))
+        self._touch("results", rid, before)
+
+    # --- отчёты (фильтры и подсчёты — по кодам перечислений; медали: 1 gold, 2 silver, 3 bronze)
     def medals_summary(self, flt):
-        where, par = self._where_results_join(flt)
-        q = f"""SELECT 
-              SUM(CASE WHEN r.medal='gold'   THEN 1 ELSE 0 END) AS g,
-              SUM(CASE WHEN r.medal='silver' THEN 1 ELSE 0 END) AS s,
-              SUM(CASE WHEN r.medal='bronze' THEN 1 ELSE 0 END) AS b
-            FROM results r JOIN events e ON e.event_id=r.event_id {where}"""
-        row = self._fetchone(q, par) or {"g":0,"s":0,"b":0}
+        rf = ReportFilter.of(flt)
+        if self._columnar(rf): return self.columns.medals_summary(rf)
+        q = self._rsql(rf, """SELECT
+              SUM(CASE WHEN r.medal=1 THEN 1 ELSE 0 END) AS g,
+              SUM(CASE WHEN r.medal=2 THEN 1 ELSE 0 END) AS s,
+              SUM(CASE WHEN r.medal=3 THEN 1 ELSE 0 END) AS b
+            FROM {results} r JOIN {events} e ON e.event_id=r.event_id {where}""")
+        row = self._fetchone(q, rf.params) or {"g":0,"s":0,"b":0}
         return int(row["g"] or 0), int(row["s"] or 0), int(row["b"] or 0)
 
+    def counts_by(self, flt, dims, source="events"):
+        # подсчёт строк по нескольким измерениям одним GROUP BY по их сочетанию
+        # (аналог GROUPING SETS): в Python приходят только группы, а не сырые строки.
+        # Возвращает {измерение: {значение: количество}}.
+        dims = tuple(dims)
+        for d in dims:
+            if d not in GROUP_DIMS: raise ValueError(f"Неизвестное измерение: {d}")
+        if source not in COUNT_SOURCES: raise ValueError(f"Неизвестный источник: {source}")
+        rf = ReportFilter.of(flt)
+        cols = ", ".join(f"{GROUP_DIMS[d]} AS d{i}" for i,d in enumerate(dims))
+        keys = ", ".join(f"d{i}" for i in range(len(dims)))
+        q = self._rsql(rf, f"SELECT {cols}, COUNT(*) AS n FROM {COUNT_SOURCES[source]} {{where}} GROUP BY {keys}")
+        out = {d: {} for d in dims}
+        fmt = [self.enum_names[d].get if d in ENUMS else GROUP_DIM_FORMAT.get(d) for d in dims]
+        for row in self._fetchrows(q, rf.params):
+            n = row[-1]
+            for i,d in enumerate(dims):
+                v = fmt[i](row[i]) if fmt[i] else row[i]
+                out[d][v] = out[d].get(v, 0) + n
+        return out
+
     def events_breakdown(self, flt):
-        where, par = self._where_events(flt)
-        by_level = {k:0 for k in LEVELS if k}
-        by_line  = {k:0 for k in LINES if k}
-        for r in self._fetchall(f"SELECT level, line FROM events {where}", par):
-            if r["level"] in by_level: by_level[r["level"]] += 1
-            if r["line"]  in by_line:  by_line[r["line"]]  += 1
+        c = self.counts_by(flt, ("level", "line"))
+        by_level = {k: c["level"].get(k, 0) for k in LEVELS if k}
+        by_line  = {k: c["line"].get(k, 0)  for k in LINES if k}
         return by_level, by_line
 
     def medals_by_coach(self, flt):
-        where, par = self._where_results_join(flt)
-        q = f"""
+        rf = ReportFilter.of(flt)
+        if self._columnar(rf): return self.columns.medals_by_coach(rf)
+        q = self._rsql(rf, """
         SELECT c.coach_id, c.fio,
-               SUM(CASE WHEN r.medal='gold'   THEN 1 ELSE 0 END) AS g,
-               SUM(CASE WHEN r.medal='silver' THEN 1 ELSE 0 END) AS s,
-               SUM(CASE WHEN r.medal='bronze' THEN 1 ELSE 0 END) AS b,
+               SUM(CASE WHEN r.medal=1 THEN 1 ELSE 0 END) AS g,
+               SUM(CASE WHEN r.medal=2 THEN 1 ELSE 0 END) AS s,
+               SUM(CASE WHEN r.medal=3 THEN 1 ELSE 0 END) AS b,
                COUNT(*)                           AS starts,
                COUNT(DISTINCT e.event_id)         AS events,
                COUNT(DISTINCT p.person_id)        AS athletes
-        FROM results r
-        JOIN events  e ON e.event_id=r.event_id
+        FROM {results} r
+        JOIN {events}  e ON e.event_id=r.event_id
         JOIN persons p ON p.person_id=r.person_id
         JOIN groups  g ON g.group_id=p.group_id
         JOIN coaches c ON c.coach_id=g.coach_id
         {where}
-        GROUP BY c.coach_id, c.fio"""
-        return self._fetchall(q, par)
+        GROUP BY c.coach_id, c.fio""")
+        return self._fetchall(q, rf.params)
 
     # ---- для карточек ----
-    def person_report(self, pid, flt):
-        where, par = self._where_results_join(flt)
-        par = [pid] + par
-        q = f"""
-        SELECT e.date, e.name, e.level, e.line, e.sport, r.category, r.place, r.medal, COALESCE(r.note,'') AS note
-        FROM results r JOIN events e ON e.event_id=r.event_id
-        WHERE r.person_id=? {"AND "+ where[6:] if where else ""}
+    _PERSON_REPORT_SQL = """
+        SELECT e.date, e.name, lv.name AS level, ln.name AS line, sp.name AS sport, r.category, r.place, md.name AS medal,
+               COALESCE(r.note,'') AS note
+        FROM {results} r JOIN {events} e ON e.event_id=r.event_id
+        JOIN enum_level lv ON lv.code=e.level JOIN enum_line ln ON ln.code=e.line JOIN enum_sport sp ON sp.code=e.sport
+        JOIN enum_medal md ON md.code=r.medal
+        WHERE r.person_id=?{cond}
         ORDER BY e.date DESC"""
-        rows = self._fetchall(q, par)
-        return rows
+    _GROUP_REPORT_SQL = """
+        SELECT e.date, e.name, pers.last_name||' '||pers.first_name AS fio, r.category, r.place, md.name AS medal
+        FROM {results} r
+        JOIN {events}  e   ON e.event_id=r.event_id
+        JOIN persons pers ON pers.person_id=r.person_id
+        JOIN enum_medal md ON md.code=r.medal
+        WHERE pers.group_id=?{cond}
+        ORDER BY e.date DESC"""
+    # итоги по стартам; призовой старт = медаль или место 1–3
+    _PRIZE_SUMMARY_SQL = """
+        SELECT COUNT(*) AS starts,
+               SUM(CASE WHEN r.medal=1 THEN 1 ELSE 0 END) AS gold,
+               SUM(CASE WHEN r.medal=2 THEN 1 ELSE 0 END) AS silver,
+               SUM(CASE WHEN r.medal=3 THEN 1 ELSE 0 END) AS bronze,
+               SUM(CASE WHEN r.medal BETWEEN 1 AND 3 OR r.place BETWEEN 1 AND 3 THEN 1 ELSE 0 END) AS prize
+        FROM {{results}} r
+        JOIN {{events}}  e   ON e.event_id=r.event_id
+        JOIN persons pers ON pers.person_id=r.person_id
+        WHERE pers.{key}=?{{cond}}"""
+
+    # все участники одним запросом: строки упорядочены по участнику (индекс idx_persons_name), затем по дате
+    _PERSON_REPORTS_SQL = """
+        SELECT p.person_id, p.last_name, p.first_name, e.date, e.name, lv.name AS level, ln.name AS line, sp.name AS sport,
+               r.category, r.place, md.name AS medal, COALESCE(r.note,'') AS note, r.medal AS medal_code
+        FROM {results} r JOIN {events} e ON e.event_id=r.event_id JOIN persons p ON p.person_id=r.person_id
+        JOIN enum_level lv ON lv.code=e.level JOIN enum_line ln ON ln.code=e.line JOIN enum_sport sp ON sp.code=e.sport
+        JOIN enum_medal md ON md.code=r.medal
+        {where}
+        ORDER BY p.last_name, p.first_name, p.person_id, e.date DESC"""
+    PERSON_REPORT_COLS = ("date", "name", "level", "line", "sport", "category", "place", "medal", "note")
+
+    def iter_person_reports(self, flt, group_id=None):
+        # отчёты всех участников со стартами в рамках фильтра (или только группы) вместо 2N запросов
+        # person_report/person_summary: один упорядоченный проход, по участнику за раз —
+        # (участник, строки как у person_report, итоги как у person_summary)
+        rf = ReportFilter.of(flt)
+        tpl, args = self._PERSON_REPORTS_SQL, rf.params
+        if group_id is not None:
+            tpl, args = tpl.replace("{where}", "WHERE p.group_id=?{cond}"), [group_id] + rf.params
+        for pid, rows in groupby(self.conn.execute(self._rsql(rf, tpl), args), key=lambda r: r["person_id"]):
+            out, summ = [], {"starts": 0, "gold": 0, "silver": 0, "bronze": 0, "prize": 0}
+            for r in rows:
+                out.append({k: r[k] for k in self.PERSON_REPORT_COLS})
+                summ["starts"] += 1
+                medal = r["medal_code"] if r["medal_code"] in (1, 2, 3) else 0     # прочие названия — не медаль
+                if medal: summ[MEDALS[medal]] += 1
+                if medal or (r["place"] is not None and 1 <= r["place"] <= 3): summ["prize"] += 1
+            yield {"person_id": pid, "last_name": r["last_name"], "first_name": r["first_name"]}, out, summ
+
+    def person_report(self, pid, flt):
+        rf = ReportFilter.of(flt)
+        return self._fetchall(self._rsql(rf, self._PERSON_REPORT_SQL), [pid] + rf.params)
+
+    def iter_person_report(self, pid, flt):
+        # потоковый вариант person_report: курсор, строки читаются по мере вывода
+        rf = ReportFilter.of(flt)
+        return self.conn.execute(self._rsql(rf, self._PERSON_REPORT_SQL), [pid] + rf.params)
+
+    def _prize_summary(self, key, id_, flt):
+        rf = ReportFilter.of(flt)
+        if key == "group_id" and self._columnar(rf):   # по участнику быстрее индекс idx_results_person
+            return self.columns.prize_summary(key, id_, rf)
+        row = self._fetchone(self._rsql(rf, self._PRIZE_SUMMARY_SQL.format(key=key)), [id_] + rf.params) or {}
+        return {k: int(row.get(k) or 0) for k in ("starts","gold","silver","bronze","prize")}
 
     def person_summary(self, pid, flt):
-        rows = self.person_report(pid, flt)
-        g = sum(1 for r in rows if r["medal"] == "gold")
-        s = sum(1 for r in rows if r["medal"] == "silver")
-        b = sum(1 for r in rows if r["medal"] == "bronze")
-        prize = sum(1 for r in rows if r["medal"] in ("gold","silver","bronze") or (r["place"] and int(r["place"])<=3))
-        return {"starts": len(rows), "gold": g, "silver": s, "bronze": b, "prize": prize}
+        return self._prize_summary("person_id", pid, flt)
+
+    def group_summary(self, gid, flt):
+        return self._prize_summary("group_id", gid, flt)
 
     def coach_results(self, coach_id, flt):
-        where, par = self._where_results_join(flt)
-        par = [coach_id] + par
-        q = f"""
-        SELECT e.date, e.name AS event_name, 
+        rf = ReportFilter.of(flt)
+        q = self._rsql(rf, """
+        SELECT e.date, e.name AS event_name,
                p.last_name||' '||p.first_name AS fio,
-               r.category, r.place, r.medal, COALESCE(r.note,'') AS note
-        FROM results r
-        JOIN events  e ON e.event_id=r.event_id
+               r.category, r.place, md.name AS medal, COALESCE(r.note,'') AS note
+        FROM {results} r
+        JOIN {events}  e ON e.event_id=r.event_id
         JOIN persons p ON p.person_id=r.person_id
         JOIN groups  g ON g.group_id=p.group_id
-        WHERE g.coach_id=? {"AND "+ where[6:] if where else ""}
-        ORDER BY e.date DESC"""
-        return self._fetchall(q, par)
+        JOIN enum_medal md ON md.code=r.medal
+        WHERE g.coach_id=?{cond}
+        ORDER BY e.date DESC""")
+        return self._fetchall(q, [coach_id] + rf.params)
 
     def coach_summary(self, coach_id, flt):
-        where, par = self._where_results_join(flt)
-        par = [coach_id] + par
-        q = f"""
-        SELECT 
-          SUM(CASE WHEN r.medal='gold'   THEN 1 ELSE 0 END) AS g,
-          SUM(CASE WHEN r.medal='silver' THEN 1 ELSE 0 END) AS s,
-          SUM(CASE WHEN r.medal='bronze' THEN 1 ELSE 0 END) AS b,
+        rf = ReportFilter.of(flt)
+        if self._columnar(rf): return self.columns.coach_summary(coach_id, rf)
+        q = self._rsql(rf, """
+        SELECT
+          SUM(CASE WHEN r.medal=1 THEN 1 ELSE 0 END) AS g,
+          SUM(CASE WHEN r.medal=2 THEN 1 ELSE 0 END) AS s,
+          SUM(CASE WHEN r.medal=3 THEN 1 ELSE 0 END) AS b,
           COUNT(*)                           AS starts,
           COUNT(DISTINCT e.event_id)         AS events,
           COUNT(DISTINCT p.person_id)        AS athletes
-        FROM results r
-        JOIN events  e ON e.event_id=r.event_id
+        FROM {results} r
+        JOIN {events}  e ON e.event_id=r.event_id
         JOIN persons p ON p.person_id=r.person_id
         JOIN groups  g ON g.group_id=p.group_id
-        WHERE g.coach_id=? {"AND "+ where[6:] if where else ""}"""
-        row = self._fetchone(q, par) or {}
+        WHERE g.coach_id=?{cond}""")
+        row = self._fetchone(q, [coach_id] + rf.params) or {}
         for k in ("g","s","b","starts","events","athletes"):
             row[k] = int(row.get(k) or 0)
         return row
 
     def group_report(self, gid, flt):
-        where, par = self._where_results_join(flt)
-        par = [gid] + par
-        q = f"""
-        SELECT e.date, e.name, pers.last_name||' '||pers.first_name AS fio, r.category, r.place, r.medal
-        FROM results r
-        JOIN events  e   ON e.event_id=r.event_id
-        JOIN persons pers ON pers.person_id=r.person_id
-        WHERE pers.group_id=? {"AND "+ where[6:] if where else ""}
-        ORDER BY e.date DESC"""
-        rows = self._fetchall(q, par)
-        return rows
+        rf = ReportFilter.of(flt)
+        return self._fetchall(self._rsql(rf, self._GROUP_REPORT_SQL), [gid] + rf.params)
+
+    def iter_group_report(self, gid, flt):
+        rf = ReportFilter.of(flt)
+        return self.conn.execute(self._rsql(rf, self._GROUP_REPORT_SQL), [gid] + rf.params)
+
+    def group_comparison(self, flt):
+        # все группы одним проходом по results (GROUP BY группы участника): старты, призовые, медали,
+        # активные участники (со стартами) и состав; группы без стартов — с нулями.
+        # Участник считается в своей текущей группе, поэтому итоги тренера — сумма его групп.
+        rf = ReportFilter.of(flt)
+        q = self._rsql(rf, """
+        WITH agg AS (
+            SELECT p.group_id, COUNT(*) AS starts, COUNT(DISTINCT r.person_id) AS athletes,
+                   SUM(CASE WHEN r.medal=1 THEN 1 ELSE 0 END) AS g,
+                   SUM(CASE WHEN r.medal=2 THEN 1 ELSE 0 END) AS s,
+                   SUM(CASE WHEN r.medal=3 THEN 1 ELSE 0 END) AS b,
+                   SUM(CASE WHEN r.medal BETWEEN 1 AND 3 OR r.place BETWEEN 1 AND 3 THEN 1 ELSE 0 END) AS prize
+            FROM {results} r JOIN {events} e ON e.event_id=r.event_id JOIN persons p ON p.person_id=r.person_id
+            WHERE p.group_id IS NOT NULL{cond}
+            GROUP BY p.group_id),
+        members AS (SELECT group_id, COUNT(*) AS n FROM persons WHERE group_id IS NOT NULL GROUP BY group_id)
+        SELECT gr.group_id, gr.name, sp.name AS sport, gr.coach_id, COALESCE(c.fio,'—') AS coach,
+               COALESCE(m.n,0) AS members, COALESCE(a.athletes,0) AS athletes, COALESCE(a.starts,0) AS starts,
+               COALESCE(a.prize,0) AS prize, COALESCE(a.g,0) AS g, COALESCE(a.s,0) AS s, COALESCE(a.b,0) AS b
+        FROM groups gr JOIN enum_sport sp ON sp.code=gr.sport LEFT JOIN coaches c ON c.coach_id=gr.coach_id
+        LEFT JOIN agg a ON a.group_id=gr.group_id LEFT JOIN members m ON m.group_id=gr.group_id
+        ORDER BY gr.name, gr.group_id""")
+        return self._fetchall(q, rf.params)
 
     def yearly_dynamics(self, flt):
-        where_e, par_e = self._where_events(flt)
-        q1 = f"""SELECT substr(e.date,1,4) AS y, COUNT(DISTINCT e.event_id) AS events
-                 FROM events e
-                 WHERE EXISTS (SELECT 1 FROM results r WHERE r.event_id=e.event_id)
-                 {"AND "+ where_e[6:] if where_e else ""}
-                 GROUP BY y ORDER BY y"""
-        starts = {r["y"]: int(r["events"]) for r in self._fetchall(q1, par_e)}
-
-        where_r, par_r = self._where_results_join(flt)
-        q2 = f"""SELECT substr(e.date,1,4) AS y,
-                        SUM(CASE WHEN r.medal='gold'   THEN 1 ELSE 0 END) AS g,
-                        SUM(CASE WHEN r.medal='silver' THEN 1 ELSE 0 END) AS s,
-                        SUM(CASE WHEN r.medal='bronze' THEN 1 ELSE 0 END) AS b
-                 FROM results r JOIN events e ON e.event_id=r.event_id
-                 {where_r}
-                 GROUP BY y ORDER BY y"""
-        medals = {r["y"]: (int(r["g"] or 0), int(r["s"] or 0), int(r["b"] or 0)) for r in self._fetchall(q2, par_r)}
+        rf = ReportFilter.of(flt)
+        if self._columnar(rf): return self.columns.yearly_dynamics(rf)
+        year = GROUP_DIM_FORMAT["year"]
+        q1 = self._rsql(rf, """SELECT e.year AS y, COUNT(*) AS events
+                 FROM {events} e
+                 WHERE EXISTS (SELECT 1 FROM {results} r WHERE r.event_id=e.event_id){cond}
+                 GROUP BY e.year""")
+        starts = {year(r["y"]): int(r["events"]) for r in self._fetchall(q1, rf.params)}
+
+        q2 = self._rsql(rf, """SELECT e.year AS y,
+                        SUM(CASE WHEN r.medal=1 THEN 1 ELSE 0 END) AS g,
+                        SUM(CASE WHEN r.medal=2 THEN 1 ELSE 0 END) AS s,
+                        SUM(CASE WHEN r.medal=3 THEN 1 ELSE 0 END) AS b
+                 FROM {results} r JOIN {events} e ON e.event_id=r.event_id
+                 {where}
+                 GROUP BY e.year""")
+        medals = {year(r["y"]): (int(r["g"] or 0), int(r["s"] or 0), int(r["b"] or 0)) for r in self._fetchall(q2, rf.params)}
 
         years = sorted(set(starts.keys()) | set(medals.keys()))
         rows = []
@@ -371,32 +1470,1501 @@ class Store:
             rows.append({"year": y, "events": starts.get(y,0), "gold": g, "silver": s, "bronze": b, "total_medals": g+s+b})
         return rows
 
+    def season_report(self, flt):
+        rf = ReportFilter.of(flt)
+        q = self._rsql(rf, """
+        SELECT e.event_id, e.date, e.level, e.line, r.person_id, r.medal, c.coach_id, c.fio
+        FROM {events} e
+        LEFT JOIN {results} r ON r.event_id=e.event_id
+        LEFT JOIN persons p ON p.person_id=r.person_id
+        LEFT JOIN groups  g ON g.group_id=p.group_id
+        LEFT JOIN coaches c ON c.coach_id=g.coach_id
+        {where}""")
+        medals = [0, 0, 0]
+        by_level = {k:0 for k in LEVELS if k}
+        by_line  = {k:0 for k in LINES if k}
+        level_name, line_name = self.enum_names["level"], self.enum_names["line"]
+        seen_events, coaches, years = set(), {}, {}
+        for eid, date, level, line, pid, medal, cid, cfio in self.conn.execute(q, rf.params):
+            if eid not in seen_events:
+                seen_events.add(eid)
+                level, line = level_name.get(level), line_name.get(line)
+                if level in by_level: by_level[level] += 1
+                if line  in by_line:  by_line[line]  += 1
+            if pid is None:   # соревнование без результатов
+                continue
+            mi = medal - 1 if medal in (1, 2, 3) else None
+            y = years.get(date[:4])
+            if y is None:
+                y = years[date[:4]] = [set(), 0, 0, 0]
+            y[0].add(eid)
+            if mi is not None:
+                medals[mi] += 1; y[mi+1] += 1
+            if cid is not None:
+                c = coaches.get(cid)
+                if c is None:
+                    c = coaches[cid] = {"coach_id": cid, "fio": cfio, "g": 0, "s": 0, "b": 0, "starts": 0, "events": set(), "athletes": set()}
+                c["starts"] += 1; c["events"].add(eid); c["athletes"].add(pid)
+                if mi is not None: c["gsb"[mi]] += 1
+        for c in coaches.values():
+            c["events"] = len(c["events"]); c["athletes"] = len(c["athletes"])
+        yearly = [{"year": k, "events": len(v[0]), "gold": v[1], "silver": v[2], "bronze": v[3], "total_medals": v[1]+v[2]+v[3]}
+                  for k, v in sorted(years.items())]
+        return SeasonReport(rf.as_dict(), tuple(medals), by_level, by_line,
+                            [coaches[k] for k in sorted(coaches)], yearly)
+
     def event_results(self, event_id):
         q = """
         SELECT e.date, e.name AS event_name, e.level, e.line, e.sport,
                p.last_name||' '||p.first_name AS fio,
                COALESCE(gr.name,'—') AS gname,
                COALESCE(c.fio,'—')  AS coach,
-               r.category, r.place, r.medal, COALESCE(r.note,'') AS note
+               r.category, r.place, md.name AS medal, COALESCE(r.note,'') AS note
         FROM results r
-        JOIN events  e  ON e.event_id=r.event_id
+        JOIN enum_medal md ON md.code=r.medal
+        JOIN events_named e ON e.event_id=r.event_id
         JOIN persons p  ON p.person_id=r.person_id
         LEFT JOIN groups gr ON gr.group_id=p.group_id
         LEFT JOIN coaches c ON c.coach_id=gr.coach_id
         WHERE e.event_id=?
-        ORDER BY COALESCE(r.place, 999999), r.medal DESC, fio"""
+        ORDER BY COALESCE(r.place, 999999), r.medal = 0, r.medal, fio"""
         return self._fetchall(q, (event_id,))
 
+# ------------ Резервные копии ------------
+BACKUP_PAGES = 256          # страниц за шаг backup(): между шагами база открыта для записи
+BACKUP_KEEP = 10            # сколько последних копий хранить
+BACKUP_INTERVAL_MIN = 60    # автокопия в окне — не чаще, и только если база менялась
+
+class Backups:
+    # снимки базы через sqlite3 backup API: страницы копируются шагами из отдельного соединения,
+    # поэтому копию можно снимать в потоке, пока в окне идёт ввод. Восстановление — тот же backup
+    # в обратную сторону: страницы файла, без разбора строк, как при импорте CSV.
+    # Архивы сезонов (Store.archive_season) — отдельные файлы, в копию не входят.
+    def __init__(self, store, folder=None, keep=BACKUP_KEEP):
+        if store.db_path == ":memory:":
+            raise ValueError("Резервные копии работают только с базой в файле")
+        self.store = store
+        self.folder = folder or os.path.join(os.path.dirname(os.path.abspath(store.db_path)), "backups")
+        self.keep = keep
+        self.prefix = os.path.splitext(os.path.basename(store.db_path))[0] + "_"
+
+    def list(self):
+        # копии, новые первыми: [(путь, размер)]
+        if not os.path.isdir(self.folder): return []
+        paths = [os.path.join(self.folder, n) for n in os.listdir(self.folder)
+                 if n.startswith(self.prefix) and n.endswith((".db", ".db.gz"))]
+        return [(p, os.path.getsize(p)) for p in sorted(paths, key=lambda p: (os.path.getmtime(p), p), reverse=True)]
+
+    def create(self, compress=False, progress=None, label="", rotate=True):
+        # progress(осталось, всего страниц) — после каждого шага (вызывается в потоке копирования)
+        os.makedirs(self.folder, exist_ok=True)
+        base = os.path.join(self.folder, self.prefix + dt.now().strftime("%Y%m%d_%H%M%S") + label)
+        path, n = base + ".db", 1
+        while os.path.exists(path) or os.path.exists(path + ".gz"):
+            n += 1; path = f"{base}_{n}.db"
+        part = path + ".part"
+        src, dst = sqlite3.connect(self.store.db_path), sqlite3.connect(part)
+        try:
+            src.backup(dst, pages=BACKUP_PAGES, sleep=0.005,
+                       progress=(lambda status, remaining, total: progress(remaining, total)) if progress else None)
+        finally:
+            dst.close(); src.close()
+        if compress:
+            with io.open(part, "rb") as f, gzip.open(path + ".gz", "wb", compresslevel=6) as z:
+                shutil.copyfileobj(f, z, 1 << 20)
+            os.remove(part); path += ".gz"
+        else:
+            os.replace(part, path)
+        if rotate: self.rotate()
+        return path
+
+    def rotate(self):
+        for path, _ in self.list()[self.keep:]:
+            os.remove(path)
+
+    def restore(self, path):
+        # база заменяется снимком; текущее состояние сначала сохраняется копией *_before_restore
+        tmp = None
+        try:
+            if path.endswith(".gz"):
+                fd, tmp = tempfile.mkstemp(suffix=".db"); os.close(fd)
+                with gzip.open(path, "rb") as z, io.open(tmp, "wb") as f:
+                    shutil.copyfileobj(z, f, 1 << 20)
+            src = sqlite3.connect(tmp or path)
+            try:
+                if not src.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='persons'").fetchone():
+                    raise ValueError(f"Это не копия базы Sports DB: {path}")
+                saved = self.create(label="_before_restore", rotate=False)    # восстанавливаемая копия может быть старейшей
+                src.backup(self.store.conn, pages=0)
+            finally:
+                src.close()
+        finally:
+            if tmp: os.remove(tmp)
+        self.store.reload()     # копия могла быть снята прежней версией: миграции, перечисления, кэши
+        return saved
+
+# ------------ Обслуживание базы ------------
+MAINT_SLICE_MS = 40         # порция работы за один вызов из окна
+MAINT_VACUUM_PAGES = 256    # страниц incremental_vacuum за шаг
+MAINT_IDLE_SEC = 120        # окно начинает обслуживание после такой паузы ввода
+MAINT_CHECK_SEC = 60
+MAINT_ANALYSIS_LIMIT = 1000 # строк на индекс для ANALYZE (PRAGMA analysis_limit)
+
+class Maintenance:
+    # обслуживание порциями: возврат свободных страниц (incremental_vacuum), статистика планировщика
+    # (PRAGMA optimize / ANALYZE) и контрольная точка WAL. steps() — генератор, одна короткая операция
+    # на next(): окно вызывает его из after_idle между событиями, командная строка — подряд.
+    # Перестройка файла (VACUUM) и полный ANALYZE блокируют надолго — только по флагам, т.е. из командной строки.
+    # Итог (место и планы запросов до/после) — в self.report.
+    def __init__(self, store):
+        self.store = store
+        self.report = None
+
+    def stats(self):
+        conn = self.store.conn
+        pragma = lambda name: conn.execute(f"PRAGMA {name}").fetchone()[0]
+        st = {k: pragma(k) for k in ("page_size", "page_count", "freelist_count", "auto_vacuum", "journal_mode")}
+        st["analyzed"] = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name='sqlite_stat1'").fetchone()[0] and \
+                         conn.execute("SELECT COUNT(DISTINCT tbl) FROM sqlite_stat1").fetchone()[0]
+        return st
+
+    def plans(self):
+        # планы типичных отчётов (фильтр по дате, виду и уровню) — чтобы показать, что поменяла статистика
+        rf = ReportFilter({"date_from": "2000-01-01", "sport": SPORTS[1], "level": LEVELS[1]})
+        queries = {
+            "person_report": rf.sql(Store._PERSON_REPORT_SQL),
+            "group_summary": rf.sql(Store._PRIZE_SUMMARY_SQL.format(key="group_id")),
+            "counts_by":     rf.sql(f"SELECT e.year, COUNT(*) FROM {COUNT_SOURCES['results']} {{where}} GROUP BY e.year"),
+        }
+        # только доступ к таблицам данных: поиск по перечислениям и по первичному ключу от статистики не зависит
+        keep = lambda d: d.startswith(("SCAN", "SEARCH")) and "enum_" not in d and "PRIMARY KEY" not in d
+        return {name: "; ".join(r[3] for r in self.store.conn.execute("EXPLAIN QUERY PLAN " + q, [None] * q.count("?")) if keep(r[3]))
+                for name, q in queries.items()}
+
+    def steps(self, vacuum=False, analyze=False):
+        # vacuum — перевести в auto_vacuum=INCREMENTAL (полный VACUUM); analyze — полный ANALYZE.
+        # Без флагов (окно) — только порции incremental_vacuum и PRAGMA optimize с analysis_limit
+        conn = self.store.conn
+        before, plans0, t0 = self.stats(), self.plans(), time.perf_counter()
+        size0 = before["page_count"] * before["page_size"]
+        done = []
+        if before["auto_vacuum"] != 2 and vacuum:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")      # один раз: режим меняется только перестройкой файла
+            done.append("VACUUM"); yield "vacuum"
+        elif before["auto_vacuum"] == 2:
+            while conn.execute("PRAGMA freelist_count").fetchone()[0]:
+                conn.execute(f"PRAGMA incremental_vacuum({MAINT_VACUUM_PAGES})").fetchall()
+                yield "incremental_vacuum"
+            done.append("incremental_vacuum")
+        conn.execute(f"PRAGMA analysis_limit = {MAINT_ANALYSIS_LIMIT}")
+        if analyze:
+            conn.execute("ANALYZE"); done.append("ANALYZE")
+        else:
+            conn.execute("PRAGMA optimize"); done.append("optimize")
+        yield "analyze"
+        if before["journal_mode"] == "wal":
+            conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall(); done.append("wal_checkpoint")
+            yield "checkpoint"
+        after, plans1 = self.stats(), self.plans()
+        self.report = {"done": done, "before": before, "after": after, "sec": time.perf_counter() - t0,
+                       "freed": size0 - after["page_count"] * after["page_size"],
+                       "plans": {k: (plans0[k], plans1[k]) for k in plans0 if plans0[k] != plans1[k]}}
+
+    def run(self, vacuum=False, analyze=False):
+        # командная строка: база без статистики получает полный ANALYZE сразу
+        for _ in self.steps(vacuum, analyze or not self.stats()["analyzed"]): pass
+        return self.report
+
+def maintenance_text(rep):
+    b, a = rep["before"], rep["after"]
+    lines = [f"Обслуживание: {', '.join(rep['done'])} за {rep['sec']:.2f} с",
+             f"Файл: {b['page_count'] * b['page_size'] // 1024} → {a['page_count'] * a['page_size'] // 1024} КБ "
+             f"(освобождено {max(rep['freed'], 0) // 1024} КБ; свободных страниц {b['freelist_count']} → {a['freelist_count']})",
+             f"Статистика планировщика: таблиц {b['analyzed']} → {a['analyzed']}"]
+    if b["auto_vacuum"] != a["auto_vacuum"]:
+        lines.append("Режим auto_vacuum: INCREMENTAL")
+    for name, (p0, p1) in rep["plans"].items():
+        lines.append(f"План {name}: {p0}  →  {p1}")
+    if not rep["plans"]: lines.append("Планы отчётов не изменились")
+    if a["auto_vacuum"] != 2 and a["freelist_count"]:
+        lines.append("Свободные страницы вернёт только полный VACUUM (командная строка: maintain --vacuum)")
+    return "\n".join(lines)
+
+# ------------ Импорт ------------
+# таблица -> (первичный ключ, поля, естественный ключ для строк без id)
+IMPORT_TABLES = {
+    "coaches": ("coach_id",  ["fio","phone"], None),
+    "groups":  ("group_id",  ["name","sport","coach_id"], ["name","sport"]),
+    "persons": ("person_id", ["last_name","first_name","birthdate","address","phone","group_id"], None),
+    "events":  ("event_id",  ["name","date","level","line","sport","location","total_count"], ["name","date","location"]),
+    "results": ("result_id", ["event_id","person_id","category","place","medal","note"], ["event_id","person_id","category"]),
+}
+IMPORT_ORDER = ["coaches","groups","persons","events","results"]
+IMPORT_CHUNK_ROWS = 50000   # строк в одной транзакции при импорте частями
+
+def _int_or_none(v):
+    # не-число оставляем строкой: его отклонит проверка в staging-таблице
+    return (int(v) if v.isdigit() else v) if v else None
+
+def _digits_or_none(v):
+    return int(v) if v.isdigit() else None
+
+# разбор строки файла: get(колонка, индекс по умолчанию) -> очищенная строка
+IMPORT_PARSERS = {
+    "coaches": lambda get: (_int_or_none(get("coach_id")), get("fio",1), get("phone",2) or None),
+    "groups":  lambda get: (_int_or_none(get("group_id")), get("name",1), get("sport",2) or "Ориентирование",
+                            _int_or_none(get("coach_id",3))),
+    "persons": lambda get: (_int_or_none(get("person_id")), get("last_name",1), get("first_name",2),
+                            get("birthdate",3) or None, get("address",4) or None, get("phone",5) or None,
+                            _int_or_none(get("group_id",6))),
+    "events":  lambda get: (_int_or_none(get("event_id")), get("name",1), get("date",2), get("level",3) or "Район",
+                            get("line",4) or "Образование", get("sport",5) or "Ориентирование",
+                            get("location",6) or None, _digits_or_none(get("total_count",7))),
+    "results": lambda get: (_int_or_none(get("result_id")), _int_or_none(get("event_id",1)), _int_or_none(get("person_id",2)),
+                            get("category",3), _digits_or_none(get("place",4)), get("medal",5), get("note",6) or None),
+}
+
+def parse_import_rows(table, header, rows, first_row=2):
+    # строки файла (списки строк) -> кортежи (номер строки, id, поля...) в порядке IMPORT_TABLES
+    idx = {h:i for i,h in enumerate(header)}
+    parse = IMPORT_PARSERS[table]
+    for n, row in enumerate(rows, first_row):
+        def get(name, default=None, row=row):
+            # id-колонки берутся только по заголовку; без него строка вставляется как новая
+            i = idx.get(name, default)
+            if i is None: return ""
+            return row[i].strip() if i < len(row) and row[i] is not None else ""
+        yield (n,) + parse(get)
+
+def xlsx_cell(v):
+    # значение ячейки XLSX -> строка, как в CSV
+    if v is None: return ""
+    if isinstance(v, float) and v.is_integer(): return str(int(v))
+    if isinstance(v, datetime.datetime): return v.date().isoformat()
+    if isinstance(v, datetime.date): return v.isoformat()
+    return str(v)
+
+def find_import_sources(path):
+    # что импортировать из пути: папка с CSV (в т.ч. полный экспорт export_*_<таблица>.csv),
+    # отдельный <таблица>.csv или книга XLSX с листами-таблицами -> [(вид, таблица, путь)]
+    if os.path.isdir(path):
+        sources = []
+        for table in IMPORT_ORDER:
+            files = [os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(f"{table}.csv")]
+            if files:
+                sources.append(("csv", table, max(files, key=os.path.getmtime)))
+        return sources
+    if path.lower().endswith(".xlsx"):
+        wb = openpyxl.load_workbook(path, read_only=True)
+        try: return [("xlsx", t, path) for t in IMPORT_ORDER if t in wb.sheetnames]
+        finally: wb.close()
+    name = os.path.basename(path).lower()
+    return [("csv", t, path) for t in IMPORT_ORDER if name.endswith(f"{t}.csv")][:1]
+
+def read_import_source(src):
+    # разбор одного файла/листа -> (таблица, [кортежи]); выполняется и в дочерних процессах
+    kind, table, path = src
+    if kind == "csv":
+        with io.open(path, "r", encoding="utf-8-sig") as f:
+            r = csv.reader(f, delimiter=';')
+            header = next(r, [])
+            return table, list(parse_import_rows(table, header, r))
+    wb = openpyxl.load_workbook(path, data_only=True, read_only=True)
+    try:
+        rows = wb[table].iter_rows(values_only=True)
+        head = next(rows, None)
+        if head is None: return table, []
+        return table, list(parse_import_rows(table, [xlsx_cell(h) for h in head],
+                                             ([xlsx_cell(v) for v in row] for row in rows)))
+    finally:
+        wb.close()
+
+def file_fingerprint(path):
+    # отпечаток файла для контрольных точек: размер + sha1 первых и последних 1 МБ
+    # (полное хеширование многогигабайтного архива стоило бы ещё одного прохода по файлу)
+    size = os.path.getsize(path)
+    h = hashlib.sha1(str(size).encode())
+    with open(path, "rb") as f:
+        h.update(f.read(1 << 20))
+        if size > 2 << 20:
+            f.seek(-(1 << 20), os.SEEK_END); h.update(f.read())
+    return h.hexdigest()
+
+def _csv_records(f, offset):
+    # записи CSV из двоичного файла с позицией (байт) сразу после каждой записи;
+    # csv.reader забирает ровно те строки, что составляют запись, поэтому pos точен
+    f.seek(offset)
+    pos = [offset]
+    def lines():
+        for raw in f:
+            pos[0] += len(raw)
+            yield raw.decode("utf-8")
+    for rec in csv.reader(lines(), delimiter=';'):
+        yield rec, pos[0]
+
+def _sql_in(values):
+    return "(" + ", ".join("'" + v.replace("'", "''") + "'" for v in values) + ")"
+
+def _fk_missing(col, parent):
+    # ссылка не найдена ни в таблице, ни среди валидных строк того же импорта
+    ppk = IMPORT_TABLES[parent][0]
+    return (f"s.{col} IS NOT NULL AND NOT EXISTS (SELECT 1 FROM {parent} p WHERE p.{ppk}=s.{col})"
+            f" AND NOT EXISTS (SELECT 1 FROM temp.stage_{parent} sp WHERE sp.{ppk}=s.{col} AND sp._err IS NULL)")
+
+def _bad_date(col):
+    # '+0 days' нормализует несуществующие даты (2020-02-30 -> 2020-03-01), и они не совпадут с исходной строкой
+    return f"s.{col} IS NOT NULL AND date(s.{col}, '+0 days') IS NOT s.{col}"
+
+# проверки staging-таблиц: (условие ошибки над строкой s, текст ошибки)
+IMPORT_CHECKS = {
+    "coaches": [
+        ("s.fio = ''", "не указано ФИО"),
+    ],
+    "groups": [
+        ("s.name = ''", "не указано название"),
+        (f"s.sport NOT IN {_sql_in([x for x in SPORTS if x])}", "неизвестный вид спорта"),
+        (_fk_missing("coach_id", "coaches"), "нет тренера с таким coach_id"),
+    ],
+    "persons": [
+        ("s.last_name = '' OR s.first_name = ''", "не указаны фамилия/имя"),
+        (_bad_date("birthdate"), "дата рождения не в формате YYYY-MM-DD"),
+        (_fk_missing("group_id", "groups"), "нет группы с таким group_id"),
+    ],
+    "events": [
+        ("s.name = ''", "не указано название"),
+        (f"s.date = '' OR {_bad_date('date')}", "дата не в формате YYYY-MM-DD"),
+        (f"s.level NOT IN {_sql_in([x for x in LEVELS if x])}", "неизвестный уровень"),
+        (f"s.line NOT IN {_sql_in([x for x in LINES if x])}", "неизвестная линия"),
+        (f"s.sport NOT IN {_sql_in([x for x in SPORTS if x])}", "неизвестный вид спорта"),
+    ],
+    "results": [
+        ("s.event_id IS NULL OR s.person_id IS NULL", "не указаны event_id/person_id"),
+        (f"s.medal NOT IN {_sql_in(MEDALS)}", "неизвестная медаль"),
+        (_fk_missing("event_id", "events"), "нет соревнования с таким event_id"),
+        (_fk_missing("person_id", "persons"), "нет участника с таким person_id"),
+    ],
+}
+
+class Importer:
+    # импорт в три шага, всё в одной транзакции:
+    #   1) строки файла загружаются во временные staging-таблицы;
+    #   2) проверки IMPORT_CHECKS помечают ошибочные строки (_err) целыми наборами, без цикла по строкам;
+    #   3) валидные строки сливаются INSERT ... ON CONFLICT DO UPDATE: существующие строки обновляются
+    #      на месте (без DELETE и каскада на results), строки без изменений не переписываются.
+    # Отклонённые строки остаются в staging до следующего импорта (см. write_rejected).
+    def __init__(self, store):
+        self.store = store
+        self.conn = store.conn
+
+    def import_table(self, table, header, rows, clear=False):
+        return self.import_tables([(table, header, rows)], clear)[table]
+
+    def import_tables(self, items, clear=False):
+        # items: [(table, header, rows)]; обрабатываются в порядке зависимостей
+        items = sorted(items, key=lambda it: IMPORT_ORDER.index(it[0]))
+        return self._run([t for t,_,_ in items], ((t, parse_import_rows(t, h, r)) for t,h,r in items), clear)
+
+    def import_sources(self, sources, clear=False, workers=None):
+        # sources — из find_import_sources. Файлы/листы разбираются параллельно в пуле процессов,
+        # а в БД пишет только этот поток, забирая готовые таблицы в порядке зависимостей:
+        # пока сливается coaches, остальные таблицы ещё разбираются.
+        sources = sorted(sources, key=lambda src: IMPORT_ORDER.index(src[1]))
+        tables = [src[1] for src in sources]
+        if workers == 0 or len(sources) < 2:
+            return self._run(tables, (read_import_source(src) for src in sources), clear)
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers or min(len(sources), os.cpu_count() or 1)) as pool:
+            futures = [pool.submit(read_import_source, src) for src in sources]
+            return self._run(tables, (f.result() for f in futures), clear)
+
+    def import_delta(self, delta):
+        # разность от другой установки (Store.delta_since). Строки в ней — по глобальным ключам uid:
+        # знакомый uid обновляет свою строку, новый вставляется со своим id (строки, созданные на разных
+        # установках с одинаковыми id, не затирают друг друга); ссылки переводятся в свои id после
+        # слияния родительской таблицы. Затем удаления — тоже по uid. Всё одной транзакцией.
+        if delta.get("format") != DELTA_FORMAT:
+            raise ValueError("Это не файл изменений Sports DB этой версии — выгрузите изменения заново")
+        items = sorted(((t, d) for t, d in delta["tables"].items() if t in IMPORT_TABLES), key=lambda it: IMPORT_ORDER.index(it[0]))
+        stats = {}
+        self.conn.execute("BEGIN IMMEDIATE")    # id новым строкам выдаются до вставки — чужая запись не должна вклиниться
+        try:
+            self._reset_stage()
+            for table, d in items:
+                if not d["upsert"]: continue
+                rows, uids = self._delta_rows(table, d["columns"], d["upsert"])
+                self._stage(table, parse_import_rows(table, d["columns"], rows))
+                stats[table] = self.merge_staged(table)
+                self._remember_uids(table, uids)
+            for table, d in reversed(items):    # сначала зависимые: results, events, persons...
+                if not d["delete"]: continue
+                st = stats.setdefault(table, {"total": 0, "inserted": 0, "updated": 0, "unchanged": 0, "rejected": 0})
+                st["deleted"] = self._delete(table, list(self.store.sync_ids(table, [int(u) for u in d["delete"]]).values()))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return stats
+
+    def _delta_rows(self, table, columns, rows):
+        # строки разности: uid строки и ссылок -> свои id (новой строке — следующий свободный id);
+        # неизвестная ссылка -> 0, такую строку отклонит проверка. Возвращает (строки, uid по порядку)
+        pk = IMPORT_TABLES[table][0]
+        ipk = columns.index(pk)
+        refs = {columns.index(c): ref for c, ref in SYNC_REFS.get(table, {}).items() if c in columns}
+        known = {i: self.store.sync_ids(ref, [int(r[i]) for r in rows if r[i]]) for i, ref in refs.items()}
+        ids = self.store.sync_ids(table, [int(r[ipk]) for r in rows])
+        next_id = self.conn.execute(f"SELECT COALESCE(MAX({pk}), 0) FROM {table}").fetchone()[0]
+        out, uids = [], []
+        for r in rows:
+            r, u = list(r), int(r[ipk])
+            if u not in ids:
+                next_id += 1; ids[u] = next_id
+            r[ipk] = str(ids[u]); uids.append(u)
+            for i in refs:
+                if r[i]: r[i] = str(known[i].get(int(r[i]), 0))
+            out.append(r)
+        return out, uids
+
+    def _remember_uids(self, table, uids):
+        # слитым строкам разности — uid источника; строка, совпавшая по естественному ключу с уже
+        # существующей, слилась в неё — uid получает та
+        pk, _, natural = IMPORT_TABLES[table]
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS stage_uids (_row INTEGER PRIMARY KEY, uid INTEGER)")
+        self.conn.execute("DELETE FROM temp.stage_uids")
+        self.conn.executemany("INSERT INTO temp.stage_uids(_row, uid) VALUES(?,?)", enumerate(uids, 2))
+        row_id = f"s.{pk}"
+        if natural:
+            on = " AND ".join(f"t.{c} IS {self._value(table, c)}" for c in natural)
+            row_id = f"COALESCE((SELECT t.{pk} FROM {table} t WHERE t.{pk}=s.{pk} AND {on}), (SELECT MIN(t.{pk}) FROM {table} t WHERE {on}))"
+        self.conn.execute(f"""INSERT OR REPLACE INTO sync_keys(tbl, row_id, uid)
+                              SELECT '{table}', row_id, uid FROM (SELECT {row_id} AS row_id, u.uid AS uid
+                                  FROM temp.stage_{table} s JOIN temp.stage_uids u ON u._row=s._row WHERE s._err IS NULL)
+                              WHERE row_id IS NOT NULL""")
+
+    def _delete(self, table, ids):
+        pk = IMPORT_TABLES[table][0]
+        return sum(self.conn.execute(f"DELETE FROM {table} WHERE {pk} IN ({','.join('?'*len(ids[k:k+500]))})",
+                                     ids[k:k+500]).rowcount for k in range(0, len(ids), 500))
+
+    def _run(self, tables, parsed, clear):
+        # parsed: итератор (таблица, кортежи) в порядке IMPORT_ORDER
+        stats = {}
+        self.conn.execute("BEGIN")
+        try:
+            self._reset_stage()
+            if clear:
+                for table in reversed(tables):
+                    self.conn.execute(f"DELETE FROM {table}")
+            for table, tuples in parsed:
+                self._stage(table, tuples)
+                stats[table] = self.merge_staged(table)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return stats
+
+    # --- строки другого источника (протокол IOF): копятся в staging частями внутри транзакции
+    # вызывающего и сливаются одним merge_staged — с теми же проверками, что и файлы
+    def stage(self, table, tuples, reset=False):
+        # tuples — как у parse_import_rows: (номер строки, id, поля...); reset — перед первой частью
+        if reset: self._reset_stage()
+        self._stage(table, tuples)
+
+    def merge_staged(self, table):
+        # проверка и слияние накопленного в staging -> статистика как у import_table
+        rejected = self._validate(table)
+        return dict(self._merge(table), rejected=rejected)
+
+    def _reset_stage(self):
+        for table in IMPORT_ORDER:
+            pk, fields, _ = IMPORT_TABLES[table]
+            self.conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS stage_{table} (_row, {', '.join([pk] + fields)}, _err)")
+            self.conn.execute(f"DELETE FROM temp.stage_{table}")
+
+    def _stage(self, table, tuples):
+        pk, fields, _ = IMPORT_TABLES[table]
+        cols = ["_row", pk] + fields
+        self.conn.executemany(f"INSERT INTO temp.stage_{table}({', '.join(cols)}) VALUES ({','.join('?'*len(cols))})", tuples)
+
+    def _validate(self, table):
+        pk, fields, _ = IMPORT_TABLES[table]
+        st = f"temp.stage_{table}"
+        def mark(cond, msg):
+            self.conn.execute(f"UPDATE {st} AS s SET _err = COALESCE(_err || '; ', '') || ? WHERE {cond}", (msg,))
+        for col in [pk] + [c for c in fields if c.endswith("_id")]:
+            mark(f"typeof(s.{col}) = 'text'", f"{col}: не число")
+        for cond, msg in IMPORT_CHECKS[table]:
+            mark(cond, msg)
+        return self.conn.execute(f"SELECT COUNT(*) FROM {st} WHERE _err IS NOT NULL").fetchone()[0]
+
+    @staticmethod
+    def _value(table, c):
+        # столбец строки staging s в виде для таблицы: в staging названия перечислений, в таблице — их коды
+        kind = ENUM_COLUMNS.get(table, {}).get(c)
+        return f"(SELECT code FROM enum_{kind} WHERE name=s.{c})" if kind else f"s.{c}"
+
+    def _merge(self, table):
+        pk, fields, natural = IMPORT_TABLES[table]
+        st = f"temp.stage_{table}"
+        ok = "_err IS NULL"
+        one = lambda q: self.conn.execute(q).fetchone()[0]
+        val = lambda c: self._value(table, c)
+        total = one(f"SELECT COUNT(*) FROM {st} WHERE {ok}")
+        # вставленные — по приросту строк таблицы: строка с новым id, совпавшая по естественному ключу
+        # с существующей, обновляет её, а не добавляет новую
+        before = one(f"SELECT COUNT(*) FROM {table}")
+
+        def upsert(target, upd):
+            if not upd: return f" ON CONFLICT({target}) DO NOTHING"
+            sets = ", ".join(f"{c}=excluded.{c}" for c in upd)
+            changed = " OR ".join(f"{table}.{c} IS NOT excluded.{c}" for c in upd)
+            return f" ON CONFLICT({target}) DO UPDATE SET {sets} WHERE {changed}"
+
+        # rowcount — строки самой таблицы (без записей триггеров, в отличие от total_changes)
+        cols = ", ".join([pk] + fields)
+        vals = ", ".join(val(c) for c in [pk] + fields)
+        q = f"INSERT INTO {table}({cols}) SELECT {vals} FROM {st} s WHERE {pk} IS NOT NULL AND {ok} ORDER BY _row" + upsert(pk, fields)
+        if natural:
+            q += upsert(", ".join(natural), [c for c in fields if c not in natural])
+        changes = self.conn.execute(q).rowcount
+        cols, vals = ", ".join(fields), ", ".join(val(c) for c in fields)
+        q = f"INSERT INTO {table}({cols}) SELECT {vals} FROM {st} s WHERE {pk} IS NULL AND {ok} ORDER BY _row"
+        if natural:
+            q += upsert(", ".join(natural), [c for c in fields if c not in natural])
+        changes += self.conn.execute(q).rowcount
+        inserted = one(f"SELECT COUNT(*) FROM {table}") - before
+        updated = max(changes - inserted, 0)
+        return {"total": total, "inserted": inserted, "updated": updated, "unchanged": total - inserted - updated}
+
+    def write_rejected(self, table, path, append=False):
+        # отклонённые строки последнего импорта: те же колонки, что в шаблоне (файл можно исправить
+        # и импортировать повторно) + номер строки исходного файла и причина
+        pk, fields, _ = IMPORT_TABLES[table]
+        cur = self.conn.execute(f"SELECT {', '.join([pk] + fields)}, _row, _err FROM temp.stage_{table} "
+                                f"WHERE _err IS NOT NULL ORDER BY _row")
+        append = append and os.path.exists(path)
+        with io.open(path, "a" if append else "w", encoding="utf-8" if append else "utf-8-sig", newline="") as f:
+            w = csv.writer(f, delimiter=';')
+            if not append: w.writerow([pk] + fields + ["_row", "_error"])
+            for row in cur:
+                w.writerow(["" if v is None else v for v in row])
+
+    # --- импорт больших CSV частями с контрольными точками
+    def find_checkpoint(self, table, path):
+        return self.store._fetchone("SELECT * FROM import_checkpoints WHERE file_hash=? AND table_name=?",
+                                    (file_fingerprint(path), table))
+
+    def import_csv_chunked(self, table, path, chunk=IMPORT_CHUNK_ROWS, clear=False, resume=True, rejected_path=None, progress=None):
+        # каждые chunk строк — отдельная транзакция: staging -> проверка -> слияние -> контрольная точка.
+        # После сбоя повторный вызов продолжает с сохранённой позиции в файле (resume=True).
+        fp = file_fingerprint(path)
+        cp = self.find_checkpoint(table, path) if resume else None
+        if cp and cp["done"]:
+            cp = None   # файл уже загружен целиком — загружаем заново (слияние идемпотентно)
+        tot = {k: (cp[k] if cp else 0) for k in ("inserted","updated","unchanged","rejected")}
+        row_no = cp["row_no"] if cp else 0
+        with open(path, "rb") as f:
+            records = _csv_records(f, 0)
+            header, offset = next(records, ([], 0))
+            if header: header[0] = header[0].lstrip("\ufeff")
+            if cp:
+                offset = cp["byte_offset"]
+                records = _csv_records(f, offset)
+            first = not cp
+            while True:
+                batch = []
+                for rec, offset in records:
+                    batch.append(rec)
+                    if len(batch) >= chunk: break
+                if not batch and not first:
+                    # файл кончился ровно на границе части
+                    self.conn.execute("UPDATE import_checkpoints SET done=1 WHERE file_hash=? AND table_name=?", (fp, table))
+                    self.conn.commit()
+                    break
+                tuples = parse_import_rows(table, header, batch, first_row=row_no + 2)
+                self.conn.execute("BEGIN")
+                try:
+                    self._reset_stage()
+                    if first and clear:
+                        self.conn.execute(f"DELETE FROM {table}")
+                    self._stage(table, tuples)
+                    st = self.merge_staged(table)
+                    rejected = st["rejected"]
+                    for k in tot: tot[k] += st[k]
+                    row_no += len(batch)
+                    self.conn.execute("""INSERT INTO import_checkpoints(file_hash,table_name,path,byte_offset,row_no,
+                                            inserted,updated,unchanged,rejected,done,updated_at)
+                                         VALUES(?,?,?,?,?,?,?,?,?,?,datetime('now'))
+                                         ON CONFLICT(file_hash,table_name) DO UPDATE SET path=excluded.path,
+                                            byte_offset=excluded.byte_offset, row_no=excluded.row_no,
+                                            inserted=excluded.inserted, updated=excluded.updated,
+                                            unchanged=excluded.unchanged, rejected=excluded.rejected,
+                                            done=excluded.done, updated_at=excluded.updated_at""",
+                                      (fp, table, os.path.abspath(path), offset, row_no, tot["inserted"], tot["updated"],
+                                       tot["unchanged"], tot["rejected"], int(len(batch) < chunk)))
+                    self.conn.execute("COMMIT")
+                except Exception:
+                    self.conn.execute("ROLLBACK")
+                    raise
+                if rejected and rejected_path:
+                    self.write_rejected(table, rejected_path, append=not first)
+                first = False
+                if progress: progress(row_no)
+                if len(batch) < chunk: break
+        return dict(tot, total=tot["inserted"] + tot["updated"] + tot["unchanged"], rows=row_no)
+
+# --- IOF XML 3.0 (ResultList) — протоколы ориентирования
+def _norm_name(s):
+    return " ".join((s or "").split()).lower().replace("ё", "е")
+
+def _xml_tag(elem):
+    t = elem.tag
+    return t.rsplit("}", 1)[1] if "}" in t else t
+
+def _xml_text(elem, *path):
+    # текст вложенного элемента по локальным именам тегов (без пространства имён)
+    for name in path:
+        if elem is None: return ""
+        elem = next((c for c in elem if _xml_tag(c) == name), None)
+    return (elem.text or "").strip() if elem is not None else ""
+
+class IofImporter:
+    # потоковый импорт протокола IOF XML 3.0 ResultList: iterparse + очистка разобранных элементов,
+    # поэтому память не зависит от размера протокола. Класс -> results.category,
+    # Position -> place, Person -> persons (сопоставление по фамилии/имени и дате рождения).
+    # Результаты копятся пачками в staging-таблице и сливаются обычным путём Importer
+    # (проверки + ON CONFLICT DO UPDATE), т.е. повторный импорт протокола обновляет места.
+    BATCH = 1000
+
+    def __init__(self, store):
+        self.store = store
+        self.conn = store.conn
+        self.importer = Importer(store)
+
+    def _person_index(self):
+        # один проход по persons: (фамилия, имя) -> [(person_id, дата рождения)]
+        idx = {}
+        for pid, last, first, bd in self.conn.execute("SELECT person_id, last_name, first_name, birthdate FROM persons"):
+            idx.setdefault((_norm_name(last), _norm_name(first)), []).append((pid, bd))
+        return idx
+
+    @staticmethod
+    def _match(cands, birthdate):
+        if not cands: return None
+        if birthdate:
+            same = [pid for pid, bd in cands if bd == birthdate]
+            if same: return same[0]
+            cands = [c for c in cands if not c[1]]   # с другой датой рождения — другой человек
+        return cands[0][0] if len(cands) == 1 else None
+
+    def _event(self, name, date, event_id, level, line, sport):
+        if event_id: return event_id
+        if not name or not date:
+            raise ValueError("В протоколе нет названия/даты соревнования — укажите соревнование вручную")
+        row = self.conn.execute("SELECT event_id FROM events WHERE name=? AND date=? ORDER BY event_id LIMIT 1", (name, date)).fetchone()
+        if row: return row[0]
+        return self.store.add_event(name, date, level, line, sport, None, None)
+
+    def import_file(self, path, event_id=None, create_persons=False, level="Район", line="Спорт", sport="Ориентирование"):
+        import xml.etree.ElementTree as ET
+        people = self._person_index()
+        st = {"rows": 0, "matched": 0, "created": 0, "skipped": 0}
+        eid = event_id
+        ev_name = ev_date = category = ""
+        batch, root = [], None
+        self.conn.execute("BEGIN")
+        try:
+            self.importer.stage("results", [], reset=True)
+            for kind, elem in ET.iterparse(path, events=("start", "end")):
+                tag = _xml_tag(elem)
+                if kind == "start":
+                    if root is None: root = elem
+                    continue
+                if tag == "Event" and not ev_name:
+                    ev_name = _xml_text(elem, "Name")
+                    ev_date = _xml_text(elem, "StartTime", "Date")[:10]
+                elif tag == "Class":
+                    category = _xml_text(elem, "Name")
+                elif tag == "PersonResult":
+                    if eid is None:
+                        eid = self._event(ev_name, ev_date, None, level, line, sport)
+                    st["rows"] += 1
+                    last  = _xml_text(elem, "Person", "Name", "Family")
+                    first = _xml_text(elem, "Person", "Name", "Given")
+                    bd    = _xml_text(elem, "Person", "BirthDate")[:10] or None
+                    key = (_norm_name(last), _norm_name(first))
+                    pid = self._match(people.get(key), bd)
+                    if pid is None and create_persons and last and first:
+                        pid = self.store.add_person(last, first, bd, None, None, None)
+                        people.setdefault(key, []).append((pid, bd)); st["created"] += 1
+                    elif pid is not None:
+                        st["matched"] += 1
+                    if pid is None:
+                        st["skipped"] += 1
+                    else:
+                        res = next((c for c in elem if _xml_tag(c) == "Result"), None)
+                        pos, status = _xml_text(res, "Position"), _xml_text(res, "Status")
+                        place = int(pos) if pos.isdigit() and status in ("", "OK") else None
+                        note = status if status not in ("", "OK") else None
+                        batch.append((st["rows"], None, eid, pid, category, place, "", note))
+                        if len(batch) >= self.BATCH:
+                            self.importer.stage("results", batch); batch = []
+                    elem.clear()
+                elif tag == "ClassResult":
+                    elem.clear()
+                    if root is not None: root.clear()
+                    category = ""
+            if eid is None:
+                eid = self._event(ev_name, ev_date, None, level, line, sport)
+            self.importer.stage("results", batch)
+            self.conn.execute("UPDATE events SET total_count=? WHERE event_id=? AND total_count IS NULL", (st["rows"], eid))
+            st.update(self.importer.merge_staged("results"), event_id=eid)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return st
+
+def iof_stats_text(st):
+    return (f"Участников в протоколе: {st['rows']}; найдено в базе: {st['matched']}, добавлено: {st['created']}, "
+            f"пропущено (не наши): {st['skipped']}\n" + import_stats_text({"results": st}))
+
+def import_stats_text(stats):
+    return "\n".join(f"{t}: добавлено {s['inserted']}, обновлено {s['updated']}, без изменений {s['unchanged']}"
+                     + (f", удалено {s['deleted']}" if s.get("deleted") else "")
+                     + (f", отклонено {s['rejected']}" if s.get("rejected") else "")
+                     for t, s in stats.items())
+
+def write_delta(path, delta):
+    with io.open(path, "w", encoding="utf-8") as f:
+        json.dump(delta, f, ensure_ascii=False)
+
+def read_delta(path):
+    with io.open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+# ------------ Дубли участников ------------
+_PHON_MAP = str.maketrans({"й":"и", "ы":"и", "э":"е", "ю":"у", "я":"а", "о":"а", "ъ":None, "ь":None,
+                           "б":"п", "в":"ф", "г":"к", "д":"т", "ж":"ш", "з":"с", "щ":"ш"})
+
+def phonetic_key(s):
+    # грубая русская фонетика: оглушение, редукция гласных, без ъ/ь и удвоений
+    # (Иваноф ~ Иванов, Соловьёв ~ Саловьев, Аннна ~ Анна)
+    s = "".join(ch for ch in _norm_name(s).translate(_PHON_MAP) if ch.isalpha())
+    return "".join(ch for i,ch in enumerate(s) if i == 0 or ch != s[i-1])
+
+def person_block_keys(last, first, birthdate):
+    # ключи блокировки: кандидаты в дубли — только участники с общим ключом
+    pl, pf = phonetic_key(last), phonetic_key(first)
+    keys = set()
+    if pl and pf: keys.update((f"n:{pl}|{pf}", f"n:{pf}|{pl}"))    # фамилия+имя, в т.ч. перепутанные
+    if birthdate:
+        if pf: keys.add(f"b:{birthdate}|{pf}")    # сменили фамилию или опечатка в ней
+        if pl: keys.add(f"b:{birthdate}|{pl}")    # опечатка или уменьшительная форма имени
+    return keys
+
+def person_similarity(a, b):
+    # a, b: (фамилия, имя, дата рождения) -> 0..1
+    from difflib import SequenceMatcher
+    sim = lambda x, y: SequenceMatcher(None, _norm_name(x), _norm_name(y)).ratio()
+    straight = 0.6*sim(a[0], b[0]) + 0.4*sim(a[1], b[1])
+    swapped  = 0.6*sim(a[0], b[1]) + 0.4*sim(a[1], b[0])
+    score = max(straight, swapped)
+    if a[2] and b[2]:
+        score = min(1.0, score + 0.15) if a[2] == b[2] else score * 0.6
+    return round(score, 3)
+
+class PersonDedup:
+    # поиск дублей по индексу блокировки person_keys вместо сравнения всех пар
+    THRESHOLD = 0.85
+    MAX_BLOCK = 200     # слишком частые ключи (однофамильцы) не дают кандидатов
+
+    def __init__(self, store):
+        self.store = store
+        self.conn = store.conn
+
+    def refresh_keys(self):
+        # пересчитать ключи помеченных участников; возвращает их число
+        dirty = [r[0] for r in self.conn.execute("SELECT person_id FROM person_keys_dirty")]
+        if not dirty: return 0
+        with self.conn:
+            for i in range(0, len(dirty), 500):
+                ids = dirty[i:i+500]; ph = ",".join("?"*len(ids))
+                self.conn.execute(f"DELETE FROM person_keys WHERE person_id IN ({ph})", ids)
+                rows = self.conn.execute(f"SELECT person_id, last_name, first_name, birthdate FROM persons WHERE person_id IN ({ph})", ids).fetchall()
+                self.conn.executemany("INSERT OR IGNORE INTO person_keys(key, person_id) VALUES(?,?)",
+                                      [(k, r[0]) for r in rows for k in person_block_keys(r[1], r[2], r[3])])
+                self.conn.execute(f"DELETE FROM person_keys_dirty WHERE person_id IN ({ph})", ids)
+        return len(dirty)
+
+    def _persons(self, ids):
+        out = {}
+        ids = list(ids)
+        for i in range(0, len(ids), 500):
+            part = ids[i:i+500]
+            for r in self.conn.execute(f"""SELECT p.person_id, p.last_name, p.first_name, p.birthdate,
+                                                  COALESCE(g.name,'—') AS gname,
+                                                  (SELECT COUNT(*) FROM results r WHERE r.person_id=p.person_id) AS starts
+                                           FROM persons p LEFT JOIN groups g ON g.group_id=p.group_id
+                                           WHERE p.person_id IN ({','.join('?'*len(part))})""", part):
+                out[r[0]] = dict(r)
+        return out
+
+    def candidates_for(self, last, first, birthdate=None, exclude=None):
+        # похожие на вводимого участника (проверка при добавлении)
+        self.refresh_keys()
+        keys = list(person_block_keys(last, first, birthdate))
+        if not keys: return []
+        ids = {r[0] for r in self.conn.execute(
+            f"SELECT DISTINCT person_id FROM person_keys WHERE key IN ({','.join('?'*len(keys))})", keys)}
+        ids.discard(exclude)
+        out = []
+        for p in self._persons(ids).values():
+            score = person_similarity((last, first, birthdate), (p["last_name"], p["first_name"], p["birthdate"]))
+            if score >= self.THRESHOLD:
+                out.append(dict(p, score=score))
+        return sorted(out, key=lambda p: -p["score"])
+
+    def find_duplicates(self, threshold=None):
+        # группы вероятных дублей: пары берутся только из общих блоков, затем объединяются в кластеры
+        threshold = threshold or self.THRESHOLD
+        self.refresh_keys()
+        # разные даты рождения дают не больше 0.6 — такие пары отсекаются ещё в SQL
+        pairs = self.conn.execute("""
+            SELECT DISTINCT a.person_id, b.person_id
+            FROM person_keys a JOIN person_keys b ON b.key=a.key AND b.person_id > a.person_id
+            JOIN persons pa ON pa.person_id=a.person_id JOIN persons pb ON pb.person_id=b.person_id
+            WHERE a.key IN (SELECT key FROM person_keys GROUP BY key HAVING COUNT(*) BETWEEN 2 AND ?)
+              AND (? <= 0.6 OR pa.birthdate IS NULL OR pb.birthdate IS NULL OR pa.birthdate=pb.birthdate)""",
+            (self.MAX_BLOCK, threshold)).fetchall()
+        people = self._persons({x for pr in pairs for x in pr})
+        parent, dates = {}, {pid: {p["birthdate"]} - {None} for pid, p in people.items()}
+        def find(x):
+            while parent.get(x, x) != x:
+                parent[x] = parent.get(parent[x], parent[x]); x = parent[x]
+            return x
+        best = {}
+        scored = []
+        for a, b in pairs:
+            pa, pb = people[a], people[b]
+            score = person_similarity((pa["last_name"], pa["first_name"], pa["birthdate"]),
+                                      (pb["last_name"], pb["first_name"], pb["birthdate"]))
+            if score >= threshold: scored.append((score, a, b))
+        for score, a, b in sorted(scored, reverse=True):
+            ra, rb = find(a), find(b)
+            if ra != rb:
+                # кластер не склеивает разные даты рождения (через запись без даты)
+                if len(dates[ra] | dates[rb]) > 1: continue
+                lo, hi = min(ra, rb), max(ra, rb)
+                parent[hi] = lo; dates[lo] |= dates.pop(hi)
+            best[a] = max(best.get(a, 0), score); best[b] = max(best.get(b, 0), score)
+        clusters = {}
+        for pid in best:
+            clusters.setdefault(find(pid), []).append(dict(people[pid], score=best[pid]))
+        out = []
+        for members in clusters.values():
+            # первым — кого оставить: больше стартов, затем меньший id
+            members.sort(key=lambda p: (-p["starts"], p["person_id"]))
+            out.append(members)
+        return sorted(out, key=lambda m: (m[0]["last_name"], m[0]["first_name"]))
+
+    def merge(self, groups):
+        # groups: [(оставляемый person_id, [дубли])] — одной транзакцией вместе с архивами сезонов
+        # (подключённые базы в общей транзакции соединения: при ошибке не остаётся наполовину слитых).
+        # Результаты дублей переводятся на оставляемого; совпадающие (то же соревнование и категория)
+        # удаляются; пустые поля оставляемого дополняются из дублей.
+        groups = [(keep, [d for d in dups if d != keep]) for keep, dups in groups]
+        groups = [(keep, dups) for keep, dups in groups if dups]
+        if len(self.store.archives) > ARCHIVE_ATTACH_MAX:
+            raise ValueError(f"Архивов сезонов: {len(self.store.archives)}, для слияния дублей их подключают все сразу, "
+                             f"а можно {ARCHIVE_ATTACH_MAX}")
+        schemas = self.store._attach(tuple(self.store.archives))   # ATTACH — только вне транзакции
+        merged = 0
+        with self.conn:
+            for keep, dups in groups:
+                ph = ",".join("?"*len(dups))
+                for s in schemas:   # история в архивах сезонов
+                    self.conn.execute(f"UPDATE OR IGNORE {s}.results SET person_id=? WHERE person_id IN ({ph})", [keep] + dups)
+                    self.conn.execute(f"DELETE FROM {s}.results WHERE person_id IN ({ph})", dups)
+                self.conn.execute(f"UPDATE OR IGNORE results SET person_id=? WHERE person_id IN ({ph})", [keep] + dups)
+                for col in ("birthdate", "address", "phone", "group_id"):
+                    self.conn.execute(f"""UPDATE persons SET {col}=(SELECT d.{col} FROM persons d WHERE d.person_id IN ({ph})
+                                                                 AND d.{col} IS NOT NULL ORDER BY d.person_id LIMIT 1)
+                                          WHERE person_id=? AND {col} IS NULL""", dups + [keep])
+                self.conn.execute(f"DELETE FROM persons WHERE person_id IN ({ph})", dups)   # остаток results — каскадом
+                merged += len(dups)
+        return merged
+
+# ------------ Отчёты: модель и вывод ------------
+class ReportTable:
+    # таблица отчёта. rows — список кортежей либо функция, возвращающая итератор
+    # (тогда строки читаются из БД потоком при каждом выводе: текст, CSV, XLSX).
+    # text_fmt — как показать строку в текстовом поле; empty — текст для пустой таблицы.
+    def __init__(self, title, columns, rows=(), text_fmt=None, empty="  —"):
+        self.title    = title
+        self.columns  = columns
+        self.rows     = rows
+        self.text_fmt = text_fmt
+        self.empty    = empty
+
+    def iter_rows(self):
+        return iter(self.rows() if callable(self.rows) else self.rows)
+
+    def format_row(self, row):
+        if self.text_fmt: return self.text_fmt(row)
+        if len(self.columns) == 2: return f"  {row[0]}: {row[1]}"
+        return "  " + " — ".join(str(v) for v in row if v not in (None, ""))
+
+class Report:
+    # отчёт = заголовок + таблицы + итоговые строки (footer — список или функция)
+    def __init__(self, title, tables=(), footer=()):
+        self.title  = title
+        self.tables = list(tables)
+        self.footer = footer
+
+    def footer_lines(self):
+        return list(self.footer() if callable(self.footer) else self.footer)
+
+def _cell(v):
+    return "" if v is None else v
+
+def report_to_text(rep):
+    lines = [rep.title] if rep.title else []
+    for t in rep.tables:
+        if lines: lines.append("")
+        if t.title: lines.append(t.title)
+        n = 0
+        for row in t.iter_rows():
+            lines.append(t.format_row(row).rstrip()); n += 1
+        if not n and t.empty: lines.append(t.empty)
+    foot = rep.footer_lines()
+    if foot: lines += [""] + foot
+    return "\n".join(lines)
+
+def _report_grid(rep):
+    # построчная раскладка отчёта для табличных форматов (CSV/XLSX), без накопления строк
+    if rep.title: yield [rep.title]
+    for t in rep.tables:
+        yield []
+        if t.title: yield [t.title.rstrip(":")]
+        yield list(t.columns)
+        for row in t.iter_rows():
+            yield [_cell(v) for v in row]
+    foot = rep.footer_lines()
+    if foot:
+        yield []
+        for line in foot: yield [line]
+
+def report_to_txt(rep, path):
+    with io.open(path, "w", encoding="utf-8") as f:
+        f.write(report_to_text(rep))
+
+def report_to_csv(rep, path):
+    with io.open(path, "w", encoding="utf-8-sig", newline="") as f:
+        csv.writer(f, delimiter=';').writerows(_report_grid(rep))
+
+def report_to_xlsx(rep, path):
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title="report")
+    for row in _report_grid(rep): ws.append(row)
+    wb.save(path)
+
+REPORT_WRITERS = {"txt": (".txt", report_to_txt), "csv": (".csv", report_to_csv), "xlsx": (".xlsx", report_to_xlsx)}
+
+def _prize_footer(s, label):
+    if not s["starts"]: return []
+    return [f"Итого {label}: {s['starts']}; призовых: {s['prize']}; доля призовых: {round(s['prize']*100/s['starts'],1)}%"]
+
+def _result_line(date, name, extra, category, place, medal):
+    pm = f", место {place}" if place else ""
+    return f"  {date} — {name}{extra} — {category}{pm} {medal or ''}"
+
+class ReportBuilder:
+    # отчёты вкладки «Отчёты» в виде Report — общий источник для экрана, CSV/XLSX и командной строки
+    def __init__(self, store):
+        self.store = store
+
+    def medals(self, flt, medals=None):
+        g,s,b = medals or self.store.medals_summary(flt)
+        return Report("", [ReportTable("Медальный зачёт (с учётом фильтра):", ["Медаль","Количество"],
+                                       [("Золото",g),("Серебро",s),("Бронза",b),("Всего",g+s+b)])])
+
+    def events_breakdown(self, flt, data=None):
+        by_level, by_line = data or self.store.events_breakdown(flt)
+        return Report("", [
+            ReportTable("Соревнования по уровням:", ["Уровень","Количество"], [(k, by_level.get(k,0)) for k in LEVELS if k]),
+            ReportTable("Соревнования по линиям:",  ["Линия","Количество"],   [(k, by_line.get(k,0))  for k in LINES if k]),
+        ])
+
+    def coaches(self, flt, rows=None):
+        rows = self.store.medals_by_coach(flt) if rows is None else rows
+        rows = sorted(rows, key=lambda r: (r["g"], r["s"], r["b"], r["starts"]), reverse=True)
+        return Report("", [ReportTable(
+            "Итоги по тренерам:" if rows else "",
+            ["Тренер","Золото","Серебро","Бронза","Стартов","Соревнований","Участников"],
+            [(r["fio"], r["g"], r["s"], r["b"], r["starts"], r["events"], r["athletes"]) for r in rows],
+            text_fmt=lambda r: f"  {r[0]}: золото {r[1]}, серебро {r[2]}, бронза {r[3]}, стартов {r[4]}, соревнований {r[5]}, участников {r[6]}",
+            empty="Нет данных по тренерам в рамках фильтра.")])
+
+    def yearly(self, flt, rows=None):
+        rows = self.store.yearly_dynamics(flt) if rows is None else rows
+        return Report("", [ReportTable(
+            "Динамика по годам:" if rows else "",
+            ["Год","Стартов","Медалей","Золото","Серебро","Бронза"],
+            [(r["year"], r["events"], r["total_medals"], r["gold"], r["silver"], r["bronze"]) for r in rows],
+            text_fmt=lambda r: f"  {r[0]}: стартов {r[1]}, медалей {r[2]} (зол {r[3]}, сер {r[4]}, бронз {r[5]})",
+            empty="Нет данных для построения динамики.")])
+
+    def season(self, flt):
+        rep = self.store.season_report(flt)
+        parts = [self.medals(flt, rep.medals), self.events_breakdown(flt, (rep.by_level, rep.by_line)),
+                 self.coaches(flt, rep.coaches), self.yearly(flt, rep.yearly)]
+        return Report("Сводный отчёт за сезон", [t for p in parts for t in p.tables])
+
+    def person(self, pid, flt, data=None):
+        # data — (участник, строки, итоги) из Store.iter_person_reports: база не читается
+        pers, rows, summ = data or (self.store.get_person(pid), None, None)
+        if not pers: return None
+        if summ is None: summ = self.store.person_summary(pid, flt)
+        cols = Store.PERSON_REPORT_COLS[:8]
+        return Report(f"Участник: {pers['last_name']} {pers['first_name']}", [ReportTable(
+            "Старты:", ["Дата","Соревнование","Уровень","Линия","Вид спорта","Категория","Место","Медаль"],
+            (lambda: (tuple(r)[:8] for r in self.store.iter_person_report(pid, flt))) if rows is None
+            else [tuple(r[k] for k in cols) for r in rows],
+            text_fmt=lambda r: _result_line(r[0], r[1], f" ({r[2]}, {r[3]}, {r[4]})", r[5], r[6], r[7]),
+            empty="  Нет стартов в рамках фильтра.")],
+            footer=_prize_footer(summ, "стартов"))
+
+    GROUP_COMPARISON_COLS = ["Группа","Вид спорта","Тренер","Состав","Активных","Стартов","Призовых","% призовых",
+                             "Золото","Серебро","Бронза","Медалей"]
+    COACH_COMPARISON_COLS = ["Тренер","Групп","Состав","Активных","Стартов","Призовых","% призовых",
+                             "Золото","Серебро","Бронза","Медалей"]
+
+    def group_comparison(self, flt, rows=None):
+        # строки обеих таблиц: (группы, тренеры), по убыванию медалей
+        rows = self.store.group_comparison(flt) if rows is None else rows
+        rate = lambda r: round(r["prize"] * 100 / r["starts"], 1) if r["starts"] else 0.0
+        coaches = {}
+        for r in rows:
+            c = coaches.setdefault(r["coach_id"], dict.fromkeys(("members","athletes","starts","prize","g","s","b","groups"), 0))
+            c["fio"] = r["coach"]; c["groups"] += 1
+            for k in ("members","athletes","starts","prize","g","s","b"): c[k] += r[k]
+        key = lambda r: (r["g"], r["s"], r["b"], r["prize"], r["starts"])
+        groups = [(r["name"], r["sport"], r["coach"], r["members"], r["athletes"], r["starts"], r["prize"], rate(r),
+                   r["g"], r["s"], r["b"], r["g"]+r["s"]+r["b"]) for r in sorted(rows, key=key, reverse=True)]
+        by_coach = [(c["fio"], c["groups"], c["members"], c["athletes"], c["starts"], c["prize"], rate(c),
+                     c["g"], c["s"], c["b"], c["g"]+c["s"]+c["b"]) for c in sorted(coaches.values(), key=key, reverse=True)]
+        return groups, by_coach
+
+    def groups(self, flt, data=None):
+        groups, by_coach = data or self.group_comparison(flt)
+        return Report("Сравнение групп и тренеров", [
+            ReportTable("Группы:", self.GROUP_COMPARISON_COLS, groups,
+                        text_fmt=lambda r: f"  {r[0]} ({r[1]}, {r[2]}): активных {r[4]} из {r[3]}, стартов {r[5]}, "
+                                           f"призовых {r[6]} ({r[7]}%), медали — зол {r[8]}, сер {r[9]}, бронз {r[10]}",
+                        empty="  Групп нет."),
+            ReportTable("Тренеры:", self.COACH_COMPARISON_COLS, by_coach,
+                        text_fmt=lambda r: f"  {r[0]} (групп {r[1]}): активных {r[3]} из {r[2]}, стартов {r[4]}, "
+                                           f"призовых {r[5]} ({r[6]}%), медали — зол {r[7]}, сер {r[8]}, бронз {r[9]}",
+                        empty="  Групп нет."),
+        ])
+
+    def group(self, gid, flt):
+        g, members = self.store.group_info(gid)
+        if not g: return None
+        summ = self.store.group_summary(gid, flt)
+        return Report(f"Группа: {g['name']} ({g['sport']})", [
+            ReportTable("Состав:", ["ФИО","Дата рождения"], [(m["fio"], m["birthdate"]) for m in members],
+                        text_fmt=lambda r: f"  {r[0]} ({r[1] or '—'})"),
+            ReportTable("Результаты:", ["Дата","Соревнование","Участник","Категория","Место","Медаль"],
+                        lambda: (tuple(r) for r in self.store.iter_group_report(gid, flt)),
+                        text_fmt=lambda r: _result_line(r[0], r[1], f" — {r[2]}", r[3], r[4], r[5]),
+                        empty="  Нет данных в рамках фильтра."),
+        ], footer=_prize_footer(summ, "результатов"))
+
+REPORT_KINDS = {
+    "medals":  "Сводка по медалям",
+    "events":  "Соревнования по уровням/линиям",
+    "coaches": "Итоги по тренерам",
+    "yearly":  "Динамика по годам",
+    "season":  "Сводный отчёт за сезон",
+    "person":  "Отчёт по участнику (--id)",
+    "group":   "Отчёт по группе (--id)",
+    "groups":  "Сравнение групп и тренеров",
+}
+
+def build_report(builder, kind, flt, id_=None):
+    if kind in ("person", "group"):
+        return getattr(builder, kind)(id_, flt)
+    return {"medals": builder.medals, "events": builder.events_breakdown, "coaches": builder.coaches,
+            "yearly": builder.yearly, "season": builder.season, "groups": builder.groups}[kind](flt)
+
+# ------------ Карточки всех участников (рассылка) ------------
+PERSON_CARDS_BATCH = 32     # участников в одном задании пула
+
+def _person_card_name(p):
+    name = f"{p['last_name']}_{p['first_name']}_{p['person_id']}"
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in name)
+
+def _write_person_cards(batch):
+    # выполняется в процессе пула: данные уже прочитаны, база не нужна
+    builder = ReportBuilder(None)
+    for path, fmt, flt, data in batch:
+        REPORT_WRITERS[fmt][1](builder.person(data[0]["person_id"], flt, data), path)
+    return len(batch)
+
+def write_person_reports(store, folder, flt, fmt="txt", group_id=None, workers=None, progress=None):
+    # по файлу на участника со стартами за период + _index.csv (кому какой файл). Старты всех участников
+    # читаются одним запросом (Store.iter_person_reports), файлы пишутся пакетами в пуле процессов;
+    # в очереди пула держится несколько пакетов на процесс, а не вся школа.
+    # workers: процессов (None — по числу ядер, 0 — без пула). Возвращает число файлов.
+    ext = REPORT_WRITERS[fmt][0]
+    os.makedirs(folder, exist_ok=True)
+    flt = ReportFilter.of(flt).as_dict()
+    index = [["person_id", "ФИО", "Файл", "Стартов", "Призовых", "Золото", "Серебро", "Бронза"]]
+    def batches():
+        batch = []
+        for p, rows, summ in store.iter_person_reports(flt, group_id):
+            name = _person_card_name(p) + ext
+            index.append([p["person_id"], f"{p['last_name']} {p['first_name']}", name,
+                          summ["starts"], summ["prize"], summ["gold"], summ["silver"], summ["bronze"]])
+            batch.append((os.path.join(folder, name), fmt, flt, (p, rows, summ)))
+            if len(batch) == PERSON_CARDS_BATCH: yield batch; batch = []
+        if batch: yield batch
+    done = 0
+    def step(n):
+        nonlocal done
+        done += n
+        if progress: progress(done)
+    if workers == 0:
+        for b in batches(): step(_write_person_cards(b))
+    else:
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            for b in batches():
+                if len(pending) >= 2 * workers:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for f in finished: step(f.result())
+                pending.add(pool.submit(_write_person_cards, b))
+            for f in pending: step(f.result())
+    with io.open(os.path.join(folder, "_index.csv"), "w", encoding="utf-8-sig", newline="") as f:
+        csv.writer(f, delimiter=';').writerows(index)
+    return done
+
+# ------------ Федерация: сводка по базам многих школ ------------
+def find_school_dbs(folder):
+    # базы школ в папке и подпапках: файлы *.db с таблицей persons (архивы сезонов её не имеют)
+    found = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.lower().endswith(".db"): continue
+            path = os.path.join(root, name)
+            try:
+                conn = sqlite3.connect(pathlib.Path(path).resolve().as_uri() + "?mode=ro", uri=True)
+                try: ok = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='persons'").fetchone()
+                finally: conn.close()
+            except sqlite3.Error:
+                ok = None
+            if ok: found.append(path)
+    return found
+
+def school_aggregates(path, flt):
+    # частичные агрегаты одной школы (выполняется в процессе пула); ошибка базы не останавливает остальные
+    try:
+        # только чтение и без обновления схемы: база может быть у школы на прежней версии программы
+        # или лежать в папке без права записи; один проход по базе — снимок NumPy не окупится
+        store = Store(path, columnar=False, readonly=True)
+        try:
+            return {"medals": store.medals_summary(flt), "coaches": store.medals_by_coach(flt),
+                    "yearly": store.yearly_dynamics(flt)}
+        finally:
+            store.conn.close()
+    except (sqlite3.Error, OSError, ValueError) as e:
+        return {"error": str(e)}
+
+def federation_aggregates(paths, flt, workers=None, progress=None):
+    # агрегаты по школам (медали, тренеры, годы) и их сумма по округу.
+    # workers: процессов пула (None — по числу ядер, 0 — без пула); progress(прочитано баз, всего)
+    flt = ReportFilter.of(flt).as_dict()
+    names = [os.path.splitext(os.path.relpath(p, os.path.commonpath(paths) if len(paths) > 1 else os.path.dirname(p)))[0]
+             for p in paths]
+    parts = []
+    def collect(it):
+        for part in it:
+            parts.append(part)
+            if progress: progress(len(parts), len(paths))
+    if workers == 0 or len(paths) < 2:
+        collect(school_aggregates(p, flt) for p in paths)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+            collect(pool.map(school_aggregates, paths, [flt] * len(paths),
+                             chunksize=max(1, len(paths) // (4 * (workers or os.cpu_count() or 1)))))
+    out = {"filter": flt, "schools": [], "coaches": [], "yearly": {}, "medals": [0, 0, 0], "errors": []}
+    for name, part in zip(names, parts):
+        if "error" in part:
+            out["errors"].append((name, part["error"])); continue
+        g, s, b = part["medals"]
+        out["schools"].append({"school": name, "g": g, "s": s, "b": b})
+        out["medals"] = [x + y for x, y in zip(out["medals"], (g, s, b))]
+        out["coaches"] += [dict(r, school=name) for r in part["coaches"]]
+        for r in part["yearly"]:
+            y = out["yearly"].setdefault(r["year"], {"year": r["year"], "events": 0, "gold": 0, "silver": 0, "bronze": 0, "total_medals": 0})
+            for k in ("events", "gold", "silver", "bronze", "total_medals"): y[k] += r[k]
+    out["yearly"] = [out["yearly"][k] for k in sorted(out["yearly"])]
+    return out
+
+def federation_report(data):
+    g, s, b = data["medals"]
+    schools = sorted(data["schools"], key=lambda r: (r["g"], r["s"], r["b"]), reverse=True)
+    coaches = sorted(data["coaches"], key=lambda r: (r["g"], r["s"], r["b"], r["starts"]), reverse=True)
+    yearly = ReportBuilder(None).yearly(None, data["yearly"]).tables
+    return Report(f"Сводка по школам округа (баз: {len(data['schools'])})", [
+        ReportTable("Медальный зачёт округа:", ["Медаль","Количество"],
+                    [("Золото",g),("Серебро",s),("Бронза",b),("Всего",g+s+b)]),
+        ReportTable("Медальный зачёт школ:", ["Школа","Золото","Серебро","Бронза","Всего"],
+                    [(r["school"], r["g"], r["s"], r["b"], r["g"]+r["s"]+r["b"]) for r in schools],
+                    text_fmt=lambda r: f"  {r[0]}: золото {r[1]}, серебро {r[2]}, бронза {r[3]}, всего {r[4]}"),
+        ReportTable("Итоги по тренерам:", ["Школа","Тренер","Золото","Серебро","Бронза","Стартов","Соревнований","Участников"],
+                    [(r["school"], r["fio"], r["g"], r["s"], r["b"], r["starts"], r["events"], r["athletes"]) for r in coaches],
+                    text_fmt=lambda r: f"  {r[1]} ({r[0]}): золото {r[2]}, серебро {r[3]}, бронза {r[4]}, стартов {r[5]}, соревнований {r[6]}, участников {r[7]}",
+                    empty="  Нет данных по тренерам в рамках фильтра."),
+    ] + yearly, footer=[f"Не прочитана база {n}: {e}" for n, e in data["errors"]])
+
+# ------------ Табло результатов в локальной сети ------------
+LIVE_PORT = 8080
+LIVE_WORKERS = 4            # потоков с запросами к базе, у каждого своё соединение (Store только для чтения)
+LIVE_POLL_SEC = 0.5         # как часто сверять PRAGMA data_version
+LIVE_WAIT_MAX = 30          # предел долгого опроса (?wait=секунд), с
+LIVE_CACHE_SIZE = 256       # ответов в кэше (адрес запроса -> тело)
+LIVE_EVENTS = 30            # соревнований в списке табло
+
+LIVE_BOARD_HTML = """<!doctype html><html lang="ru"><meta charset="utf-8">
+<meta name="viewport" content="width=device-width,initial-scale=1"><title>Результаты</title>
+<style>body{font:18px sans-serif;margin:12px}table{border-collapse:collapse;width:100%}
+td,th{padding:6px 10px;border-bottom:1px solid #ddd;text-align:left}a{color:#2455a4}
+.p1{background:#fff4ce}.p2{background:#eee}.p3{background:#f2e2d5}.m{color:#777;font-size:14px}</style>
+<h2 id="h">Результаты</h2><div class="m" id="s"></div><table id="t"></table>
+<script>
+const esc = v => String(v ?? "").replace(/[&<>"]/g, c => ({"&":"&amp;","<":"&lt;",">":"&gt;",'"':"&quot;"}[c]));
+const id = location.pathname.startsWith("/board/") ? location.pathname.split("/").pop() : "";
+const url = id ? `/api/events/${id}` : "/api/events";
+let etag = "";
+function render(d) {
+  const t = document.getElementById("t");
+  if (!id) {
+    t.innerHTML = d.events.map(e => `<tr><td>${esc(e.date)}<td><a href="/board/${e.event_id}">${esc(e.name)}</a><td>${esc(e.level)}<td>${esc(e.location)}`).join("");
+    return;
+  }
+  document.getElementById("h").textContent = `${d.event.date} — ${d.event.name}`;
+  t.innerHTML = "<tr><th>Место<th>Медаль<th>Участник<th>Группа<th>Категория" + d.results.map(r =>
+    `<tr class="p${esc(r.place)}"><td>${esc(r.place)}<td>${esc(r.medal)}<td>${esc(r.fio)}<td>${esc(r.gname)}<td>${esc(r.category)}`).join("");
+}
+async function poll() {
+  try {
+    const r = await fetch(url + "?wait=25", {headers: etag ? {"If-None-Match": etag} : {}, cache: "no-store"});
+    if (r.status === 200) { etag = r.headers.get("ETag"); render(await r.json()); }
+    document.getElementById("s").textContent = "обновлено " + new Date().toLocaleTimeString();
+  } catch (e) { await new Promise(f => setTimeout(f, 3000)); }
+  poll();
+}
+poll();
+</script></html>"""
+
+class LiveBoard:
+    # HTTP/JSON только для чтения: табло соревнования для экрана в зале и телефонов.
+    # Соединения держит asyncio (долгий опрос ничего не стоит), запросы к базе идут в пул потоков,
+    # у каждого потока свой Store. Ответ кэшируется до следующей смены PRAGMA data_version
+    # (её опрашивает отдельное соединение), ETag — хэш тела: сколько бы зрителей ни было,
+    # каждый ответ считается один раз за правку, а неизменившийся отдаётся как 304.
+    #   GET /api/events               последние соревнования
+    #   GET /api/events/<id>          соревнование и результаты (Store.event_results)
+    #   GET /api/persons/<id>?фильтр  старты и итоги участника (без телефона и адреса)
+    #   GET /api/medals?фильтр        медальный зачёт и итоги тренеров
+    #   ?wait=N + If-None-Match       ждать до N с, пока ответ не изменится
+    def __init__(self, db_path=DB_PATH, host="0.0.0.0", port=LIVE_PORT, workers=LIVE_WORKERS):
+        self.db_path, self.host, self.port, self.workers = db_path, host, port, workers
+        self.generation = 0
+        self._cache = OrderedDict()     # (путь, параметры) -> (generation, future с (etag, тело))
+        self._local = threading.local()
+        self._thread = self.loop = None
+
+    # ---- запуск: serve() блокирует (CLI), start()/stop() — фоном из окна
+    def serve(self, ready=None):
+        asyncio.run(self._main(ready))
+
+    def check(self):
+        # табло только читает (mode=ro, без обновления схемы): база должна быть обновлена программой
+        Store(self.db_path, columnar=False, readonly=True).conn.close()
+
+    def start(self):
+        self.check()
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self.serve, args=(ready,), daemon=True)
+        self._thread.start()
+        ready.wait(5)
+        if not self.running: raise OSError(f"не удалось открыть порт {self.port}")
+
+    def stop(self):
+        if self.running: self.loop.call_soon_threadsafe(self._stop.set)
+        if self._thread is not None: self._thread.join(5)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive() and self.loop is not None
+
+    async def _main(self, ready=None):
+        from concurrent.futures import ThreadPoolExecutor
+        self._changed, self._stop = asyncio.Event(), asyncio.Event()
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="live")
+        try:
+            server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError:
+            if ready: ready.set()
+            raise
+        self.port = server.sockets[0].getsockname()[1]
+        self.loop = asyncio.get_running_loop()
+        watcher = asyncio.create_task(self._watch())
+        if ready: ready.set()
+        async with server:
+            await self._stop.wait()
+        watcher.cancel()
+        self.pool.shutdown(wait=False)
+        self.loop = None
+
+    async def _watch(self):
+        # своё соединение только для PRAGMA data_version: меняется от любой чужой фиксации
+        conn = sqlite3.connect(pathlib.Path(self.db_path).resolve().as_uri() + "?mode=ro", uri=True, check_same_thread=False)
+        seen = None
+        try:
+            while True:
+                try: dv = await self.loop.run_in_executor(None, lambda: conn.execute("PRAGMA data_version").fetchone()[0])
+                except sqlite3.OperationalError: dv = seen    # база занята записью — в следующий раз
+                if dv != seen:
+                    seen, self.generation = dv, self.generation + 1
+                    self._changed.set(); self._changed = asyncio.Event()
+                await asyncio.sleep(LIVE_POLL_SEC)
+        finally:
+            conn.close()
+
+    # ---- HTTP/1.1: только GET/HEAD, соединение держится для следующих запросов
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                line = await asyncio.wait_for(reader.readline(), LIVE_WAIT_MAX * 2)
+                if not line: break
+                method, target, _ = line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (h := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    k, _, v = h.decode("latin-1").partition(":"); headers[k.strip().lower()] = v.strip()
+                status, head, body = await self._respond(method, target, headers)
+                head = [f"HTTP/1.1 {status}", f"Content-Length: {len(body)}", "Cache-Control: no-cache"] + head
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + (b"" if method == "HEAD" else body))
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close": break
+        except (ConnectionError, ValueError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, method, target, headers):
+        url = urllib.parse.urlsplit(target)
+        q = dict(urllib.parse.parse_qsl(url.query))
+        if method not in ("GET", "HEAD"): return "405 Method Not Allowed", ["Allow: GET, HEAD"], b""
+        if url.path == "/" or url.path.startswith("/board/"):
+            return "200 OK", ["Content-Type: text/html; charset=utf-8"], LIVE_BOARD_HTML.encode()
+        route = self._route(url.path.rstrip("/").split("/")[1:], q)
+        if route is None: return "404 Not Found", [], b""
+        try: wait = min(max(float(q.pop("wait", 0)), 0), LIVE_WAIT_MAX)
+        except ValueError: return "400 Bad Request", [], b""
+        key, deadline = (url.path, tuple(sorted(q.items()))), self.loop.time() + wait
+        while True:
+            changed = self._changed
+            try: etag, body = await self._cached(key, route)
+            except ValueError as e: return "400 Bad Request", ["Content-Type: text/plain; charset=utf-8"], str(e).encode()
+            except LookupError: return "404 Not Found", [], b""
+            if etag != headers.get("if-none-match"):
+                return "200 OK", ["Content-Type: application/json; charset=utf-8", f"ETag: {etag}"], body
+            try: await asyncio.wait_for(changed.wait(), deadline - self.loop.time())
+            except asyncio.TimeoutError: return "304 Not Modified", [f"ETag: {etag}"], b""
+
+    def _route(self, parts, q):
+        # (функция над Store, аргументы) или None
+        flt = lambda: {k: q.get(k, "") for k, _ in FILTER_FIELDS}
+        if parts == ["api", "events"]: return LiveBoard._events, ()
+        if parts == ["api", "medals"]: return LiveBoard._medals, (flt(),)
+        if len(parts) == 3 and parts[:2] == ["api", "events"] and parts[2].isdigit():
+            return LiveBoard._event, (int(parts[2]),)
+        if len(parts) == 3 and parts[:2] == ["api", "persons"] and parts[2].isdigit():
+            return LiveBoard._person, (int(parts[2]), flt())
+        return None
+
+    async def _cached(self, key, route):
+        # одно вычисление на адрес и поколение базы; ждущие того же ответа получают тот же future
+        hit = self._cache.get(key)
+        if hit is None or hit[0] != self.generation:
+            hit = self._cache[key] = (self.generation, self.loop.run_in_executor(self.pool, self._call, *route))
+            while len(self._cache) > LIVE_CACHE_SIZE: self._cache.popitem(last=False)
+        self._cache.move_to_end(key)
+        try: return await asyncio.shield(hit[1])
+        except Exception:
+            if self._cache.get(key) is hit: del self._cache[key]
+            raise
+
+    def _call(self, fn, args):
+        # выполняется в потоке пула: своё соединение только для чтения на поток, открывается при первом запросе
+        store = getattr(self._local, "store", None)
+        if store is None: store = self._local.store = Store(self.db_path, columnar=False, readonly=True)
+        data = fn(store, *args)
+        if data is None: raise LookupError
+        body = json.dumps(data, ensure_ascii=False, default=str).encode()
+        return '"' + hashlib.sha1(body).hexdigest()[:20] + '"', body
+
+    # ---- ответы
+    @staticmethod
+    def _events(store):
+        return {"events": store.recent_events(LIVE_EVENTS)}
+
+    @staticmethod
+    def _event(store, eid):
+        e = store.get_event(eid)
+        if e is None: return None
+        return {"event": {k: e[k] for k in ("event_id", "date", "name", "level", "line", "sport", "location")},
+                "results": [{k: r[k] for k in ("place", "medal", "fio", "gname", "coach", "category", "note")}
+                            for r in store.event_results(eid)]}
+
+    @staticmethod
+    def _person(store, pid, flt):
+        p = store.get_person(pid)
+        if p is None: return None
+        return {"person": {"person_id": pid, "fio": f"{p['last_name']} {p['first_name']}"},
+                "summary": store.person_summary(pid, flt), "results": store.person_report(pid, flt)}
+
+    @staticmethod
+    def _medals(store, flt):
+        g, s, b = store.medals_summary(flt)
+        return {"medals": {"gold": g, "silver": s, "bronze": b},
+                "coaches": sorted(store.medals_by_coach(flt), key=lambda r: (r["g"], r["s"], r["b"]), reverse=True)}
+
 # ------------ UI ------------
 class App(tk.Tk):
     # --------- вспомогательные мини-компоненты (скроллы/пагинация/поиск) ----------
     class PagedSearchTable:
-        def __init__(self, app, parent, columns, widths, get_rows_fn, apply_tags_fn=None, search_label="Поиск"):
+        # список вкладки: страница, сортировка (щелчок по заголовку) и поиск считаются в SQL (Store.list_page),
+        # переход вперёд — по ключу последней строки; ключи начала просмотренных страниц хранятся для «Назад»
+        def __init__(self, app, parent, columns, widths, view, apply_tags_fn=None, search_label="Поиск"):
             self.app = app
             self.columns = columns
             self.widths  = widths
-            self.get_rows_fn = get_rows_fn
+            self.view = view
             self.apply_tags_fn = apply_tags_fn
+            self.search_label = search_label
+            self.sort, self.desc = LIST_VIEWS[view]["default"]
 
             # верхняя панель: поиск + пагинация
             top = ttk.Frame(parent); top.pack(fill="x", padx=8, pady=(0,6))
@@ -410,7 +2978,7 @@ class App(tk.Tk):
             self.var_page_size = tk.StringVar(value="50")
             cb = ttk.Combobox(top, textvariable=self.var_page_size, width=5, values=["10","20","50","100","200"])
             cb.pack(side="left", padx=(4,10))
-            cb.bind("<<ComboboxSelected>>", lambda e: self._goto_page(0))
+            cb.bind("<<ComboboxSelected>>", lambda e: self.refresh())
 
             self.btn_prev = ttk.Button(top, text="⟨ Назад", width=10, command=self.prev_page)
             self.btn_next = ttk.Button(top, text="Вперёд ⟩", width=10, command=self.next_page)
@@ -422,8 +2990,8 @@ class App(tk.Tk):
             # дерево со скроллами
             frame = ttk.Frame(parent); frame.pack(fill="both", expand=True, padx=8, pady=4)
             tree = ttk.Treeview(frame, show="headings", columns=self.columns)
-            for c,w in zip(self.columns, self.widths):
-                tree.heading(c,text=c); tree.column(c,width=w,anchor="w")
+            for i,(c,w) in enumerate(zip(self.columns, self.widths)):
+                tree.heading(c,text=c,command=lambda i=i: self.sort_by(i)); tree.column(c,width=w,anchor="w")
             ysb = ttk.Scrollbar(frame, orient="vertical", command=tree.yview)
             xsb = ttk.Scrollbar(frame, orient="horizontal", command=tree.xview)
             tree.configure(yscrollcommand=ysb.set, xscrollcommand=xsb.set)
@@ -434,40 +3002,49 @@ class App(tk.Tk):
             frame.columnconfigure(0, weight=1)
             self.tree = tree
 
-            self._all_rows = []
-            self._filtered = []
+            self._starts = [None]   # ключ начала каждой просмотренной страницы
+            self._count = None      # строк без поиска (с поиском не считается — это полный проход)
             self._page = 0
+            self._search_job = None
+            self._show_sort()
             self.refresh()
 
         def refresh(self):
-            self._all_rows = self.get_rows_fn()
-            self._apply_filter()
-            self._goto_page(0)
-
-        def _apply_filter(self):
-            q = (self.var_q.get() or "").strip().lower()
-            if not q:
-                self._filtered = list(self._all_rows)
-                return
-            def row_match(row):
-                for v in row:
-                    if q in str(v).lower():
-                        return True
-                return False
-            self._filtered = [r for r in self._all_rows if row_match(r)]
-
-        def _goto_page(self, page_idx):
+            t0 = time.perf_counter(); q0 = self.app.trace.sql_time
+            self._count = None if self._query() else self.app.store.list_count(self.view)
+            self._starts = [None]
+            self._show(0, "refresh", t0, q0)
+
+        def sort_by(self, col):
+            self.sort, self.desc = col, (not self.desc if col == self.sort else False)
+            self._show_sort()
+            self._starts = [None]
+            self._show(0, "sort")
+
+        def _show_sort(self):
+            for i,c in enumerate(self.columns):
+                self.tree.heading(c, text=c + ((" ▼" if self.desc else " ▲") if i == self.sort else ""))
+
+        def _query(self):
+            return (self.var_q.get() or "").strip()
+
+        def _page_size(self):
             try:
                 size = int(self.var_page_size.get())
-                if size <= 0: size = 50
+                return size if size > 0 else 50
             except:
-                size = 50
-            n = len(self._filtered)
-            max_page = (max(n-1,0)) // size
-            self._page = max(0, min(page_idx, max_page))
-            start = self._page * size
-            end   = start + size
-            rows = self._filtered[start:end]
+                return 50
+
+        def _show(self, page_idx, op, t0=None, q0=None):
+            tr = self.app.trace
+            if t0 is None: t0 = time.perf_counter(); q0 = tr.sql_time
+            size = self._page_size()
+            self._page = max(0, min(page_idx, len(self._starts) - 1))
+            rows, last, more = self.app.store.list_page(self.view, self.sort, self.desc, self._starts[self._page],
+                                                        size, self._query())
+            del self._starts[self._page + 1:]
+            if more: self._starts.append(last)
+            t1 = time.perf_counter(); query = tr.sql_time - q0
 
             for i in self.tree.get_children():
                 self.tree.delete(i)
@@ -476,23 +3053,45 @@ class App(tk.Tk):
                 if self.apply_tags_fn:
                     self.apply_tags_fn(self.tree, iid, r)
 
-            self.lbl_info.config(text=f"Стр. {self._page+1}/{max_page+1} • всего: {n}")
+            if self._count is None:
+                found = self._page * size + len(rows)
+                self.lbl_info.config(text=f"Стр. {self._page+1} • найдено: {found}{'+' if more else ''}")
+            else:
+                self.lbl_info.config(text=f"Стр. {self._page+1}/{max(1, -(-self._count // size))} • всего: {self._count}")
             self.btn_prev.config(state=("normal" if self._page>0 else "disabled"))
-            self.btn_next.config(state=("normal" if self._page<max_page else "disabled"))
+            self.btn_next.config(state=("normal" if more else "disabled"))
+            tr.record(self.search_label, op, len(rows), query, (t1-t0)-query, insert=time.perf_counter()-t1)
 
         def next_page(self):
-            self._goto_page(self._page + 1)
+            self._show(self._page + 1, "page")
         def prev_page(self):
-            self._goto_page(self._page - 1)
+            self._show(self._page - 1, "page")
         def _on_search(self, *_):
-            self._apply_filter()
-            self._goto_page(0)
+            # поиск — проход по строкам в SQL: запускается после паузы в наборе, а не на каждую клавишу
+            if self._search_job is not None: self.app.after_cancel(self._search_job)
+            self._search_job = self.app.after(250, self._run_search)
+        def _run_search(self):
+            self._search_job = None
+            t0 = time.perf_counter(); q0 = self.app.trace.sql_time
+            self._count = None if self._query() else self.app.store.list_count(self.view)
+            self._starts = [None]
+            self._show(0, "search", t0, q0)
 
     def __init__(self):
         super().__init__()
         self.title(APP_TITLE)
         self._center(*APP_SIZE)
-        self.store = Store()
+        self.trace = UiTrace(enabled=bool(os.environ.get("SPORTS_TRACE")))
+        self.store = Store(trace=self.trace)
+        self.reports = ReportBuilder(self.store)
+        self.importer = Importer(self.store)
+        self.dedup = PersonDedup(self.store)
+        self.backups = Backups(self.store)
+        self._backup_thread, self._backup_stamp = None, None
+        self._report_job = None     # долгий отчёт в потоке: (поток, заголовок, состояние, done)
+        self.maintenance = Maintenance(self.store)
+        self._maint, self._maint_stamp, self._last_input = None, None, time.monotonic()
+        self._cards = []    # открытые карточки: (окно, таблицы, от которых зависят, refresh)
         self._make_style()
 
         self.nb = ttk.Notebook(self); self.nb.pack(fill="both", expand=True)
@@ -504,6 +3103,11 @@ class App(tk.Tk):
         self._tab_results()
         self._tab_reports()
         self._tab_io()   # импорт/экспорт
+        self.after(BACKUP_INTERVAL_MIN * 60000, self._auto_backup)
+        for seq in ("<Any-KeyPress>", "<Any-ButtonPress>"):
+            self.bind_all(seq, self._mark_input, add="+")
+        self.after(MAINT_CHECK_SEC * 1000, self._maint_tick)
+        self.after(EXTERNAL_POLL_MS, self._poll_external)
 
     # helpers
     def _center(self, w, h):
@@ -592,11 +3196,12 @@ class App(tk.Tk):
         ttk.Button(btn,text="Удалить",command=self._delete_person).pack(side="right",padx=(6,0))
         ttk.Button(btn,text="Редактировать",command=self._edit_person_dialog).pack(side="right",padx=(6,0))
         ttk.Button(btn,text="Назначить в группу",command=self._assign_person_to_group).pack(side="left")
+        ttk.Button(btn,text="Дубли…",command=self._duplicates_dialog).pack(side="left",padx=(6,0))
 
         cols=["id","ФИО","Дата рождения","Группа","Тренер","Телефон","Адрес"]
         widths=[60,200,110,170,170,120,260]
         self.tbl_persons = self.PagedSearchTable(
-            self, f, cols, widths, self._person_rows,
+            self, f, cols, widths, "persons",
             search_label="Поиск участника",
         )
         self.tree_persons = self.tbl_persons.tree
@@ -605,8 +3210,6 @@ class App(tk.Tk):
 
     def _group_options(self):
         return [self._id_label(r["group_id"], f"{r['name']} ({r['sport']}, тренер: {r['coach']})") for r in self.store.list_groups()]
-    def _person_rows(self):
-        return [[r["person_id"], r["fio"], r["birthdate"], r["gname"], r["coach"], r["phone"], r["address"]] for r in self.store.list_persons()]
 
     def _add_person(self):
         last=self.p_last.get().strip(); first=self.p_first.get().strip()
@@ -616,6 +3219,10 @@ class App(tk.Tk):
             try: dt.strptime(b,"%Y-%m-%d")
             except: messagebox.showwarning("Дата рождения","Формат: YYYY-MM-DD"); return
         gid=self._parse_id(self.p_group.get()) if self.p_group.get().strip() else None
+        similar=self.dedup.candidates_for(last,first,b or None)
+        if similar:
+            lines="\n".join(f"#{p['person_id']} {p['last_name']} {p['first_name']}, {p['birthdate'] or 'д.р. —'}, {p['gname']}" for p in similar[:5])
+            if not messagebox.askyesno("Возможный дубль", f"Похожие участники уже есть:\n{lines}\n\nВсё равно добавить?"): return
         try: self.store.add_person(last,first,b or None,self.p_addr.get().strip() or None,self.p_phone.get().strip() or None,gid)
         except sqlite3.IntegrityError as e: messagebox.showerror("Ошибка БД", str(e)); return
         for w in (self.p_last,self.p_first,self.p_birth,self.p_addr,self.p_phone): w.delete(0,"end")
@@ -623,6 +3230,40 @@ class App(tk.Tk):
 
     def _refresh_persons(self):
         self.tbl_persons.refresh()
+
+    def _duplicates_dialog(self):
+        # кластеры вероятных дублей; первый в кластере (больше стартов) остаётся, остальные вливаются в него
+        dlg=tk.Toplevel(self); dlg.title("Дубли участников"); dlg.transient(self); dlg.geometry("820x480")
+        cols=["id","ФИО","Дата рождения","Группа","Стартов","Сходство"]
+        tree=ttk.Treeview(dlg,columns=cols,show="tree headings")
+        tree.column("#0",width=120)
+        for c,w in zip(cols,[60,240,110,170,70,80]): tree.heading(c,text=c); tree.column(c,width=w,anchor="w")
+        tree.pack(fill="both",expand=True,padx=8,pady=8)
+        clusters={}
+        def load():
+            tree.delete(*tree.get_children()); clusters.clear()
+            for n,members in enumerate(self.dedup.find_duplicates(),1):
+                node=tree.insert("","end",text=f"Кластер {n}",open=True)
+                clusters[node]=members
+                for i,p in enumerate(members):
+                    tree.insert(node,"end",text="оставить" if i==0 else "влить",
+                                values=[p["person_id"],f"{p['last_name']} {p['first_name']}",p["birthdate"] or "",p["gname"],p["starts"],p["score"]])
+            lbl.config(text=f"Кластеров: {len(clusters)}")
+        def merge(nodes):
+            groups=[(clusters[n][0]["person_id"],[p["person_id"] for p in clusters[n][1:]]) for n in nodes]
+            if not groups: return
+            if not messagebox.askyesno("Объединить",f"Объединить кластеров: {len(groups)}?\nРезультаты дублей перейдут к оставляемому участнику.",parent=dlg): return
+            n=self.dedup.merge(groups)
+            messagebox.showinfo("Объединить",f"Удалено дублей: {n}",parent=dlg)
+            load(); self._refresh_persons(); self._refresh_groups()
+        def selected():
+            return list(dict.fromkeys(n if n in clusters else tree.parent(n) for n in tree.selection()))
+        bar=ttk.Frame(dlg); bar.pack(fill="x",padx=8,pady=(0,8))
+        lbl=ttk.Label(bar,text=""); lbl.pack(side="left")
+        ttk.Button(bar,text="Закрыть",command=dlg.destroy).pack(side="right")
+        ttk.Button(bar,text="Объединить все",command=lambda: merge(list(clusters))).pack(side="right",padx=(0,6))
+        ttk.Button(bar,text="Объединить выбранные",command=lambda: merge(selected())).pack(side="right",padx=(0,6))
+        load()
     def _delete_person(self):
         sel = self.tree_persons.selection()
         if not sel:
@@ -643,7 +3284,7 @@ class App(tk.Tk):
             messagebox.showinfo("Выбор", "Выбери участника")
             return
         pid = int(self.tree_persons.item(sel[0])["values"][0])
-        p = self.store.person_raw(pid)
+        p = self.store.get_person(pid)
         if not p:
             return
 
@@ -658,7 +3299,7 @@ class App(tk.Tk):
         e_phone = tk.Entry(dlg, width=16); e_phone.insert(0, p["phone"] or "")
         cb_group= ttk.Combobox(dlg, width=40, values=self._group_options()); cb_group.set("")
         if p.get("group_id"):
-            g = self.store._fetchone("SELECT name, sport FROM groups WHERE group_id=?", (p["group_id"],))
+            g = self.store.get_group(p["group_id"])
             if g:
                 cb_group.set(self._id_label(p["group_id"], f"{g['name']} ({g['sport']})"))
 
@@ -702,7 +3343,7 @@ class App(tk.Tk):
             return
 
         pid = int(self.tree_persons.item(sel[0])["values"][0])
-        p = self.store.person_raw(pid)
+        p = self.store.get_person(pid)
         if not p:
             return
 
@@ -718,7 +3359,7 @@ class App(tk.Tk):
 
         # проставим текущее значение, если есть
         if p.get("group_id"):
-            g = self.store._fetchone("SELECT name, sport FROM groups WHERE group_id=?", (p["group_id"],))
+            g = self.store.get_group(p["group_id"])
             if g:
                 cb.set(self._id_label(p["group_id"], f"{g['name']} ({g['sport']}, тренер: —)"))
 
@@ -769,7 +3410,7 @@ class App(tk.Tk):
 
         cols=["id","ФИО","Телефон"]; widths=[60,320,160]
         self.tbl_coaches = self.PagedSearchTable(
-            self, f, cols, widths, self._coach_rows,
+            self, f, cols, widths, "coaches",
             search_label="Поиск тренера",
         )
         self.tree_coaches = self.tbl_coaches.tree
@@ -788,16 +3429,13 @@ class App(tk.Tk):
         self.store.add_coach(fio, self.c_phone.get().strip() or None)
         self.c_fio.delete(0,"end"); self.c_phone.delete(0,"end"); self._refresh_coaches(); self._refresh_groups_refs()
 
-    def _coach_rows(self): return [[r["coach_id"], r["fio"], r["phone"]] for r in self.store.list_coaches()]
     def _refresh_coaches(self): self.tbl_coaches.refresh()
 
     def _edit_coach_dialog(self):
         sel=self.tree_coaches.selection()
         if not sel: messagebox.showinfo("Выбор","Выбери тренера"); return
         cid=int(self.tree_coaches.item(sel[0])["values"][0])
-        row=None
-        for r in self.store.list_coaches():
-            if r["coach_id"]==cid: row=r; break
+        row=self.store.get_coach(cid)
         if not row: return
         dlg=tk.Toplevel(self); dlg.title("Редактировать тренера"); dlg.transient(self)
         e_fio=tk.Entry(dlg,width=40); e_fio.insert(0,row["fio"])
@@ -916,7 +3554,7 @@ class App(tk.Tk):
         if not gid: messagebox.showinfo("Группа","Выбери группу"); return
         pid=self._choose_person_dialog()
         if not pid: return
-        r=self.store.person_raw(pid)
+        r=self.store.get_person(pid)
         self.store.edit_person(pid,r["last_name"],r["first_name"],r["birthdate"],r["address"],r["phone"],gid)
         self._refresh_groups(); self._refresh_persons()
 
@@ -926,20 +3564,20 @@ class App(tk.Tk):
         sel=self.tree_group_members.selection()
         if not sel: messagebox.showinfo("Выбор","Выбери участника"); return
         pid=int(self.tree_group_members.item(sel[0])["values"][0])
-        r=self.store.person_raw(pid)
+        r=self.store.get_person(pid)
         self.store.edit_person(pid,r["last_name"],r["first_name"],r["birthdate"],r["address"],r["phone"],None)
         self._refresh_groups(); self._refresh_persons()
 
     def _edit_group_dialog(self):
         gid=self._current_group_id()
         if not gid: messagebox.showinfo("Выбор","Выбери группу"); return
-        g=self.store._fetchone("SELECT * FROM groups WHERE group_id=?", (gid,))
+        g=self.store.get_group(gid)
         dlg=tk.Toplevel(self); dlg.title("Редактировать группу"); dlg.transient(self)
         e_name=tk.Entry(dlg,width=24); e_name.insert(0,g["name"])
         cb_sport=ttk.Combobox(dlg,values=[s for s in SPORTS if s],width=24); cb_sport.set(g["sport"])
         cb_coach=ttk.Combobox(dlg,values=self._coach_options(),width=40)
         if g.get("coach_id"):
-            c=self.store._fetchone("SELECT fio FROM coaches WHERE coach_id=?", (g["coach_id"],))
+            c=self.store.get_coach(g["coach_id"])
             if c: cb_coach.set(self._id_label(g["coach_id"], c["fio"]))
         ttk.Label(dlg,text="Название").grid(row=0,column=0,sticky="w",padx=6,pady=4); e_name.grid(row=0,column=1,padx=6,pady=4)
         ttk.Label(dlg,text="Вид спорта").grid(row=0,column=2,sticky="w",padx=6,pady=4); cb_sport.grid(row=0,column=3,padx=6,pady=4)
@@ -984,7 +3622,7 @@ class App(tk.Tk):
         def _apply_evt_tags(tree, iid, vals):  # без подсветки
             pass
         self.tbl_events = self.PagedSearchTable(
-            self, f, cols, widths, self._event_rows,
+            self, f, cols, widths, "events",
             apply_tags_fn=_apply_evt_tags, search_label="Поиск соревнования"
         )
         self.tree_events = self.tbl_events.tree
@@ -1007,10 +3645,6 @@ class App(tk.Tk):
         except sqlite3.IntegrityError as e: messagebox.showerror("Ошибка БД", str(e)); return
         for w in (self.e_name,self.e_date,self.e_loc,self.e_total): w.delete(0,"end"); self._refresh_events()
 
-    def _event_rows(self):
-        return [[r["event_id"],r["date"],r["name"],r["level"],r["line"],r["sport"],r["location"],r["total_count"],r["ours"]]
-                for r in self.store.list_events()]
-
     def _refresh_events(self): self.tbl_events.refresh()
 
     def _selected_event_id(self):
@@ -1019,7 +3653,7 @@ class App(tk.Tk):
     def _edit_event_dialog(self):
         eid=self._selected_event_id()
         if not eid: messagebox.showinfo("Выбор","Выбери соревнование"); return
-        e=self.store.event_raw(eid)
+        e=self.store.get_event(eid)
         dlg=tk.Toplevel(self); dlg.title("Редактировать соревнование"); dlg.transient(self)
         e_name=tk.Entry(dlg,width=32); e_name.insert(0,e["name"])
         e_date=tk.Entry(dlg,width=12); e_date.insert(0,e["date"])
@@ -1079,7 +3713,7 @@ class App(tk.Tk):
             self._apply_medal_tag(tree, iid, vals[6])
 
         self.tbl_results = self.PagedSearchTable(
-            self, f, cols, widths, self._result_rows,
+            self, f, cols, widths, "results",
             apply_tags_fn=_apply_res_tags, search_label="Поиск по результатам"
         )
         self.tree_results = self.tbl_results.tree
@@ -1111,10 +3745,6 @@ class App(tk.Tk):
         for w in (self.r_cat,self.r_place,self.r_note): w.delete(0,"end"); self.r_medal.set("")
         self._refresh_results(); self._refresh_events()
 
-    def _result_rows(self):
-        return [[r["result_id"],r["date"],r["event_name"],r["fio"],r["category"],r["place"],r["medal"],r["note"]]
-                for r in self.store.list_results()]
-
     def _refresh_results(self):
         self.tbl_results.refresh()
 
@@ -1134,11 +3764,11 @@ class App(tk.Tk):
     def _edit_result_dialog(self):
         rid=self._selected_result_id()
         if not rid: messagebox.showinfo("Выбор","Выбери результат"); return
-        r=self.store.result_raw(rid)
+        r=self.store.get_result(rid)
         dlg=tk.Toplevel(self); dlg.title("Редактировать результат"); dlg.transient(self)
         cb_event=ttk.Combobox(dlg,values=self._event_options(),width=60)
         cb_person=ttk.Combobox(dlg,values=self._person_options(),width=50)
-        ev=self.store.event_raw(r["event_id"]); per=self.store.person_raw(r["person_id"])
+        ev=self.store.get_event(r["event_id"]); per=self.store.get_person(r["person_id"])
         if ev:  cb_event.set(self._id_label(r["event_id"], f"{ev['date']} — {ev['name']}"))
         if per: cb_person.set(self._id_label(r["person_id"], f"{per['last_name']} {per['first_name']}"))
         e_cat=tk.Entry(dlg,width=10); e_cat.insert(0, r["category"] or "")
@@ -1183,17 +3813,26 @@ class App(tk.Tk):
         ttk.Button(top,text="Сводка по медалям",command=self._report_medals).pack(side="left")
         ttk.Button(top,text="Соревнования по уровням/линиям",command=self._report_events_breakdown).pack(side="left",padx=8)
         ttk.Button(top,text="Итоги по тренерам",command=self._report_coaches).pack(side="left")
+        ttk.Button(top,text="Сводный отчёт за сезон",command=self._report_season).pack(side="left",padx=8)
 
         ttk.Separator(f,orient="horizontal").pack(fill="x",padx=8,pady=6)
 
         adv=ttk.Frame(f); adv.pack(fill="x",padx=8,pady=6)
         ttk.Button(adv,text="Отчёт по участнику…",command=self._report_person_dialog).pack(side="left")
         ttk.Button(adv,text="Отчёт по группе…",command=self._report_group_dialog).pack(side="left",padx=6)
+        ttk.Button(adv,text="Сравнение групп",command=self._report_groups).pack(side="left",padx=6)
         ttk.Button(adv,text="Динамика по годам",command=self._report_yearly).pack(side="left",padx=6)
+        ttk.Button(adv,text="Сводка по школам (папка баз)…",command=self._report_federation).pack(side="left",padx=6)
+        ttk.Button(adv,text="Карточки всех участников → папка…",command=self._export_person_cards).pack(side="left",padx=6)
+        self.cb_cards_fmt=ttk.Combobox(adv,values=[k for k in REPORT_WRITERS if k != "xlsx" or HAS_XLSX],width=6,state="readonly")
+        self.cb_cards_fmt.set("txt"); self.cb_cards_fmt.pack(side="left")
 
         exp=ttk.Frame(f); exp.pack(fill="x",padx=8,pady=6)
         ttk.Button(exp,text="Экспорт отчёта → TXT",command=self._export_report_txt).pack(side="left")
         ttk.Button(exp,text="Экспорт отчёта → CSV",command=self._export_report_csv).pack(side="left",padx=6)
+        if HAS_XLSX:
+            ttk.Button(exp,text="Экспорт отчёта → XLSX",command=self._export_report_xlsx).pack(side="left")
+        self.lbl_report_job=ttk.Label(exp,text=""); self.lbl_report_job.pack(side="right",padx=6)
 
         self.txt=tk.Text(f,wrap="word",height=24); self.txt.pack(fill="both",expand=True,padx=8,pady=8)
         self._write_report("Задайте фильтр (по желанию) и выберите отчёт.")
@@ -1221,33 +3860,26 @@ class App(tk.Tk):
         self._write_report("Фильтр применён. Теперь выберите отчёт заново.")
 
     def _write_report(self, text):
-        self.current_report_lines = text.splitlines()
+        # служебное сообщение вместо отчёта — экспортировать нечего
+        self.current_report = None
         self.txt.delete("1.0","end"); self.txt.insert("1.0", text)
 
+    def _show_report(self, rep):
+        self.current_report = rep
+        self.txt.delete("1.0","end"); self.txt.insert("1.0", report_to_text(rep))
+
     # ---- отчёты (текст в поле)
     def _report_medals(self):
-        g,s,b=self.store.medals_summary(self._filters())
-        self._write_report(f"Медальный зачёт (с учётом фильтра):\n  Золото: {g}\n  Серебро: {s}\n  Бронза: {b}\n  Всего: {g+s+b}\n")
+        self._show_report(self.reports.medals(self._filters()))
 
     def _report_events_breakdown(self):
-        by_level,by_line=self.store.events_breakdown(self._filters())
-        lines=["Соревнования по уровням:"]+[f"  {k}: {by_level.get(k,0)}" for k in [x for x in LEVELS if x]]
-        lines+=["","Соревнования по линиям:"]+[f"  {k}: {by_line.get(k,0)}" for k in [x for x in LINES if x]]
-        self._write_report("\n".join(lines))
+        self._show_report(self.reports.events_breakdown(self._filters()))
 
     def _report_coaches(self):
-        rows = self.store.medals_by_coach(self._filters())
-        if not rows:
-            self._write_report("Нет данных по тренерам в рамках фильтра.")
-            return
-        rows.sort(key=lambda r: (r["g"], r["s"], r["b"], r["starts"]), reverse=True)
-        lines = ["Итоги по тренерам:"]
-        for r in rows:
-            lines.append(
-                f"  {r['fio']}: золото {r['g']}, серебро {r['s']}, бронза {r['b']}, "
-                f"стартов {r['starts']}, соревнований {r['events']}, участников {r['athletes']}"
-            )
-        self._write_report("\n".join(lines))
+        self._show_report(self.reports.coaches(self._filters()))
+
+    def _report_season(self):
+        self._show_report(self.reports.season(self._filters()))
 
     # ---- расширенные отчёты (диалоги)
     def _report_person_dialog(self):
@@ -1263,21 +3895,8 @@ class App(tk.Tk):
         ttk.Button(dlg,text="OK",command=ok).pack(pady=8); dlg.grab_set(); self.wait_window(dlg)
 
     def _report_person(self, pid):
-        rows=self.store.person_report(pid, self._filters())
-        pers=self.store.person_raw(pid)
-        header=f"Участник: {pers['last_name']} {pers['first_name']}\n"
-        if not rows:
-            self._write_report(header + "Нет стартов в рамках фильтра.")
-            return
-        lines=[header, "Старты:"]
-        prize=0
-        for r in rows:
-            medal=r["medal"]; place=r["place"]; pm = f", место {place}" if place else ""
-            if medal in ("gold","silver","bronze") or (place and int(place)<=3): prize+=1
-            lines.append(f"  {r['date']} — {r['name']} ({r['level']}, {r['line']}, {r['sport']}) — {r['category']}{pm} {medal or ''}".rstrip())
-        lines.append("")
-        lines.append(f"Итого стартов: {len(rows)}; призовых: {prize}; доля призовых: {round(prize*100/len(rows),1)}%")
-        self._write_report("\n".join(lines))
+        rep = self.reports.person(pid, self._filters())
+        if rep: self._show_report(rep)
 
     def _report_group_dialog(self):
         groups=self.store.list_groups()
@@ -1292,67 +3911,119 @@ class App(tk.Tk):
         ttk.Button(dlg,text="OK",command=ok).pack(pady=8); dlg.grab_set(); self.wait_window(dlg)
 
     def _report_group(self, gid):
-        g, members = self.store.group_info(gid)
-        rows = self.store.group_report(gid, self._filters())
-        lines = [f"Группа: {g['name']} ({g['sport']})", ""]
-        lines.append("Состав:")
-        if members:
-            for m in members:
-                lines.append(f"  {m['fio']} ({m['birthdate'] or '—'})")
-        else:
-            lines.append("  —")
-        lines.append("")
-        lines.append("Результаты:")
-        if not rows:
-            lines.append("  Нет данных в рамках фильтра.")
-        else:
-            prize = 0
-            for r in rows:
-                pm = f", место {r['place']}" if r["place"] else ""
-                if (r["medal"] in ("gold", "silver", "bronze")) or (r["place"] and int(r["place"]) <= 3):
-                    prize += 1
-                lines.append(f"  {r['date']} — {r['name']} — {r['fio']} — {r['category']}{pm} {r['medал'] if 'медал' in r else (r['medal'] or '')}".rstrip())
-            lines.append("")
-            lines.append(f"Итого результатов: {len(rows)}; призовых: {prize}")
-        self._write_report("\n".join(lines))
+        rep = self.reports.group(gid, self._filters())
+        if rep: self._show_report(rep)
+
+    def _report_groups(self):
+        # сравнение всех групп и тренеров: текст отчёта в поле (для экспорта) — один раз, при открытии;
+        # окно с сортируемыми таблицами обновляется вслед за правками (чужими тоже), поле отчёта — нет
+        flt = self._filters()
+        win = tk.Toplevel(self); win.title("Сравнение групп и тренеров"); win.geometry("1100x620"); win.transient(self)
+        nb = ttk.Notebook(win); nb.pack(fill="both", expand=True, padx=8, pady=8)
+        trees = []
+        for title, cols in (("Группы", ReportBuilder.GROUP_COMPARISON_COLS), ("Тренеры", ReportBuilder.COACH_COMPARISON_COLS)):
+            fr = ttk.Frame(nb); nb.add(fr, text=title)
+            tree = ttk.Treeview(fr, show="headings", columns=cols)
+            ysb = ttk.Scrollbar(fr, orient="vertical", command=tree.yview); tree.configure(yscrollcommand=ysb.set)
+            tree.grid(row=0, column=0, sticky="nsew"); ysb.grid(row=0, column=1, sticky="ns")
+            fr.rowconfigure(0, weight=1); fr.columnconfigure(0, weight=1)
+            for i, c in enumerate(cols):
+                tree.heading(c, text=c, command=lambda t=tree, i=i: self._sort_tree(t, i))
+                text = c in ("Группа", "Вид спорта", "Тренер")
+                tree.column(c, width=200 if text else 90, anchor="w" if text else "e")
+            trees.append(tree)
+        def refresh():
+            with self.trace.measure("Сравнение групп", "refresh") as m:
+                data = self.reports.group_comparison(flt); m["rows"] = len(data[0])
+                for tree, rows in zip(trees, data):
+                    self._fill_tree(tree, rows)
+                    if getattr(tree, "_sort", None): self._sort_tree(tree, *tree._sort)   # прежний порядок
+            return data
+        self._show_report(self.reports.groups(flt, refresh()))
+        self._cards.append((win, set(SYNC_TABLES), refresh))
+
+    def _sort_tree(self, tree, col, desc=None):
+        # сортировка уже показанных строк (их немного — по строке на группу); повторный щелчок — обратный порядок
+        if desc is None: desc = not (getattr(tree, "_sort", None) == (col, True))
+        def key(iid):
+            v = tree.item(iid, "values")[col]
+            try: return (0, float(v), "")
+            except (TypeError, ValueError): return (1, 0.0, str(v).casefold())
+        for i, iid in enumerate(sorted(tree.get_children(), key=key, reverse=desc)): tree.move(iid, "", i)
+        tree._sort = (col, desc)
 
     def _report_yearly(self):
-        rows=self.store.yearly_dynamics(self._filters())
-        if not rows:
-            self._write_report("Нет данных для построения динамики.")
-            return
-        lines=["Динамика по годам:"]
-        for r in rows:
-            lines.append(f"  {r['year']}: стартов {r['events']}, медалей {r['total_medals']} (зол {r['gold']}, сер {r['silver']}, бронз {r['bronze']})")
-        self._write_report("\n".join(lines))
+        self._show_report(self.reports.yearly(self._filters()))
 
-    # --- Экспорт текущего отчёта
-    def _export_report_txt(self):
+    def _report_federation(self):
+        folder = filedialog.askdirectory(title="Папка с базами школ")
+        if not folder: return
+        paths = find_school_dbs(folder)
+        if not paths:
+            messagebox.showinfo("Сводка по школам", "В папке нет баз школ (*.db)."); return
+        flt = self._filters()
+        self._start_report_job("Сводка по школам",
+                               lambda progress: federation_aggregates(paths, flt, progress=lambda n, tot: progress(f"баз {n} из {tot}")),
+                               lambda data: self._show_report(federation_report(data)))
+
+    # --- долгие отчёты (сводка по школам, карточки участников) считаются в потоке; окно опрашивает их ход через after()
+    def _start_report_job(self, title, work, done):
+        # work(progress) — в потоке, без виджетов (фильтр и прочее собираются заранее); progress(текст) — ход
+        # для подписи; done(результат) — уже в потоке окна
+        if self._report_job is not None and self._report_job[0].is_alive():
+            messagebox.showinfo(title, "Дождитесь окончания предыдущего отчёта."); return
+        st = {"text": "", "result": None, "error": None}
+        def run():
+            try: st["result"] = work(lambda text: st.update(text=text))
+            except (OSError, sqlite3.Error, ValueError) as e: st["error"] = str(e)
+        self._report_job = (threading.Thread(target=run, daemon=True), title, st, done)
+        self._report_job[0].start()
+        self._poll_report_job()
+
+    def _poll_report_job(self):
+        th, title, st, done = self._report_job
+        if th.is_alive():
+            self.lbl_report_job.config(text=f"{title}: {st['text'] or 'выполняется'}…")
+            self.after(200, self._poll_report_job); return
+        self.lbl_report_job.config(text="")
+        if st["error"]: messagebox.showerror(title, st["error"])
+        else: done(st["result"])
+
+    def _export_person_cards(self):
+        # по файлу на каждого участника со стартами в рамках фильтра (для рассылки)
+        folder = filedialog.askdirectory(title="Папка для карточек участников")
+        if not folder: return
+        folder = os.path.join(folder, f"cards_{self._timestamp()}")
+        flt, fmt, db, t0 = self._filters(), self.cb_cards_fmt.get(), self.store.db_path, time.perf_counter()
+        def work(progress):
+            # своё соединение только для чтения: соединение окна принадлежит его потоку
+            store = Store(db, columnar=False, readonly=True)
+            try: return write_person_reports(store, folder, flt, fmt, progress=lambda n: progress(f"файлов {n}"))
+            finally: store.conn.close()
+        self._start_report_job("Карточки участников", work, lambda n: messagebox.showinfo(
+            "Карточки участников", f"Файлов: {n} ({time.perf_counter() - t0:.1f} с)\n{folder}"))
+
+    # --- Экспорт текущего отчёта (из модели отчёта, строки читаются из БД потоком)
+    def _export_report(self, kind, ext, filetypes, write):
+        if self.current_report is None:
+            messagebox.showinfo("Экспорт", "Сначала сформируйте отчёт.")
+            return
         path = filedialog.asksaveasfilename(
-            title="Сохранить отчёт (TXT)", initialfile=f"report_{self._timestamp()}.txt",
-            defaultextension=".txt", filetypes=[("TXT","*.txt")]
+            title=f"Сохранить отчёт ({kind})", initialfile=f"report_{self._timestamp()}{ext}",
+            defaultextension=ext, filetypes=filetypes
         )
         if not path: return
-        with io.open(path,"w",encoding="utf-8") as f:
-            f.write(self.txt.get("1.0","end").rstrip())
+        write(self.current_report, path)
         messagebox.showinfo("Экспорт", f"Сохранено: {path}")
 
+    def _export_report_txt(self):
+        self._export_report("TXT", ".txt", [("TXT","*.txt")], report_to_txt)
+
     def _export_report_csv(self):
-        path = filedialog.asksaveasfilename(
-            title="Сохранить отчёт (CSV)", initialfile=f"report_{self._timestamp()}.csv",
-            defaultextension=".csv", filetypes=[("CSV","*.csv")]
-        )
-        if not path: return
-        text = self.txt.get("1.0","end").rstrip().splitlines()
-        with io.open(path,"w",encoding="utf-8-sig",newline="") as f:
-            w = csv.writer(f, delimiter=';')
-            for line in text:
-                if ": " in line:
-                    k,v = line.split(": ",1)
-                    w.writerow([k.strip(), v.strip()])
-                else:
-                    w.writerow([line])
-        messagebox.showinfo("Экспорт", f"Сохранено: {path}")
+        self._export_report("CSV", ".csv", [("CSV","*.csv")], report_to_csv)
+
+    def _export_report_xlsx(self):
+        self._export_report("XLSX", ".xlsx", [("Excel","*.xlsx")], report_to_xlsx)
 
     # ---------- Карточки (участник / тренер / соревнование) ----------
     def _mini_filter_frame(self, parent):
@@ -1387,7 +4058,7 @@ class App(tk.Tk):
         sel = self.tree_persons.selection()
         if not sel: return
         pid = int(self.tree_persons.item(sel[0])["values"][0])
-        p = self.store.person_raw(pid)
+        p = self.store.get_person(pid)
 
         win = tk.Toplevel(self); win.title(f"Участник — {p['last_name']} {p['first_name']}"); win.geometry("820x520"); win.transient(self)
 
@@ -1416,26 +4087,26 @@ class App(tk.Tk):
         self._init_all_tags(tree)
 
         def refresh():
-            flt = self._collect_mini_filter(e_from,e_to,cb_sport,cb_line,cb_level)
-            rows = self.store.person_report(pid, flt)
-            for i in tree.get_children(): tree.delete(i)
-            for r in rows:
-                vals = [r["date"], r["name"], r["line"], r["level"], r["sport"], r["category"], r["place"], r["medal"], r["note"]]
-                iid = tree.insert("", "end", values=vals)
-                self._apply_place_tag(tree, iid, r["place"])
-                self._apply_medal_tag(tree, iid, r["medal"])
-            s = self.store.person_summary(pid, flt)
-            summary.set(f"Итого стартов: {s['starts']}  •  призовых: {s['prize']}  •  медали — зол: {s['gold']}, сер: {s['silver']}, бронз: {s['bronze']}")
+            with self.trace.measure("Карточка участника", "refresh") as m:
+                flt = self._collect_mini_filter(e_from,e_to,cb_sport,cb_line,cb_level)
+                rows = self.store.person_report(pid, flt); m["rows"] = len(rows)
+                for i in tree.get_children(): tree.delete(i)
+                for r in rows:
+                    vals = [r["date"], r["name"], r["line"], r["level"], r["sport"], r["category"], r["place"], r["medal"], r["note"]]
+                    iid = tree.insert("", "end", values=vals)
+                    self._apply_place_tag(tree, iid, r["place"])
+                    self._apply_medal_tag(tree, iid, r["medal"])
+                s = self.store.person_summary(pid, flt)
+                summary.set(f"Итого стартов: {s['starts']}  •  призовых: {s['prize']}  •  медали — зол: {s['gold']}, сер: {s['silver']}, бронз: {s['bronze']}")
         ttk.Button(fl, text="Применить", command=refresh).pack(side="right", padx=6)
         refresh()
+        self._cards.append((win, {"persons", "events", "results"}, refresh))
 
     def _open_coach_card(self):
         sel = self.tree_coaches.selection()
         if not sel: return
         cid = int(self.tree_coaches.item(sel[0])["values"][0])
-        c = None
-        for r in self.store.list_coaches():
-            if r["coach_id"]==cid: c=r; break
+        c = self.store.get_coach(cid)
         if not c: return
 
         win = tk.Toplevel(self); win.title(f"Тренер — {c['fio']}"); win.geometry("900x560"); win.transient(self)
@@ -1465,24 +4136,26 @@ class App(tk.Tk):
         self._init_all_tags(tree)
 
         def refresh():
-            flt = self._collect_mini_filter(e_from,e_to,cb_sport,cb_line,cb_level)
-            rows = self.store.coach_results(cid, flt)
-            for i in tree.get_children(): tree.delete(i)
-            for r in rows:
-                vals = [r["date"], r["event_name"], r["fio"], r["category"], r["place"], r["medal"], r["note"]]
-                iid = tree.insert("", "end", values=vals)
-                self._apply_place_tag(tree, iid, r["place"])
-                self._apply_medal_tag(tree, iid, r["medal"])
-            s = self.store.coach_summary(cid, flt)
-            summary.set(f"Стартов: {s['starts']} • Соревнований: {s['events']} • Спортсменов: {s['athletes']} • Медали — зол:{s['g']} сер:{s['s']} бронз:{s['b']}")
+            with self.trace.measure("Карточка тренера", "refresh") as m:
+                flt = self._collect_mini_filter(e_from,e_to,cb_sport,cb_line,cb_level)
+                rows = self.store.coach_results(cid, flt); m["rows"] = len(rows)
+                for i in tree.get_children(): tree.delete(i)
+                for r in rows:
+                    vals = [r["date"], r["event_name"], r["fio"], r["category"], r["place"], r["medal"], r["note"]]
+                    iid = tree.insert("", "end", values=vals)
+                    self._apply_place_tag(tree, iid, r["place"])
+                    self._apply_medal_tag(tree, iid, r["medal"])
+                s = self.store.coach_summary(cid, flt)
+                summary.set(f"Стартов: {s['starts']} • Соревнований: {s['events']} • Спортсменов: {s['athletes']} • Медали — зол:{s['g']} сер:{s['s']} бронз:{s['b']}")
         ttk.Button(fl, text="Применить", command=refresh).pack(side="right", padx=6)
         refresh()
+        self._cards.append((win, {"groups", "persons", "events", "results"}, refresh))
 
     def _open_event_card(self):
         sel = self.tree_events.selection()
         if not sel: return
         eid = int(self.tree_events.item(sel[0])["values"][0])
-        e = self.store.event_raw(eid)
+        e = self.store.get_event(eid)
         win = tk.Toplevel(self); win.title(f"Соревнование — {e['date']} • {e['name']}"); win.geometry("940x560"); win.transient(self)
 
         ttk.Label(win, text=f"{e['date']}  —  {e['name']}  •  {e['level']} / {e['line']} • {e['sport']} • {e.get('location') or '—'}").pack(
@@ -1504,12 +4177,17 @@ class App(tk.Tk):
 
         self._init_all_tags(tree)
 
-        rows = self.store.event_results(eid)
-        for r in rows:
-            vals = [r["place"], r["medal"], r["fio"], r["gname"], r["coach"], r["category"], r["note"]]
-            iid = tree.insert("", "end", values=vals)
-            self._apply_place_tag(tree, iid, r["place"])
-            self._apply_medal_tag(tree, iid, r["medal"])
+        def refresh():
+            with self.trace.measure("Карточка соревнования", "open") as m:
+                rows = self.store.event_results(eid); m["rows"] = len(rows)
+                for i in tree.get_children(): tree.delete(i)
+                for r in rows:
+                    vals = [r["place"], r["medal"], r["fio"], r["gname"], r["coach"], r["category"], r["note"]]
+                    iid = tree.insert("", "end", values=vals)
+                    self._apply_place_tag(tree, iid, r["place"])
+                    self._apply_medal_tag(tree, iid, r["medal"])
+        refresh()
+        self._cards.append((win, set(SYNC_TABLES), refresh))
 
     # -------- Импорт/Экспорт --------
     def _tab_io(self):
@@ -1523,15 +4201,26 @@ class App(tk.Tk):
         else:
             ttk.Label(box,text="(для XLSX установи пакет openpyxl)").pack(side="left",padx=6)
 
+        # Обмен изменениями: только строки, изменённые после прошлой выгрузки
+        box6=ttk.LabelFrame(f,text="Обмен изменениями с другой установкой"); box6.pack(fill="x",padx=8,pady=8)
+        ttk.Button(box6,text="Выгрузить изменения…",command=self._export_delta).pack(side="left",padx=6,pady=6)
+        ttk.Button(box6,text="Загрузить изменения…",command=self._import_delta).pack(side="left",padx=6)
+        self.lbl_delta=ttk.Label(box6,text=""); self.lbl_delta.pack(side="left",padx=6)
+
         # Импорт
         box2=ttk.LabelFrame(f,text="Импорт"); box2.pack(fill="x",padx=8,pady=8)
         self.var_clear= tk.BooleanVar(value=False)
         ttk.Checkbutton(box2,text="Очистить таблицу перед импортом",variable=self.var_clear).pack(side="right",padx=6)
+        self.var_chunked= tk.BooleanVar(value=False)
+        ttk.Checkbutton(box2,text="Большой CSV: частями, с продолжением после сбоя",variable=self.var_chunked).pack(side="right",padx=6)
+        self.lbl_import=ttk.Label(f,text=""); self.lbl_import.pack(fill="x",padx=14)
         ttk.Button(box2,text="Импорт coaches.csv",command=lambda:self._import_csv("coaches")).pack(side="left",padx=6,pady=6)
         ttk.Button(box2,text="Импорт groups.csv",command=lambda:self._import_csv("groups")).pack(side="left",padx=6)
         ttk.Button(box2,text="Импорт persons.csv",command=lambda:self._import_csv("persons")).pack(side="left",padx=6)
         ttk.Button(box2,text="Импорт events.csv",command=lambda:self._import_csv("events")).pack(side="left",padx=6)
         ttk.Button(box2,text="Импорт results.csv",command=lambda:self._import_csv("results")).pack(side="left",padx=6)
+        ttk.Button(box2,text="Импорт папки CSV (все таблицы)",command=self._import_folder).pack(side="left",padx=6)
+        ttk.Button(box2,text="Протокол IOF XML…",command=self._import_iof_dialog).pack(side="left",padx=6)
         if HAS_XLSX:
             ttk.Button(box2,text="Импорт из XLSX (все листы)",command=self._import_xlsx).pack(side="left",padx=6)
 
@@ -1541,6 +4230,41 @@ class App(tk.Tk):
         if HAS_XLSX:
             ttk.Button(box3,text="Создать шаблон XLSX",command=self._make_xlsx_template).pack(side="left",padx=6)
 
+        # Диагностика: замеры задержек интерфейса
+        box4=ttk.LabelFrame(f,text="Диагностика"); box4.pack(fill="x",padx=8,pady=8)
+        self.var_trace=tk.BooleanVar(value=self.trace.enabled)
+        ttk.Checkbutton(box4,text="Замерять время обновления таблиц и карточек",variable=self.var_trace,
+                        command=self._toggle_trace).pack(side="left",padx=6,pady=6)
+        ttk.Button(box4,text="Сохранить трассу → CSV",command=self._export_trace).pack(side="left",padx=6)
+        ttk.Button(box4,text="Очистить трассу",command=self.trace.clear).pack(side="left",padx=6)
+
+        # Резервные копии (sqlite3 backup API, в фоне)
+        box7=ttk.LabelFrame(f,text="Резервные копии"); box7.pack(fill="x",padx=8,pady=8)
+        ttk.Button(box7,text="Создать копию",command=self._start_backup).pack(side="left",padx=6,pady=6)
+        ttk.Button(box7,text="Восстановить из копии…",command=self._restore_backup).pack(side="left",padx=6)
+        self.var_backup_gz=tk.BooleanVar(value=False)
+        ttk.Checkbutton(box7,text="Сжимать (gzip)",variable=self.var_backup_gz).pack(side="left",padx=6)
+        self.var_autobackup=tk.BooleanVar(value=True)
+        ttk.Checkbutton(box7,text=f"Автоматически раз в {BACKUP_INTERVAL_MIN} мин, хранить {BACKUP_KEEP}",
+                        variable=self.var_autobackup).pack(side="left",padx=6)
+        self.lbl_backup=ttk.Label(box7,text=""); self.lbl_backup.pack(side="left",padx=6)
+
+        # Обслуживание: само запускается в простое окна
+        box8=ttk.LabelFrame(f,text="Обслуживание базы"); box8.pack(fill="x",padx=8,pady=8)
+        ttk.Button(box8,text="Обслужить сейчас",command=self._start_maintenance).pack(side="left",padx=6,pady=6)
+        self.lbl_maint=ttk.Label(box8,text=f"статистика запросов и возврат места — после {MAINT_IDLE_SEC} с без ввода")
+        self.lbl_maint.pack(side="left",padx=6)
+
+        # Табло результатов: HTTP/JSON для экрана в зале и телефонов в локальной сети
+        box9=ttk.LabelFrame(f,text="Табло результатов в локальной сети"); box9.pack(fill="x",padx=8,pady=8)
+        self.btn_board=ttk.Button(box9,text="Запустить табло",command=self._toggle_board); self.btn_board.pack(side="left",padx=6,pady=6)
+        self.lbl_board=ttk.Label(box9,text=f"порт {LIVE_PORT}; соревнование — /board/<id>, данные — /api/…"); self.lbl_board.pack(side="left",padx=6)
+
+        # Архив закрытых сезонов
+        box5=ttk.LabelFrame(f,text="Архив сезонов"); box5.pack(fill="x",padx=8,pady=8)
+        ttk.Button(box5,text="Сезоны и архив…",command=self._archive_dialog).pack(side="left",padx=6,pady=6)
+        ttk.Label(box5,text="старые сезоны переносятся в отдельные файлы и подключаются к отчётам по датам фильтра").pack(side="left",padx=6)
+
         # Памятка форматов
         tips=ttk.LabelFrame(f,text="Формат колонок"); tips.pack(fill="x",padx=8,pady=8)
         txt=tk.Text(tips,height=10,wrap="word"); txt.pack(fill="x",padx=6,pady=6)
@@ -1552,9 +4276,183 @@ class App(tk.Tk):
             "events: event_id(optional), name, date(YYYY-MM-DD), level, line, sport, location, total_count\n"
             "results: result_id(optional), event_id, person_id, category, place, medal, note\n"
             "Важно: импорт results делай после загрузки persons и events.\n"
+            "Строки с ошибками (ссылки, даты, уровни/линии/виды спорта/медали) пропускаются и сохраняются рядом с файлом в *_rejected.csv.\n"
         )
         txt.config(state="disabled")
 
+    def _toggle_board(self):
+        board = getattr(self, "board", None)
+        if board is not None and board.running:
+            board.stop(); self.btn_board.config(text="Запустить табло"); self.lbl_board.config(text="остановлено")
+            return
+        self.board = LiveBoard(self.store.db_path)
+        try: self.board.start()
+        except (OSError, ValueError, sqlite3.Error) as e: messagebox.showerror("Табло", str(e)); return
+        self.btn_board.config(text="Остановить табло")
+        self.lbl_board.config(text=f"http://{socket.gethostname()}:{self.board.port}/  (соревнование — /board/<id>)")
+
+    def _export_delta(self):
+        since = self.store.last_delta_version()
+        path = filedialog.asksaveasfilename(title="Выгрузить изменения", initialfile=f"delta_{self._timestamp()}.json",
+                                            defaultextension=".json", filetypes=[("JSON","*.json")])
+        if not path: return
+        delta = self.store.delta_since(since)
+        write_delta(path, delta)
+        self.store.mark_delta_exported("", delta["version"])
+        n = sum(len(d["upsert"]) + len(d["delete"]) for d in delta["tables"].values())
+        self.lbl_delta.config(text=f"Выгружено изменений: {n} (версии {since}…{delta['version']})")
+
+    def _import_delta(self):
+        path = filedialog.askopenfilename(title="Загрузить изменения", filetypes=[("JSON","*.json")])
+        if not path: return
+        try: stats = self.importer.import_delta(read_delta(path))
+        except Exception as e:
+            messagebox.showerror("Изменения — ошибка", str(e)); return
+        messagebox.showinfo("Изменения", f"Загружено: {os.path.basename(path)}\n{import_stats_text(stats) or 'нет изменений'}")
+        self._refresh_after_import()
+
+    # --- правки других операторов той же базы: опрос PRAGMA data_version, перечитываются только
+    # вкладки и открытые карточки, которые зависят от изменённых таблиц
+    EXTERNAL_REFRESH = {
+        "coaches": ("_refresh_coaches", "_refresh_groups", "_refresh_persons", "_refresh_groups_refs"),
+        "groups":  ("_refresh_groups", "_refresh_persons", "_refresh_groups_refs"),
+        "persons": ("_refresh_persons", "_refresh_groups", "_refresh_results", "_refresh_result_refs"),
+        "events":  ("_refresh_events", "_refresh_results", "_refresh_result_refs"),
+        "results": ("_refresh_results", "_refresh_events"),
+    }
+
+    def _poll_external(self):
+        self.after(EXTERNAL_POLL_MS, self._poll_external)
+        if self.store.conn.in_transaction or self._maint is not None: return
+        try: tables = self.store.external_changes()
+        except sqlite3.OperationalError: return     # база занята чужой записью — в следующий раз
+        if tables: self._refresh_external(tables)
+
+    def report_callback_exception(self, exc, val, tb):
+        # запись, которую другой оператор не пустил и после повторов (Store._write), — сообщение вместо трассы
+        if isinstance(val, sqlite3.OperationalError) and "locked" in str(val):
+            messagebox.showerror("База занята", "Базу сейчас изменяет другой оператор. Повторите действие чуть позже.")
+            return
+        super().report_callback_exception(exc, val, tb)
+
+    def _refresh_external(self, tables):
+        for name in dict.fromkeys(m for t in sorted(tables) for m in self.EXTERNAL_REFRESH.get(t, ())):
+            getattr(self, name)()
+        alive = []
+        for win, deps, refresh in self._cards:
+            if not win.winfo_exists(): continue
+            alive.append((win, deps, refresh))
+            if deps & tables: refresh()
+        self._cards = alive
+
+    # --- обслуживание в простое: порции по MAINT_SLICE_MS между событиями окна
+    def _mark_input(self, _event=None):
+        self._last_input = time.monotonic()
+
+    def _maint_tick(self):
+        self.after(MAINT_CHECK_SEC * 1000, self._maint_tick)
+        if time.monotonic() - self._last_input >= MAINT_IDLE_SEC and self.store.conn.total_changes != self._maint_stamp:
+            self._start_maintenance()
+
+    def _start_maintenance(self):
+        if self._maint is not None: return
+        self._maint = self.maintenance.steps()
+        self.lbl_maint.config(text="Обслуживание…")
+        self.after_idle(self._maint_step)
+
+    def _maint_step(self):
+        if self._maint is None: return
+        if self.store.conn.in_transaction or (self._backup_thread is not None and self._backup_thread.is_alive()):
+            self.after(1000, self._maint_step); return
+        t0 = time.perf_counter()
+        try:
+            while time.perf_counter() - t0 < MAINT_SLICE_MS / 1000:
+                next(self._maint)
+        except StopIteration:
+            self._maint = None; self._maint_stamp = self.store.conn.total_changes
+            self.lbl_maint.config(text=maintenance_text(self.maintenance.report).split("\n")[1])
+            return
+        except sqlite3.Error as e:
+            self._maint = None; self.lbl_maint.config(text=f"Обслуживание прервано: {e}")
+            return
+        self.after(1 if time.monotonic() - self._last_input >= 1 else 500, lambda: self.after_idle(self._maint_step))
+
+    # --- резервные копии
+    def _auto_backup(self):
+        self.after(BACKUP_INTERVAL_MIN * 60000, self._auto_backup)
+        if self.var_autobackup.get() and self.store.conn.total_changes != self._backup_stamp:
+            self._start_backup()
+
+    def _start_backup(self):
+        # копия снимается в потоке своим соединением; окно опрашивает её ход через after()
+        if self._backup_thread is not None and self._backup_thread.is_alive(): return
+        self._backup_stamp = self.store.conn.total_changes
+        st = self._backup_state = {"path": None, "error": None, "done": 0.0}
+        compress = self.var_backup_gz.get()
+        def run():
+            try: st["path"] = self.backups.create(compress=compress, progress=lambda rem, tot: st.update(done=1 - rem/tot if tot else 1))
+            except (OSError, sqlite3.Error) as e: st["error"] = str(e)
+        self._backup_thread = threading.Thread(target=run, daemon=True)
+        self._backup_thread.start()
+        self._poll_backup()
+
+    def _poll_backup(self):
+        st = self._backup_state
+        if self._backup_thread.is_alive():
+            self.lbl_backup.config(text=f"Копирование… {int(st['done']*100)}%")
+            self.after(200, self._poll_backup); return
+        self.lbl_backup.config(text=f"Ошибка копии: {st['error']}" if st["error"] else
+                               f"Копия {dt.now().strftime('%H:%M')}: {os.path.basename(st['path'])}")
+
+    def _restore_backup(self):
+        if self._backup_thread is not None and self._backup_thread.is_alive():
+            messagebox.showinfo("Восстановление", "Дождитесь окончания копирования."); return
+        path = filedialog.askopenfilename(title="Восстановить из копии", initialdir=self.backups.folder,
+                                          filetypes=[("Копии базы","*.db *.db.gz")])
+        if not path: return
+        if not messagebox.askyesno("Восстановление", f"Заменить данные копией {os.path.basename(path)}?\n"
+                                   "Текущее состояние будет сохранено отдельной копией."): return
+        try: saved = self.backups.restore(path)
+        except (ValueError, OSError, sqlite3.Error) as e:
+            messagebox.showerror("Восстановление — ошибка", str(e)); return
+        messagebox.showinfo("Восстановление", f"Данные восстановлены из {os.path.basename(path)}.\nПрежнее состояние: {os.path.basename(saved)}")
+        self._refresh_after_import()
+
+    def _archive_dialog(self):
+        dlg=tk.Toplevel(self); dlg.title("Архив сезонов"); dlg.transient(self); dlg.geometry("720x360")
+        cols=["Сезон","Соревнований","Результатов","В архиве: соревн.","В архиве: рез.","Файл архива"]
+        tree=ttk.Treeview(dlg,columns=cols,show="headings",selectmode="browse")
+        for c,w in zip(cols,[70,100,100,120,110,200]): tree.heading(c,text=c); tree.column(c,width=w,anchor="w")
+        tree.pack(fill="both",expand=True,padx=8,pady=8)
+        def load():
+            tree.delete(*tree.get_children())
+            for y,st in self.store.seasons().items():
+                tree.insert("","end",iid=str(y),values=[y,st["events"],st["results"],st["archived_events"],st["archived_results"],st["path"]])
+        def archive():
+            sel=tree.selection()
+            if not sel: return
+            y=int(sel[0])
+            if not messagebox.askyesno("Архив",f"Перенести сезон {y} в архив?\nСоревнования и результаты уйдут из рабочей базы, отчёты за {y} год будут читать их из файла архива.",parent=dlg): return
+            try: ne,nr=self.store.archive_season(y)
+            except (ValueError, OSError, sqlite3.Error) as e:
+                messagebox.showerror("Архив",str(e),parent=dlg); return
+            messagebox.showinfo("Архив",f"Перенесено: соревнований {ne}, результатов {nr}",parent=dlg)
+            load(); self._refresh_events(); self._refresh_results()
+        bar=ttk.Frame(dlg); bar.pack(fill="x",padx=8,pady=(0,8))
+        ttk.Button(bar,text="Закрыть",command=dlg.destroy).pack(side="right")
+        ttk.Button(bar,text="Перенести в архив",command=archive).pack(side="right",padx=(0,6))
+        load()
+
+    def _toggle_trace(self):
+        self.trace.enabled = bool(self.var_trace.get())
+
+    def _export_trace(self):
+        path = filedialog.asksaveasfilename(title="Сохранить трассу (CSV)", initialfile=f"ui_trace_{self._timestamp()}.csv",
+                                            defaultextension=".csv", filetypes=[("CSV","*.csv")])
+        if not path: return
+        n = self.trace.export_csv(path)
+        messagebox.showinfo("Трасса", f"Сохранено замеров: {n}\n{path}")
+
     # ---- экспорт всех таблиц в CSV/XLSX и импорт
     def _save_dialog(self, title, defname):
         return filedialog.asksaveasfilename(title=title, initialfile=defname, defaultextension=".csv",
@@ -1575,7 +4473,7 @@ class App(tk.Tk):
                   ["coach_id","fio","phone"],
                   [[r["coach_id"],r["fio"],r["phone"]] for r in self.store.list_coaches()])
         # groups
-        glist = self.store._fetchall("SELECT group_id,name,sport,coach_id FROM groups ORDER BY group_id")
+        glist = self.store._fetchall("SELECT group_id,name,sport,coach_id FROM groups_named ORDER BY group_id")
         write_csv(os.path.join(folder,f"{base}_groups.csv"),
                   ["group_id","name","sport","coach_id"],
                   [[r["group_id"],r["name"],r["sport"],r["coach_id"] or ""] for r in glist])
@@ -1585,12 +4483,12 @@ class App(tk.Tk):
                   ["person_id","last_name","first_name","birthdate","address","phone","group_id"],
                   [[r["person_id"],r["last_name"],r["first_name"],r["birthdate"] or "",r["address"] or "",r["phone"] or "",r["group_id"] or ""] for r in plist])
         # events
-        elist = self.store._fetchall("SELECT event_id,name,date,level,line,sport,location,total_count FROM events ORDER BY date DESC, event_id DESC")
+        elist = self.store._fetchall("SELECT event_id,name,date,level,line,sport,location,total_count FROM events_named ORDER BY date DESC, event_id DESC")
         write_csv(os.path.join(folder,f"{base}_events.csv"),
                   ["event_id","name","date","level","line","sport","location","total_count"],
                   [[r["event_id"],r["name"],r["date"],r["level"],r["line"],r["sport"],r["location"] or "",r["total_count"] or ""] for r in elist])
         # results
-        rlist = self.store._fetchall("SELECT result_id,event_id,person_id,category,place,medal,note FROM results ORDER BY result_id")
+        rlist = self.store._fetchall("SELECT result_id,event_id,person_id,category,place,medal,note FROM results_named ORDER BY result_id")
         write_csv(os.path.join(folder,f"{base}_results.csv"),
                   ["result_id","event_id","person_id","category","place","medal","note"],
                   [[r["result_id"],r["event_id"],r["person_id"],r["category"] or "",r["place"] or "",r["medal"] or "",r["note"] or ""] for r in rlist])
@@ -1599,95 +4497,89 @@ class App(tk.Tk):
     def _import_csv(self, table):
         path = self._open_dialog(f"Выбери {table}.csv")
         if not path: return
-        clear = self.var_clear.get()
+        if self.var_chunked.get():
+            self._import_csv_chunked(table, path); return
         try:
             with io.open(path,"r",encoding="utf-8-sig") as f:
                 r = csv.reader(f, delimiter=';')
                 header = next(r, [])
-                rows = list(r)
-            cur = self.store.conn.cursor()
-            cur.execute("BEGIN")
-            if clear:
-                cur.execute(f"DELETE FROM {table}")
-            if table == "coaches":
-                idx = {h:i for i,h in enumerate(header)}
-                for row in rows:
-                    fio = row[idx.get("fio",1)].strip()
-                    phone = row[idx.get("phone",2)].strip() or None
-                    cidtxt = row[idx.get("coach_id",0)].strip() if "coach_id" in idx else ""
-                    if cidtxt:
-                        cur.execute("INSERT OR REPLACE INTO coaches(coach_id,fio,phone) VALUES(?,?,?)", (int(cidtxt), fio, phone))
-                    else:
-                        cur.execute("INSERT INTO coaches(fio,phone) VALUES(?,?)", (fio, phone))
-            elif table == "groups":
-                idx = {h:i for i,h in enumerate(header)}
-                for row in rows:
-                    name = row[idx.get("name",1)].strip()
-                    sport= row[idx.get("sport",2)].strip() or "Ориентирование"
-                    coach = row[idx.get("coach_id",3)].strip()
-                    gidtxt = row[idx.get("group_id",0)].strip() if "group_id" in idx else ""
-                    coach_id = int(coach) if coach else None
-                    if gidtxt:
-                        cur.execute("INSERT OR REPLACE INTO groups(group_id,name,sport,coach_id) VALUES(?,?,?,?)",
-                                    (int(gidtxt), name, sport, coach_id))
-                    else:
-                        cur.execute("INSERT INTO groups(name,sport,coach_id) VALUES(?,?,?)",
-                                    (name, sport, coach_id))
-            elif table == "persons":
-                idx = {h:i for i,h in enumerate(header)}
-                for row in rows:
-                    last=row[idx.get("last_name",1)].strip(); first=row[idx.get("first_name",2)].strip()
-                    birth=row[idx.get("birthdate",3)].strip() or None
-                    addr=row[idx.get("address",4)].strip() or None
-                    phone=row[idx.get("phone",5)].strip() or None
-                    gid=row[idx.get("group_id",6)].strip(); group_id=int(gid) if gid else None
-                    pidtxt=row[idx.get("person_id",0)].strip() if "person_id" in idx else ""
-                    if pidtxt:
-                        cur.execute("""INSERT OR REPLACE INTO persons(person_id,last_name,first_name,birthdate,address,phone,group_id)
-                                       VALUES(?,?,?,?,?,?,?)""",(int(pidtxt),last,first,birth,addr,phone,group_id))
-                    else:
-                        cur.execute("""INSERT INTO persons(last_name,first_name,birthdate,address,phone,group_id)
-                                       VALUES(?,?,?,?,?,?)""",(last,first,birth,addr,phone,group_id))
-            elif table == "events":
-                idx = {h:i for i,h in enumerate(header)}
-                for row in rows:
-                    name=row[idx.get("name",1)].strip()
-                    date=row[idx.get("date",2)].strip()
-                    level=row[idx.get("level",3)].strip() or "Район"
-                    line=row[idx.get("line",4)].strip() or "Образование"
-                    sport=row[idx.get("sport",5)].strip() or "Ориентирование"
-                    loc=row[idx.get("location",6)].strip() or None
-                    tot=row[idx.get("total_count",7)].strip(); total=int(tot) if tot.isdigit() else None
-                    eidtxt=row[idx.get("event_id",0)].strip() if "event_id" in idx else ""
-                    if eidtxt:
-                        cur.execute("""INSERT OR REPLACE INTO events(event_id,name,date,level,line,sport,location,total_count)
-                                       VALUES(?,?,?,?,?,?,?,?)""",(int(eidtxt),name,date,level,line,sport,loc,total))
-                    else:
-                        cur.execute("""INSERT INTO events(name,date,level,line,sport,location,total_count)
-                                       VALUES(?,?,?,?,?,?,?)""",(name,date,level,line,sport,loc,total))
-            elif table == "results":
-                idx = {h:i for i,h in enumerate(header)}
-                for row in rows:
-                    eid=int(row[idx.get("event_id",1)].strip())
-                    pid=int(row[idx.get("person_id",2)].strip())
-                    cat=(row[idx.get("category",3)].strip() or '')
-                    plc=row[idx.get("place",4)].strip(); place=int(plc) if plc.isdigit() else None
-                    medal=row[idx.get("medal",5)].strip() or ""
-                    note=row[idx.get("note",6)].strip() or None
-                    ridtxt=row[idx.get("result_id",0)].strip() if "result_id" in idx else ""
-                    if ridtxt:
-                        cur.execute("""INSERT OR REPLACE INTO results(result_id,event_id,person_id,category,place,medal,note)
-                                       VALUES(?,?,?,?,?,?,?)""",(int(ridtxt),eid,pid,cat,place,medal,note))
-                    else:
-                        cur.execute("""INSERT OR REPLACE INTO results(event_id,person_id,category,place,medal,note)
-                                       VALUES(?,?,?,?,?,?)""",(eid,pid,cat,place,medal,note))
-            cur.execute("COMMIT")
+                stats = self.importer.import_table(table, header, r, clear=self.var_clear.get())
         except Exception as e:
-            try: cur.execute("ROLLBACK")
-            except: pass
             messagebox.showerror("Импорт CSV — ошибка", str(e))
             return
-        messagebox.showinfo("Импорт CSV", f"Импорт завершён: {table}")
+        msg = f"Импорт завершён: {table}\n{import_stats_text({table: stats})}"
+        msg += self._save_rejected({table: stats}, os.path.splitext(path)[0])
+        messagebox.showinfo("Импорт CSV", msg)
+        self._refresh_after_import()
+
+    def _import_csv_chunked(self, table, path):
+        resume = True
+        cp = self.importer.find_checkpoint(table, path)
+        if cp and not cp["done"]:
+            ans = messagebox.askyesnocancel("Импорт частями",
+                f"Этот файл уже загружался: обработано строк {cp['row_no']}.\n"
+                f"Да — продолжить с этого места, Нет — начать заново.")
+            if ans is None: return
+            resume = ans
+        rejected_path = f"{os.path.splitext(path)[0]}_{table}_rejected.csv"
+        def progress(n):
+            self.lbl_import.config(text=f"{table}: обработано строк {n}"); self.update_idletasks()
+        try:
+            stats = self.importer.import_csv_chunked(table, path, chunk=IMPORT_CHUNK_ROWS, clear=self.var_clear.get(),
+                                                     resume=resume, rejected_path=rejected_path, progress=progress)
+        except Exception as e:
+            messagebox.showerror("Импорт CSV — ошибка",
+                                 f"{e}\n\nЗагруженные части сохранены; при повторном импорте файла можно продолжить.")
+            self._refresh_after_import()
+            return
+        finally:
+            self.lbl_import.config(text="")
+        msg = f"Импорт завершён: {table}, строк {stats['rows']}\n{import_stats_text({table: stats})}"
+        if stats["rejected"]: msg += f"\n\nОтклонённые строки:\n{rejected_path}"
+        messagebox.showinfo("Импорт CSV", msg)
+        self._refresh_after_import()
+
+    def _save_rejected(self, stats, base):
+        # отклонённые строки — рядом с исходным файлом: <имя>_<таблица>_rejected.csv
+        out = []
+        for table, st in stats.items():
+            if not st.get("rejected"): continue
+            path = f"{base}_{table}_rejected.csv"
+            try:
+                self.importer.write_rejected(table, path); out.append(path)
+            except OSError as e:
+                out.append(f"{table}: не удалось сохранить ({e})")
+        return ("\n\nОтклонённые строки:\n" + "\n".join(out)) if out else ""
+
+    def _import_iof_dialog(self):
+        path = filedialog.askopenfilename(title="Протокол IOF XML 3.0 (ResultList)", filetypes=[("IOF XML","*.xml"),("All","*.*")])
+        if not path: return
+        dlg=tk.Toplevel(self); dlg.title("Импорт протокола IOF XML"); dlg.transient(self)
+        cb_event=ttk.Combobox(dlg,values=self._event_options(),width=60); cb_event.set("")
+        cb_lvl=ttk.Combobox(dlg,values=[l for l in LEVELS if l],width=16); cb_lvl.set("Район")
+        cb_line=ttk.Combobox(dlg,values=[l for l in LINES if l],width=16); cb_line.set("Спорт")
+        var_create=tk.BooleanVar(value=False)
+        ttk.Label(dlg,text="Соревнование (пусто — взять из протокола)").grid(row=0,column=0,sticky="w",padx=6,pady=4); cb_event.grid(row=0,column=1,columnspan=3,padx=6)
+        ttk.Label(dlg,text="Уровень нового").grid(row=1,column=0,sticky="w",padx=6,pady=4); cb_lvl.grid(row=1,column=1,sticky="w",padx=6)
+        ttk.Label(dlg,text="Линия нового").grid(row=1,column=2,sticky="w",padx=6,pady=4); cb_line.grid(row=1,column=3,sticky="w",padx=6)
+        ttk.Checkbutton(dlg,text="Добавлять в базу участников, которых нет (иначе — только наши)",variable=var_create).grid(
+            row=2,column=0,columnspan=4,sticky="w",padx=6,pady=4)
+        def ok():
+            eid=self._parse_id(cb_event.get()) if cb_event.get().strip() else None
+            dlg.destroy()
+            try:
+                st=IofImporter(self.store).import_file(path, event_id=eid, create_persons=var_create.get(),
+                                                       level=cb_lvl.get().strip() or "Район", line=cb_line.get().strip() or "Спорт")
+            except Exception as e:
+                messagebox.showerror("Импорт IOF XML — ошибка", str(e)); return
+            msg = f"Импорт завершён: {os.path.basename(path)}\n{iof_stats_text(st)}"
+            msg += self._save_rejected({"results": st}, os.path.splitext(path)[0])
+            messagebox.showinfo("Импорт IOF XML", msg)
+            self._refresh_after_import()
+        ttk.Button(dlg,text="Импорт",command=ok).grid(row=3,column=3,sticky="e",padx=6,pady=8)
+        dlg.grab_set(); self.wait_window(dlg)
+
+    def _refresh_after_import(self):
         self._refresh_coaches(); self._refresh_groups(); self._refresh_persons(); self._refresh_events(); self._refresh_results(); self._refresh_result_refs()
 
     # --- XLSX (если есть openpyxl)
@@ -1704,16 +4596,16 @@ class App(tk.Tk):
         wb.remove(wb.active)
         ws("coaches", ["coach_id","fio","phone"],
            [[r["coach_id"],r["fio"],r["phone"]] for r in self.store.list_coaches()])
-        glist=self.store._fetchall("SELECT group_id,name,sport,coach_id FROM groups ORDER BY group_id")
+        glist=self.store._fetchall("SELECT group_id,name,sport,coach_id FROM groups_named ORDER BY group_id")
         ws("groups", ["group_id","name","sport","coach_id"],
            [[r["group_id"],r["name"],r["sport"],r["coach_id"]] for r in glist])
         plist=self.store._fetchall("SELECT person_id,last_name,first_name,birthdate,address,phone,group_id FROM persons ORDER BY person_id")
         ws("persons", ["person_id","last_name","first_name","birthdate","address","phone","group_id"],
            [[r["person_id"],r["last_name"],r["first_name"],r["birthdate"],r["address"],r["phone"],r["group_id"]] for r in plist])
-        elist=self.store._fetchall("SELECT event_id,name,date,level,line,sport,location,total_count FROM events ORDER BY date DESC, event_id DESC")
+        elist=self.store._fetchall("SELECT event_id,name,date,level,line,sport,location,total_count FROM events_named ORDER BY date DESC, event_id DESC")
         ws("events", ["event_id","name","date","level","line","sport","location","total_count"],
            [[r["event_id"],r["name"],r["date"],r["level"],r["line"],r["sport"],r["location"],r["total_count"]] for r in elist])
-        rlist=self.store._fetchall("SELECT result_id,event_id,person_id,category,place,medal,note FROM results ORDER BY result_id")
+        rlist=self.store._fetchall("SELECT result_id,event_id,person_id,category,place,medal,note FROM results_named ORDER BY result_id")
         ws("results", ["result_id","event_id","person_id","category","place","medal","note"],
            [[r["result_id"],r["event_id"],r["person_id"],r["category"],r["place"],r["medal"],r["note"]] for r in rlist])
         wb.save(path)
@@ -1723,99 +4615,26 @@ class App(tk.Tk):
         if not HAS_XLSX: return
         path = filedialog.askopenfilename(title="Выбери XLSX", filetypes=[("Excel","*.xlsx")])
         if not path: return
-        clear = self.var_clear.get()
+        self._import_sources(path, "Импорт XLSX")
+
+    def _import_folder(self):
+        folder = filedialog.askdirectory(title="Папка с CSV (экспорт или шаблоны)")
+        if not folder: return
+        self._import_sources(folder, "Импорт папки CSV")
+
+    def _import_sources(self, path, title):
         try:
-            wb = openpyxl.load_workbook(path, data_only=True)
-            cur = self.store.conn.cursor(); cur.execute("BEGIN")
-            order = ["coaches","groups","persons","events","results"]
-            for name in order:
-                if name not in wb.sheetnames: continue
-                ws = wb[name]
-                rows = list(ws.values)
-                if not rows: continue
-                header = [str(h) if h is not None else "" for h in rows[0]]
-                data = rows[1:]
-                if clear:
-                    cur.execute(f"DELETE FROM {name}")
-                idx = {h:i for i,h in enumerate(header)}
-                if name == "coaches":
-                    for row in data:
-                        fio = str(row[idx.get("fio",1)] or "").strip()
-                        phone = str(row[idx.get("phone",2)] or "").strip() or None
-                        cidtxt = str(row[idx.get("coach_id",0)] or "").strip() if "coach_id" in idx else ""
-                        if cidtxt:
-                            cur.execute("INSERT OR REPLACE INTO coaches(coach_id,fio,phone) VALUES(?,?,?)", (int(cidtxt), fio, phone))
-                        else:
-                            cur.execute("INSERT INTO coaches(fio,phone) VALUES(?,?)", (fio, phone))
-                elif name == "groups":
-                    for row in data:
-                        namev = str(row[idx.get("name",1)] or "").strip()
-                        sport = str(row[idx.get("sport",2)] or "").strip() or "Ориентирование"
-                        coach = str(row[idx.get("coach_id",3)] or "").strip()
-                        gidtxt = str(row[idx.get("group_id",0)] or "").strip() if "group_id" in idx else ""
-                        coach_id = int(coach) if coach else None
-                        if gidtxt:
-                            cur.execute("INSERT OR REPLACE INTO groups(group_id,name,sport,coach_id) VALUES(?,?,?,?)",
-                                        (int(gidtxt), namev, sport, coach_id))
-                        else:
-                            cur.execute("INSERT INTO groups(name,sport,coach_id) VALUES(?,?,?)",
-                                        (namev, sport, coach_id))
-                elif name == "persons":
-                    for row in data:
-                        last = str(row[idx.get("last_name",1)] or "").strip()
-                        first= str(row[idx.get("first_name",2)] or "").strip()
-                        birth= str(row[idx.get("birthdate",3)] or "").strip() or None
-                        addr = str(row[idx.get("address",4)] or "").strip() or None
-                        phone= str(row[idx.get("phone",5)] or "").strip() or None
-                        gid  = str(row[idx.get("group_id",6)] or "").strip()
-                        group_id = int(gid) if gid else None
-                        pidtxt = str(row[idx.get("person_id",0)] or "").strip() if "person_id" in idx else ""
-                        if pidtxt:
-                            cur.execute("""INSERT OR REPLACE INTO persons(person_id,last_name,first_name,birthdate,address,phone,group_id)
-                                           VALUES(?,?,?,?,?,?,?)""",(int(pidtxt),last,first,birth,addr,phone,group_id))
-                        else:
-                            cur.execute("""INSERT INTO persons(last_name,first_name,birthdate,address,phone,group_id)
-                                           VALUES(?,?,?,?,?,?)""",(last,first,birth,addr,phone,group_id))
-                elif name == "events":
-                    for row in data:
-                        namev = str(row[idx.get("name",1)] or "").strip()
-                        date  = str(row[idx.get("date",2)] or "").strip()
-                        level = str(row[idx.get("level",3)] or "").strip() or "Район"
-                        line  = str(row[idx.get("line",4)] or "").strip() or "Образование"
-                        sport = str(row[idx.get("sport",5)] or "").strip() or "Ориентирование"
-                        loc   = str(row[idx.get("location",6)] or "").strip() or None
-                        tot   = str(row[idx.get("total_count",7)] or "").strip()
-                        total = int(tot) if tot.isdigit() else None
-                        eidtxt= str(row[idx.get("event_id",0)] or "").strip() if "event_id" in idx else ""
-                        if eidtxt:
-                            cur.execute("""INSERT OR REPLACE INTO events(event_id,name,date,level,line,sport,location,total_count)
-                                           VALUES(?,?,?,?,?,?,?,?)""",(int(eidtxt),namev,date,level,line,sport,loc,total))
-                        else:
-                            cur.execute("""INSERT INTO events(name,date,level,line,sport,location,total_count)
-                                           VALUES(?,?,?,?,?,?,?)""",(namev,date,level,line,sport,loc,total))
-                elif name == "results":
-                    for row in data:
-                        eid = int(str(row[idx.get("event_id",1)] or "0").strip())
-                        pid = int(str(row[idx.get("person_id",2)] or "0").strip())
-                        cat = str(row[idx.get("category",3)] or "").strip()
-                        plc = str(row[idx.get("place",4)] or "").strip()
-                        place = int(plc) if plc.isdigit() else None
-                        medal = str(row[idx.get("medal",5)] or "").strip()
-                        note  = str(row[idx.get("note",6)] or "").strip() or None
-                        ridtxt= str(row[idx.get("result_id",0)] or "").strip() if "result_id" in idx else ""
-                        if ridtxt:
-                            cur.execute("""INSERT OR REPLACE INTO results(result_id,event_id,person_id,category,place,medal,note)
-                                           VALUES(?,?,?,?,?,?,?)""",(int(ridtxt),eid,pid,cat,place,medal,note))
-                        else:
-                            cur.execute("""INSERT OR REPLACE INTO results(event_id,person_id,category,place,medal,note)
-                                           VALUES(?,?,?,?,?,?)""",(eid,pid,cat,place,medal,note))
-            cur.execute("COMMIT")
+            sources = find_import_sources(path)
+            if not sources:
+                messagebox.showwarning(title, "Не найдено файлов/листов coaches, groups, persons, events, results."); return
+            stats = self.importer.import_sources(sources, clear=self.var_clear.get())
         except Exception as e:
-            try: cur.execute("ROLLBACK")
-            except: pass
-            messagebox.showerror("Импорт XLSX — ошибка", str(e)); return
-        messagebox.showinfo("Импорт XLSX", f"Импорт завершён: {os.path.basename(path)}")
-        self._refresh_coaches(); self._refresh_groups(); self._refresh_persons(); self._refresh_events(); self._refresh_results(); self._refresh_result_refs()
+            messagebox.showerror(f"{title} — ошибка", str(e)); return
+        base = os.path.join(path, "import") if os.path.isdir(path) else os.path.splitext(path)[0]
+        msg = f"Импорт завершён: {os.path.basename(path)}\n{import_stats_text(stats)}"
+        msg += self._save_rejected(stats, base)
+        messagebox.showinfo(title, msg)
+        self._refresh_after_import()
 
     # ------------- шаблоны -------------
     def _make_csv_templates(self):
@@ -1849,7 +4668,209 @@ class App(tk.Tk):
         ws("results", ["result_id","event_id","person_id","category","place","medal","note"])
         wb.save(path); messagebox.showinfo("Шаблон XLSX", f"Сохранено: {path}")
 
+# ------------- командная строка -------------
+def cli(argv):
+    import argparse
+    ap = argparse.ArgumentParser(prog="sport_school_app.py", description="Sports DB — работа без окна")
+    ap.add_argument("--db", default=DB_PATH, help="файл базы (по умолчанию sports.db)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    rp = sub.add_parser("report", help="сформировать отчёт")
+    rp.add_argument("kind", choices=list(REPORT_KINDS), help="; ".join(f"{k} — {v}" for k,v in REPORT_KINDS.items()))
+    rp.add_argument("--id", type=int, help="person_id / group_id для отчётов person и group")
+    def date_arg(v):
+        if not v: return v
+        try: date_ordinal(v); return v
+        except ValueError: raise argparse.ArgumentTypeError(f"дата в формате YYYY-MM-DD: {v!r}")
+    def filter_args(p, save=True):
+        for k,_ in FILTER_FIELDS:
+            p.add_argument("--" + k.replace("_","-"), dest=k, default="", type=date_arg if k in FILTER_PARAMS else str)
+        if not save: return
+        p.add_argument("--csv", help="сохранить в CSV")
+        p.add_argument("--xlsx", help="сохранить в XLSX (нужен openpyxl)")
+    filter_args(rp)
+
+    fp = sub.add_parser("federation", help="сводка по базам школ в папке (медали, тренеры, годы)")
+    fp.add_argument("folder")
+    fp.add_argument("--workers", type=int, default=None, help="процессов (0 — без пула)")
+    filter_args(fp)
+
+    cp = sub.add_parser("cards", help="карточки всех участников со стартами: по файлу на участника")
+    cp.add_argument("folder")
+    cp.add_argument("--format", choices=list(REPORT_WRITERS), default="txt")
+    cp.add_argument("--group", type=int, help="только участники группы (group_id)")
+    cp.add_argument("--workers", type=int, default=None, help="процессов (0 — без пула)")
+    filter_args(cp, save=False)
+
+    ip = sub.add_parser("import", help="импорт папки CSV, файла <таблица>.csv или книги XLSX")
+    ip.add_argument("path")
+    ip.add_argument("--clear", action="store_true", help="очистить таблицы перед импортом")
+    ip.add_argument("--workers", type=int, default=None, help="процессов для разбора (0 — без пула)")
+    ip.add_argument("--chunk", type=int, default=0, metavar="N",
+                    help="для одного CSV: фиксировать каждые N строк и продолжать после сбоя")
+    ip.add_argument("--restart", action="store_true", help="с --chunk: не продолжать с контрольной точки")
+
+    xp = sub.add_parser("iof", help="импорт протокола IOF XML 3.0 (ResultList)")
+    xp.add_argument("path")
+    xp.add_argument("--event-id", type=int, help="добавить результаты к существующему соревнованию")
+    xp.add_argument("--create-persons", action="store_true", help="добавлять отсутствующих участников")
+    xp.add_argument("--level", default="Район", choices=[l for l in LEVELS if l])
+    xp.add_argument("--line", default="Спорт", choices=[l for l in LINES if l])
+
+    dp = sub.add_parser("dedup", help="поиск дублей участников")
+    dp.add_argument("--threshold", type=float, default=PersonDedup.THRESHOLD, help="порог сходства 0..1")
+    dp.add_argument("--merge", action="store_true", help="объединить найденные дубли")
+
+    sp = sub.add_parser("delta", help="обмен изменениями с другой установкой")
+    sp.add_argument("action", choices=["export", "import"])
+    sp.add_argument("path", help="файл изменений (JSON)")
+    sp.add_argument("--peer", default="", help="адресат выгрузки: с какой версии выгружать, помнится для каждого")
+    sp.add_argument("--since", type=int, default=None, help="выгрузить изменения после этой версии журнала")
+
+    bp = sub.add_parser("backup", help="резервная копия базы (sqlite3 backup API)")
+    bp.add_argument("--compress", action="store_true", help="сжать копию (gzip)")
+    bp.add_argument("--keep", type=int, default=BACKUP_KEEP, help="сколько последних копий хранить")
+    bp.add_argument("--folder", help="папка копий (по умолчанию backups рядом с базой)")
+    bp.add_argument("--list", action="store_true", help="только показать копии")
+    mp = sub.add_parser("maintain", help="обслуживание: возврат места, статистика планировщика, контрольная точка WAL")
+    mp.add_argument("--vacuum", action="store_true", help="перевести базу в auto_vacuum=INCREMENTAL (полный VACUUM)")
+    mp.add_argument("--analyze", action="store_true", help="полный ANALYZE вместо PRAGMA optimize")
+    rs = sub.add_parser("restore", help="восстановить базу из копии")
+    rs.add_argument("path")
+
+    lp = sub.add_parser("serve", help="табло результатов: HTTP/JSON только для чтения в локальной сети")
+    lp.add_argument("--host", default="0.0.0.0")
+    lp.add_argument("--port", type=int, default=LIVE_PORT)
+    lp.add_argument("--workers", type=int, default=LIVE_WORKERS, help="потоков с запросами к базе")
+
+    ap_ = sub.add_parser("archive", help="архив закрытых сезонов")
+    ap_.add_argument("years", nargs="*", type=int, help="перенести сезоны в архив (без аргументов — список сезонов)")
+
+    args = ap.parse_args(argv)
+    if args.cmd == "federation":
+        if args.xlsx and not HAS_XLSX:
+            ap.error("для XLSX установи пакет openpyxl")
+        paths = find_school_dbs(args.folder)
+        if not paths:
+            ap.error(f"в папке нет баз школ: {args.folder}")
+        rep = federation_report(federation_aggregates(paths, {k: getattr(args, k) for k,_ in FILTER_FIELDS}, args.workers))
+        if args.csv:  report_to_csv(rep, args.csv)
+        if args.xlsx: report_to_xlsx(rep, args.xlsx)
+        if not (args.csv or args.xlsx): print(report_to_text(rep))
+        return 0
+    if args.cmd == "serve":
+        board = LiveBoard(args.db, args.host, args.port, args.workers)
+        try: board.check()
+        except (ValueError, sqlite3.Error) as e: ap.error(f"{args.db}: {e}")
+        print(f"Табло: http://{args.host}:{args.port}/ (Ctrl+C — остановить)")
+        try: board.serve()
+        except KeyboardInterrupt: pass
+        return 0
+    store = Store(args.db)
+    if args.cmd == "cards":
+        if args.format == "xlsx" and not HAS_XLSX:
+            ap.error("для XLSX установи пакет openpyxl")
+        t0 = time.perf_counter()
+        n = write_person_reports(store, args.folder, {k: getattr(args, k) for k,_ in FILTER_FIELDS}, args.format,
+                                 group_id=args.group, workers=args.workers)
+        print(f"Карточек: {n} → {args.folder} ({time.perf_counter() - t0:.1f} с)")
+        return 0
+    if args.cmd == "backup":
+        bk = Backups(store, folder=args.folder, keep=args.keep)
+        if not args.list:
+            t0 = time.perf_counter()
+            print(f"Копия: {bk.create(compress=args.compress)} ({time.perf_counter() - t0:.1f} с)")
+        for path, size in bk.list():
+            print(f"{path}\t{size // 1024} КБ")
+        return 0
+    if args.cmd == "maintain":
+        print(maintenance_text(Maintenance(store).run(vacuum=args.vacuum, analyze=args.analyze)))
+        return 0
+    if args.cmd == "restore":
+        t0 = time.perf_counter()
+        saved = Backups(store).restore(args.path)
+        print(f"Восстановлено из {args.path} ({time.perf_counter() - t0:.1f} с); прежнее состояние: {saved}")
+        return 0
+    if args.cmd == "delta":
+        if args.action == "import":
+            print(import_stats_text(Importer(store).import_delta(read_delta(args.path))))
+            return 0
+        since = store.last_delta_version(args.peer) if args.since is None else args.since
+        delta = store.delta_since(since)
+        write_delta(args.path, delta)
+        store.mark_delta_exported(args.peer, delta["version"])
+        n = sum(len(d["upsert"]) + len(d["delete"]) for d in delta["tables"].values())
+        print(f"Изменений: {n} (версии {since}…{delta['version']}) → {args.path}")
+        return 0
+    if args.cmd == "archive":
+        for y in args.years:
+            try: ne, nr = store.archive_season(y)
+            except ValueError as e: print(e, file=sys.stderr); return 1
+            print(f"{y}: перенесено соревнований {ne}, результатов {nr} → {store.archive_file(y)}")
+        if not args.years:
+            for y, st in store.seasons().items():
+                print(f"{y}\tв базе: {st['events']}/{st['results']}\tв архиве: {st['archived_events']}/{st['archived_results']}\t{st['path']}")
+        return 0
+    if args.cmd == "dedup":
+        dd = PersonDedup(store)
+        clusters = dd.find_duplicates(args.threshold)
+        for members in clusters:
+            for i, p in enumerate(members):
+                print(f"{'  ' if i else '* '}#{p['person_id']} {p['last_name']} {p['first_name']}\t{p['birthdate'] or '—'}\t{p['gname']}\tстартов {p['starts']}\t{p['score']}")
+        print(f"Кластеров: {len(clusters)}")
+        if args.merge and clusters:
+            print(f"Удалено дублей: {dd.merge([(m[0]['person_id'], [p['person_id'] for p in m[1:]]) for m in clusters])}")
+        return 0
+    if args.cmd == "iof":
+        st = IofImporter(store).import_file(args.path, event_id=args.event_id, create_persons=args.create_persons,
+                                            level=args.level, line=args.line)
+        print(iof_stats_text(st))
+        return 0
+    if args.cmd == "import":
+        if args.path.lower().endswith(".xlsx") and not HAS_XLSX:
+            ap.error("для XLSX установи пакет openpyxl")
+        sources = find_import_sources(args.path)
+        if not sources:
+            ap.error("не найдено файлов/листов coaches, groups, persons, events, results")
+        imp = Importer(store)
+        if args.chunk:
+            if len(sources) != 1 or sources[0][0] != "csv":
+                ap.error("--chunk работает только с одним файлом <таблица>.csv")
+            _, table, path = sources[0]
+            rej = f"{os.path.splitext(path)[0]}_{table}_rejected.csv"
+            cp = None if args.restart else imp.find_checkpoint(table, path)
+            if cp and not cp["done"]:
+                print(f"Продолжение с контрольной точки: обработано строк {cp['row_no']}")
+            st = imp.import_csv_chunked(table, path, chunk=args.chunk, clear=args.clear, resume=not args.restart,
+                                        rejected_path=rej, progress=lambda n: print(f"\rстрок: {n}", end="", flush=True))
+            print()
+            print(import_stats_text({table: st}))
+            if st["rejected"]: print(f"Отклонённые строки: {rej}")
+            return 0
+        stats = imp.import_sources(sources, clear=args.clear, workers=args.workers)
+        print(import_stats_text(stats))
+        base = os.path.join(args.path, "import") if os.path.isdir(args.path) else os.path.splitext(args.path)[0]
+        for table, st in stats.items():
+            if st["rejected"]:
+                imp.write_rejected(table, f"{base}_{table}_rejected.csv")
+                print(f"Отклонённые строки: {base}_{table}_rejected.csv")
+    if args.cmd == "report":
+        if args.kind in ("person", "group") and not args.id:
+            ap.error(f"для отчёта {args.kind} нужен --id")
+        if args.xlsx and not HAS_XLSX:
+            ap.error("для XLSX установи пакет openpyxl")
+        flt = {k: getattr(args, k) for k,_ in FILTER_FIELDS}
+        rep = build_report(ReportBuilder(store), args.kind, flt, args.id)
+        if rep is None:
+            print("Не найдено", file=sys.stderr); return 1
+        if args.csv:  report_to_csv(rep, args.csv)
+        if args.xlsx: report_to_xlsx(rep, args.xlsx)
+        if not (args.csv or args.xlsx): print(report_to_text(rep))
+    return 0
+
 # ------------- run -------------
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(cli(sys.argv[1:]))
     App().mainloop()
 
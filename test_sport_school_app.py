@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+# Проверки на случаи, которые уже ломались: python -m pytest -q (или python -m unittest)
+import csv
+import datetime
+import os
+import tempfile
+import unittest
+
+import sport_school_app as app
+
+PERSON_HEADER = ["person_id", "last_name", "first_name", "birthdate", "address", "phone", "group_id"]
+
+class PersonImportTest(unittest.TestCase):
+    def setUp(self):
+        self.store = app.Store(":memory:")
+        self.importer = app.Importer(self.store)
+
+    def test_reimport_with_changed_row(self):
+        # повторный импорт участников с одной изменённой строкой: триггер person_keys_dirty
+        # внутри INSERT ... ON CONFLICT не должен ронять импорт на UNIQUE
+        rows = [["1", "Иванов", "Иван", "2012-01-01", "", "", ""],
+                ["2", "Петров", "Пётр", "2011-02-02", "", "", ""]]
+        first = self.importer.import_table("persons", PERSON_HEADER, rows)
+        self.assertEqual((first["inserted"], first["updated"]), (2, 0))
+        rows[1][2] = "Павел"
+        second = self.importer.import_table("persons", PERSON_HEADER, rows)
+        self.assertEqual((second["inserted"], second["updated"], second["unchanged"]), (0, 1, 1))
+        self.assertEqual(self.store.get_person(2)["first_name"], "Павел")
+        dirty = [r["person_id"] for r in self.store._fetchall("SELECT person_id FROM person_keys_dirty ORDER BY 1")]
+        self.assertEqual(dirty, [1, 2])
+
+class ChunkedImportTest(unittest.TestCase):
+    def test_resume_after_failed_chunk(self):
+        # вторая часть падает при слиянии и откатывается; повторный вызов продолжает с контрольной точки
+        store = app.Store(":memory:")
+        importer = app.Importer(store)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "persons.csv")
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                w = csv.writer(f, delimiter=';')
+                w.writerow(PERSON_HEADER)
+                w.writerows([str(i), f"Фамилия{i}", "Имя", "", "", "", ""] for i in range(1, 6))
+            merge, calls = importer.merge_staged, []
+            def failing(table):
+                calls.append(table)
+                if len(calls) == 2: raise RuntimeError("сбой на второй части")
+                return merge(table)
+            importer.merge_staged = failing
+            with self.assertRaises(RuntimeError):
+                importer.import_csv_chunked("persons", path, chunk=2)
+            cp = importer.find_checkpoint("persons", path)
+            self.assertEqual((cp["row_no"], cp["inserted"], cp["done"]), (2, 2, 0))
+            self.assertEqual(store._fetchone("SELECT COUNT(*) AS n FROM persons")["n"], 2)
+            importer.merge_staged = merge
+            stats = importer.import_csv_chunked("persons", path, chunk=2)
+            self.assertEqual((stats["rows"], stats["inserted"], stats["updated"]), (5, 5, 0))
+            self.assertEqual(store._fetchone("SELECT COUNT(*) AS n FROM persons")["n"], 5)
+            cp = importer.find_checkpoint("persons", path)
+            self.assertEqual((cp["row_no"], cp["done"]), (5, 1))
+
+class PersonMergeTest(unittest.TestCase):
+    def setUp(self):
+        # дубль участника со стартом в архивном сезоне и стартом, совпадающим со стартом оставляемого
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = app.Store(os.path.join(self.tmp.name, "school.db"))
+        s = self.store
+        self.keep = s.add_person("Иванов", "Иван", None, None, "111", None)
+        self.dup = s.add_person("Иванов", "Иван", "2012-01-01", "ул. Лесная", None, None)
+        old = s.add_event("Осенний кросс", "2020-10-01", "Район", "Спорт", "Туризм", "X", 10)
+        new = s.add_event("Кубок", f"{datetime.date.today().year}-05-01", "Район", "Спорт", "Туризм", "X", 10)
+        s.add_result(old, self.dup, "М12", 2, "", None)
+        s.add_result(new, self.keep, "М12", 1, "", None)
+        s.add_result(new, self.dup, "М12", 1, "", None)
+        s.add_result(new, self.dup, "М14", 3, "", None)
+        s.archive_season(2020)
+
+    def tearDown(self):
+        self.store.conn.close()
+        self.tmp.cleanup()
+
+    def archived(self):
+        s = self.store._attach((2020,))[0]
+        return [r[0] for r in self.store.conn.execute(f"SELECT person_id FROM {s}.results")]
+
+    def test_merge_with_archive(self):
+        self.assertEqual(app.PersonDedup(self.store).merge([(self.keep, [self.dup])]), 1)
+        rows = self.store._fetchall("SELECT person_id, category FROM results ORDER BY category")
+        self.assertEqual([(r["person_id"], r["category"]) for r in rows], [(self.keep, "М12"), (self.keep, "М14")])
+        p = self.store._fetchone("SELECT * FROM persons WHERE person_id=?", (self.keep,))
+        self.assertEqual((p["birthdate"], p["address"], p["phone"]), ("2012-01-01", "ул. Лесная", "111"))
+        self.assertIsNone(self.store._fetchone("SELECT 1 FROM persons WHERE person_id=?", (self.dup,)))
+        self.assertEqual(self.archived(), [self.keep])
+
+    def test_failed_merge_leaves_archive_untouched(self):
+        self.store.conn.execute("""CREATE TEMP TRIGGER fail_merge BEFORE DELETE ON main.persons
+                                   BEGIN SELECT RAISE(ABORT, 'сбой слияния'); END""")
+        with self.assertRaises(app.sqlite3.IntegrityError):
+            app.PersonDedup(self.store).merge([(self.keep, [self.dup])])
+        self.assertEqual(self.archived(), [self.dup])
+        self.assertEqual(self.store._fetchone("SELECT COUNT(*) AS n FROM persons")["n"], 2)
+
+@unittest.skipUnless(app.HAS_NUMPY, "нет numpy")
+class ColumnarParityTest(unittest.TestCase):
+    # отчёты из колоночного снимка NumPy должны совпадать с запросами SQL на той же базе;
+    # «Кубок» — медаль не из MEDALS (в форме можно ввести любой текст), получает код 4
+    MEDALS = ["", "gold", "silver", "bronze", "Кубок"]
+    FILTERS = [{}, {"date_from": "2023-01-01"}, {"level": "Район"},
+               {"sport": "Туризм", "date_to": "2023-12-31"}, {"line": "Образование", "level": "Область"}]
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, "school.db")
+        s = app.Store(path, columnar=False)
+        for c in range(2): s.add_coach(f"Тренер {c}", None)
+        for g in range(3): s.add_group(f"Группа {g}", "Туризм", 1 + g % 2)
+        people = [s.add_person(f"Фамилия{i}", "Имя", None, None, None, 1 + i % 4 if i % 4 < 3 else None) for i in range(12)]
+        n = 0
+        for year in (2022, 2023, 2024):
+            for k, (level, line, sport) in enumerate([("Район", "Спорт", "Туризм"), ("Область", "Образование", "Ориентирование")]):
+                eid = s.add_event(f"Старт {year}-{k}", f"{year}-0{k + 3}-15", level, line, sport, None, None)
+                for pid in people[k::2]:
+                    n += 1
+                    s.add_result(eid, pid, "", n % 6 or None, self.MEDALS[n % len(self.MEDALS)], None)
+        s.conn.close()
+        self.cols, self.sql = app.Store(path, columnar=True), app.Store(path, columnar=False)
+
+    def tearDown(self):
+        for s in (self.cols, self.sql): s.conn.close()
+        self.tmp.cleanup()
+
+    def assertSame(self):
+        for flt in self.FILTERS:
+            with self.subTest(flt=flt):
+                self.assertEqual(self.cols.medals_summary(flt), tuple(self.sql.medals_summary(flt)))
+                by_coach = lambda s: sorted((dict(r) for r in s.medals_by_coach(flt)), key=lambda r: r["coach_id"])
+                self.assertEqual(by_coach(self.cols), by_coach(self.sql))
+                self.assertEqual(self.cols.yearly_dynamics(flt), self.sql.yearly_dynamics(flt))
+                for gid in (1, 2, 3):
+                    self.assertEqual(self.cols.group_summary(gid, flt), self.sql.group_summary(gid, flt))
+
+    def test_snapshot_matches_sql(self):
+        self.assertSame()
+
+    def test_touched_snapshot_matches_sql(self):
+        # запись через Store правит загруженный снимок точечно — итоги по-прежнему как в SQL
+        self.assertSame()
+        eid = self.cols.add_event("Финал", "2024-09-01", "Район", "Спорт", "Туризм", None, None)
+        for pid, medal in zip((1, 2, 3, 4), self.MEDALS):
+            self.cols.add_result(eid, pid, "", pid, medal, None)
+        self.assertSame()
+
+class PersonCardsTest(unittest.TestCase):
+    def test_summaries_match_person_summary(self):
+        # итоги карточек из одного прохода = person_summary, и с медалью не из MEDALS
+        s = app.Store(":memory:")
+        pid = s.add_person("Иванов", "Иван", None, None, None, None)
+        for i, medal in enumerate(["gold", "Кубок", "", "bronze"]):
+            eid = s.add_event(f"Старт {i}", f"2024-0{i + 1}-01", "Район", "Спорт", "Туризм", None, None)
+            s.add_result(eid, pid, "", 5 if medal else 2, medal, None)
+        (person, rows, summ), = s.iter_person_reports({})
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(summ, s.person_summary(pid, {}))
+        self.assertEqual((summ["gold"], summ["bronze"], summ["prize"]), (1, 1, 3))
+
+class ListPageTest(unittest.TestCase):
+    # постраничные списки (keyset): страницы подряд = полный ORDER BY, для каждого столбца в обе стороны;
+    # NULL в ключе (дата рождения, группа, место...), одинаковые значения и поиск без учёта регистра
+    def setUp(self):
+        s = self.store = app.Store(":memory:")
+        s.add_coach("Смирнова", "222"); s.add_coach("Кузнецов", None); s.add_coach("смирнова", None)
+        s.add_group("Старшие", "Туризм", 1); s.add_group("Младшие", "Ориентирование", 2)
+        people = [("Иванов", "Иван", "2012-01-01", 1), ("ИВАНОВА", "Анна", None, None), ("Петров", "Пётр", "2011-05-05", 2),
+                  ("Иванов", "Иван", None, 2), ("Сидоров", "Олег", "2012-01-01", None), ("иванов", "Илья", None, 1),
+                  ("Петров", "Пётр", None, None), ("Орлова", "Мария", "2010-03-03", 1)]
+        ids = [s.add_person(last, first, bd, None, "555" if i % 3 else None, gid) for i, (last, first, bd, gid) in enumerate(people)]
+        events = [s.add_event(f"Кубок Ивана {i % 3}" if i % 2 else f"Первенство {i}", f"2024-0{1 + i % 4}-10", "Район" if i % 2 else "Область", "Спорт",
+                              "Туризм", "Лес" if i % 3 else None, 20 if i % 2 else None) for i in range(7)]
+        for i, pid in enumerate(ids):
+            for eid in events[i % 3::3]:
+                s.add_result(eid, pid, "М12" if i % 2 else "Ж12", (i % 4) or None, app.MEDALS[i % 4], "дисквал." if i == 3 else None)
+
+    def full(self, view, sort, desc, search):
+        v = app.LIST_VIEWS[view]
+        cols, d = v["columns"], "DESC" if desc else "ASC"
+        where, args = "", []
+        if search:
+            where, args = f" WHERE instr(casefold({' || char(31) || '.join(c[0] for c in cols)}), ?) > 0", [search.casefold()]
+        order = ", ".join(f"{k} {d}" for k in cols[sort][1] + (v["pk"],))
+        q = f"SELECT {', '.join(c[0] for c in cols)} FROM {v['from']}{where} ORDER BY {order}"
+        return [list(r) for r in self.store._fetchrows(q, args)]
+
+    def test_pages_match_full_order(self):
+        for view, v in app.LIST_VIEWS.items():
+            for sort in range(len(v["columns"])):
+                for desc in (False, True):
+                    for search in ("", "ИВАН", "СМИРН"):
+                        with self.subTest(view=view, sort=sort, desc=desc, search=search):
+                            pages, starts, more = [], [None], True
+                            while more:
+                                rows, last, more = self.store.list_page(view, sort, desc, starts[-1], 3, search)
+                                pages.append(rows); starts.append(last)
+                            self.assertEqual([r for p in pages for r in p], self.full(view, sort, desc, search))
+                            # назад: каждая страница заново от сохранённого начала (как кнопка «назад» вкладки)
+                            for k in reversed(range(len(pages))):
+                                self.assertEqual(self.store.list_page(view, sort, desc, starts[k], 3, search)[0], pages[k])
+
+class DeltaSyncTest(unittest.TestCase):
+    def test_rows_added_at_two_sites_with_same_id(self):
+        # участники, внесённые на двух установках под одним id, после обмена разностями — оба на месте
+        a, b = app.Store(":memory:"), app.Store(":memory:")
+        for s, last in ((a, "Петров"), (b, "Сидоров")):
+            s.add_event("Кубок", "2024-05-01", "Район", "Спорт", "Туризм", "X", 10)
+            s.add_person(last, "Иван", None, None, None, None)
+            s.add_result(1, 1, "", 1 if s is a else 2, "", None)
+        stats = app.Importer(b).import_delta(a.delta_since(0))
+        self.assertEqual((stats["persons"]["inserted"], stats["persons"]["updated"]), (1, 0))
+        app.Importer(a).import_delta(b.delta_since(0))
+        for s in (a, b):
+            rows = s._fetchall("""SELECT p.last_name, r.place FROM results r JOIN persons p ON p.person_id=r.person_id
+                                  ORDER BY r.place""")
+            self.assertEqual([(r["last_name"], r["place"]) for r in rows], [("Петров", 1), ("Сидоров", 2)])
+
+if __name__ == "__main__":
+    unittest.main()